@@ -0,0 +1,5 @@
+"""
+Benchmarks of the recognizer stages over synthetic scenes.
+Run them from the repository root with `python -m benchmarks` and compare
+two runs with `python -m benchmarks.compare`.
+"""
@@ -0,0 +1,287 @@
+"""
+Times the seed search, the segmentation, the classification and the full
+per-frame processing over synthetic scenes and saves the results as JSON.
+"""
+import argparse
+import datetime
+import itertools
+import json
+import platform
+import subprocess
+import sys
+import time
+
+import cv2
+import numpy as np
+
+from benchmarks.scenes import make_scene
+from core_lib.colors import ColorConfig
+from core_lib.recognition import FrameRecognizer
+from core_lib.region_identifier import identify_region
+from core_lib.seeds import get_seeds
+from core_lib.segmentation import get_pyramid
+from core_lib.segmentation import label_regions
+from core_lib.segmentation import label_regions_tiled
+from core_lib.segmentation import region_expander
+from core_lib.segmentation import region_expander_pyramid
+from core_lib.segmentation import region_expansion_backends
+
+WIDTHS = (320, 450, 1280, 1920)
+SHAPES = ("compact", "long")
+REGION_SIZES = (0.03, 0.08)
+SEED_COUNTS = (2, 8)
+
+
+def get_latency_stats(durations):
+    """
+    Summarizes the durations of the repetitions of a benchmark.
+
+    Arguments:
+        durations {list} -- Seconds taken by each repetition.
+
+    Returns:
+        Dictionary -- Mean and percentile latencies in milliseconds and the
+            frames per second that the mean latency allows.
+    """
+
+    milliseconds = np.array(durations) * 1000
+    mean = float(milliseconds.mean())
+
+    return {
+        "repeats": len(durations),
+        "mean_ms": mean,
+        "p50_ms": float(np.percentile(milliseconds, 50)),
+        "p95_ms": float(np.percentile(milliseconds, 95)),
+        "p99_ms": float(np.percentile(milliseconds, 99)),
+        "fps": 1000 / mean if mean > 0 else float("inf"),
+    }
+
+
+def time_function(function, repeats, warmup):
+    """
+    Runs a function several times and measures each run.
+
+    Arguments:
+        function {function} -- Called without arguments.
+        repeats {integer} -- Measured runs.
+        warmup {integer} -- Runs before the measured ones, to fill caches.
+
+    Returns:
+        Dictionary -- The latency stats, see `get_latency_stats`.
+    """
+
+    for _ in range(warmup):
+        function()
+
+    durations = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        function()
+        durations.append(time.perf_counter() - start)
+
+    return get_latency_stats(durations)
+
+
+def get_metadata():
+    """
+    Describes the code and the machine the benchmarks ran on.
+    """
+
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+
+    return {
+        "commit": commit,
+        "date": datetime.datetime.now().isoformat(),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "opencv": cv2.__version__,
+        "machine": platform.machine(),
+        "processor": platform.processor(),
+    }
+
+
+def run_scene(scene, image, centers, context, args):
+    """
+    Times every stage on a scene.
+
+    Arguments:
+        scene {dictionary} -- The parameters of the scene.
+        image {np.array} -- The BGR frame.
+        centers {list} -- The centers of the figures, used as seeds.
+        context {dictionary} -- The color configuration and training params.
+        args {Namespace} -- The command line arguments.
+
+    Returns:
+        List -- One result per stage and backend.
+    """
+
+    color_config = context["color_config"]
+    training_params = context["training_params"]
+    gray_image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    results = []
+
+    def add_result(stage, function, backend=None):
+        stats = time_function(function, args.repeats, args.warmup)
+        results.append({"stage": stage, "backend": backend, **scene, **stats})
+
+    add_result("seeds", lambda: get_seeds(image, color_config))
+
+    for backend in args.backends:
+        add_result(
+            "segmentation",
+            lambda: region_expander(
+                gray_image, centers, args.intensity_threshold, backend
+            ),
+            backend,
+        )
+
+    # The pyramid is built once per frame, see `Frame.get_pyramid_level`.
+    for levels in args.pyramid_levels:
+        pyramid = get_pyramid(gray_image, levels)
+        for backend in args.backends:
+            add_result(
+                "pyramid{}".format(levels),
+                lambda: region_expander_pyramid(
+                    gray_image,
+                    centers,
+                    args.intensity_threshold,
+                    levels,
+                    backend,
+                    pyramid=pyramid,
+                ),
+                backend,
+            )
+
+    add_result(
+        "labels",
+        lambda: label_regions(gray_image, centers, args.intensity_threshold),
+    )
+
+    for tile_size in args.tile_sizes:
+        add_result(
+            "tiled{}".format(tile_size),
+            lambda: label_regions_tiled(
+                gray_image, centers, args.intensity_threshold, tile_size=tile_size
+            ),
+        )
+
+    _, found_regions = region_expander(
+        gray_image, centers, args.intensity_threshold, args.backends[0]
+    )
+    add_result(
+        "classification", lambda: identify_region(training_params, found_regions)
+    )
+
+    for backend in args.backends:
+        recognizer = FrameRecognizer(
+            training_params, args.intensity_threshold, backend
+        )
+        add_result("frame", lambda: recognizer.process({"image": image}), backend)
+
+    return results
+
+
+def main():
+    """
+    Runs the benchmarks over every combination of scene parameters.
+    """
+
+    parser = argparse.ArgumentParser(prog="python -m benchmarks")
+    parser.add_argument(
+        "-o",
+        "--output",
+        default="benchmark_results.json",
+        help="The JSON file the results are written to",
+    )
+    parser.add_argument(
+        "-n", "--repeats", type=int, default=30, help="Measured runs per benchmark"
+    )
+    parser.add_argument(
+        "--warmup", type=int, default=3, help="Unmeasured runs before measuring"
+    )
+    parser.add_argument(
+        "-b",
+        "--backends",
+        nargs="+",
+        default=["scanline", "opencv"],
+        choices=sorted(region_expansion_backends.keys()),
+        help="The region growing backends to time, the reference one is slow "
+        "on large frames",
+    )
+    parser.add_argument("--widths", type=int, nargs="+", default=list(WIDTHS))
+    parser.add_argument("--shapes", nargs="+", default=list(SHAPES), choices=SHAPES)
+    parser.add_argument(
+        "--region-sizes",
+        type=float,
+        nargs="+",
+        default=list(REGION_SIZES),
+        help="Radius of the figures over the frame width",
+    )
+    parser.add_argument(
+        "--seed-counts", type=int, nargs="+", default=list(SEED_COUNTS)
+    )
+    parser.add_argument(
+        "--pyramid-levels",
+        type=int,
+        nargs="*",
+        default=[1, 2],
+        help="Also time the coarse to fine segmentation with these levels",
+    )
+    parser.add_argument(
+        "--tile-sizes",
+        type=int,
+        nargs="*",
+        default=[256],
+        help="Also time the tiled segmentation with these tile sizes",
+    )
+    parser.add_argument("-i", "--intensity-threshold", type=int, default=30)
+    parser.add_argument(
+        "--training-params",
+        default="train_parameters.txt",
+        help="The training parameters used by the classification",
+    )
+    args = parser.parse_args()
+
+    with open(args.training_params) as json_file:
+        training_params = json.load(json_file)
+
+    color_config = ColorConfig()
+    context = {"color_config": color_config, "training_params": training_params}
+
+    results = []
+    combinations = itertools.product(
+        args.widths, args.shapes, args.region_sizes, args.seed_counts
+    )
+    for width, shape, region_size, seed_count in combinations:
+        scene = {
+            "width": width,
+            "shape": shape,
+            "region_size": region_size,
+            "seed_count": seed_count,
+        }
+        image, centers = make_scene(
+            width, shape, region_size, seed_count, color_config.colors, color_config.lut
+        )
+
+        scene_results = run_scene(scene, image, centers, context, args)
+
+        for result in scene_results:
+            print(
+                "{width:>5} {shape:<8} {region_size:<5} {seed_count:>2} "
+                "{stage:<15} {backend!s:<9} p50 {p50_ms:8.2f} ms  "
+                "p99 {p99_ms:8.2f} ms  {fps:9.1f} fps".format(**result),
+                file=sys.stderr,
+            )
+        results.extend(scene_results)
+
+    with open(args.output, "w") as output:
+        json.dump({"metadata": get_metadata(), "results": results}, output, indent=4)
+
+
+if __name__ == "__main__":
+    main()
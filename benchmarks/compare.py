@@ -0,0 +1,58 @@
+"""
+Compares two benchmark result files, for example from two commits.
+Usage: python -m benchmarks.compare baseline.json candidate.json
+"""
+import argparse
+import json
+
+# Fields that identify a benchmark within a result file.
+KEY_FIELDS = ("width", "shape", "region_size", "seed_count", "stage", "backend")
+
+
+def read_results(path):
+    """
+    Reads a result file indexed by the fields that identify each benchmark.
+    """
+
+    with open(path) as json_file:
+        results = json.load(json_file)["results"]
+
+    return {
+        tuple(result[field] for field in KEY_FIELDS): result for result in results
+    }
+
+
+def main():
+    """
+    Prints the p50 and p99 latencies of the benchmarks present in both files
+    and how many times faster the candidate is.
+    """
+
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.compare")
+    parser.add_argument("baseline", help="The reference result file")
+    parser.add_argument("candidate", help="The result file to compare")
+    args = parser.parse_args()
+
+    baseline = read_results(args.baseline)
+    candidate = read_results(args.candidate)
+
+    for key in baseline.keys():
+        if key not in candidate:
+            continue
+        old = baseline[key]
+        new = candidate[key]
+        print(
+            "{:>5} {:<8} {:<5} {:>2} {:<15} {!s:<9} "
+            "p50 {:8.2f} -> {:8.2f} ms  p99 {:8.2f} -> {:8.2f} ms  x{:.2f}".format(
+                *key,
+                old["p50_ms"],
+                new["p50_ms"],
+                old["p99_ms"],
+                new["p99_ms"],
+                old["p50_ms"] / new["p50_ms"] if new["p50_ms"] else float("inf"),
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
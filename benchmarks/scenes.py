@@ -0,0 +1,130 @@
+"""
+Generates synthetic BGR frames with figures painted in the calibrated
+colors, so the seed search and the segmentation find them like in a real
+frame without needing a camera.
+"""
+import math
+
+import cv2
+import numpy as np
+
+from core_lib.colors import NO_COLOR
+from core_lib.colors import classify_pixels
+from core_lib.colors import get_color_list
+
+# Range of the light gray background, far from the calibrated colors.
+BACKGROUND_RANGE = (190, 230)
+
+# Background value used for the pixels that match a color by chance.
+BACKGROUND_FILL = 210
+
+# Maximum per-channel noise added to the figures.
+FIGURE_NOISE = 4
+
+# Frame height over frame width.
+ASPECT_RATIO = 3 / 4
+
+
+def get_figure_centers(width, height, count):
+    """
+    Places the figures on the cells of a grid that covers the frame.
+
+    Arguments:
+        width {integer} -- The width of the frame.
+        height {integer} -- The height of the frame.
+        count {integer} -- The number of figures.
+
+    Returns:
+        Tuple -- Contains:
+            centers: The (x, y) center of each figure.
+            cell_size: The (width, height) of each cell.
+    """
+
+    columns = math.ceil(math.sqrt(count))
+    rows = math.ceil(count / columns)
+    cell_width = width / columns
+    cell_height = height / rows
+
+    centers = [
+        (
+            int((index % columns + 0.5) * cell_width),
+            int((index // columns + 0.5) * cell_height),
+        )
+        for index in range(count)
+    ]
+
+    return centers, (cell_width, cell_height)
+
+
+def draw_figure(image, center, shape, radius, angle, color):
+    """
+    Paints a filled figure.
+
+    Arguments:
+        image {np.array} -- The BGR frame, updated in place.
+        center {tuple} -- The (x, y) center of the figure.
+        shape {string} -- "compact" for a disc, "long" for a thin ellipse
+            with the same area.
+        radius {number} -- The radius of the disc.
+        angle {number} -- The orientation of long figures in degrees.
+        color {list} -- The BGR color.
+    """
+
+    if shape == "compact":
+        axes = (round(radius), round(radius))
+    elif shape == "long":
+        axes = (round(radius * 3), max(1, round(radius / 3)))
+    else:
+        raise ValueError("FAILURE: unknown figure shape {}".format(shape))
+
+    cv2.ellipse(image, center, axes, angle, 0, 360, color, -1)
+
+
+def make_scene(width, shape, region_size, seed_count, colors, lut, rng_seed=0):
+    """
+    Generates a frame with seed_count figures on a noisy background. The
+    figures alternate between COLOR_1 and COLOR_2.
+
+    Arguments:
+        width {integer} -- The width of the frame, the height keeps ASPECT_RATIO.
+        shape {string} -- "compact" or "long", see `draw_figure`.
+        region_size {number} -- The radius of the figures over the frame width.
+        seed_count {integer} -- The number of figures.
+        colors {dictionary} -- The contents of colors.json.
+        lut {np.array} -- The color lookup table, used to keep the background
+            from matching the colors.
+        rng_seed {integer} -- Makes the noise reproducible.
+
+    Returns:
+        Tuple -- Contains:
+            image: The BGR frame.
+            centers: The (x, y) center of each figure, usable as seeds.
+    """
+
+    rng = np.random.default_rng(rng_seed)
+    height = int(width * ASPECT_RATIO)
+
+    image = rng.integers(
+        BACKGROUND_RANGE[0], BACKGROUND_RANGE[1], (height, width, 3), np.uint8
+    )
+    image[classify_pixels(lut, image) != NO_COLOR] = BACKGROUND_FILL
+
+    color_list = get_color_list(colors)[:2]
+    centers, cell_size = get_figure_centers(width, height, seed_count)
+    # Keep the figures inside their cell.
+    radius = min(region_size * width, min(cell_size) / 2 - 1)
+    if shape == "long":
+        radius = min(radius, min(cell_size) / 6 - 1)
+
+    figures = np.zeros((height, width), np.uint8)
+    for index, center in enumerate(centers):
+        angle = rng.uniform(0, 180)
+        color = color_list[index % len(color_list)]
+        draw_figure(image, center, shape, radius, angle, color)
+        draw_figure(figures, center, shape, radius, angle, 255)
+
+    noise = rng.integers(-FIGURE_NOISE, FIGURE_NOISE + 1, image.shape)
+    noisy = np.clip(image.astype(np.int16) + noise, 0, 255).astype(np.uint8)
+    image[figures > 0] = noisy[figures > 0]
+
+    return image, centers
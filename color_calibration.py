@@ -1,9 +1,13 @@
 """
 This program calibrates color of an object in livefeed.
 """
+import argparse
 import cv2
 import json
-from core_lib.video_feed import VideoFeed
+from core_lib.colors import COLOR_TOLERANCE
+from core_lib.colors import build_color_lut
+from core_lib.colors import save_color_lut
+from core_lib.video_feed import open_feed
 
 image = None
 new_color_samples = [[], [], []]
@@ -75,6 +79,33 @@ def main():
     global image
     global new_color_samples
 
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "-t",
+        "--tolerance",
+        default=COLOR_TOLERANCE,
+        help="The maximum distance from a calibrated color for a pixel to match it",
+    )
+    parser.add_argument(
+        "-b",
+        "--lut-bits",
+        default=8,
+        help="Bits per channel of the color lookup table, 8 keeps full resolution",
+    )
+    parser.add_argument(
+        "-s",
+        "--shape",
+        default="box",
+        choices=["box", "sphere"],
+        help="Shape of the tolerance around each calibrated color",
+    )
+    parser.add_argument(
+        "--source",
+        default="0",
+        help="Camera index, recorded session, video file or images to calibrate on",
+    )
+    args = parser.parse_args()
+
     colors = {}
     new_color = []
 
@@ -86,12 +117,17 @@ def main():
     print("Press 'n' to calibrate new color")
     print("Press 'q' to finish calibration")
 
-    with VideoFeed(camera_index=0, width=450) as feed:
+    with open_feed(args.source, width=450) as feed:
         while True:
-            success, image = feed.read()
-
-            if not success:
-                continue
+            # Keep showing the last frame when a recording ends.
+            success, frame = feed.read()
+            if success:
+                image = frame
+            elif image is None:
+                # Nothing to show or sample, waiting would spin forever.
+                raise ValueError(
+                    "FAILURE: no frame could be read from " + str(args.source)
+                )
 
             cv2.imshow("Color calibration", image)
 
@@ -117,6 +153,11 @@ def main():
                 # Dump calibrated colors to JSON.
                 with open("colors.json", "w") as write_file:
                     json.dump(colors, write_file)
+                # Compile the colors for the seed search.
+                lut = build_color_lut(
+                    colors, int(args.tolerance), int(args.lut_bits), args.shape
+                )
+                save_color_lut(lut, colors)
                 break
 
     cv2.destroyAllWindows()
@@ -0,0 +1,318 @@
+"""
+Color classification shared by the color calibration and the seed search.
+The calibrated colors are compiled into a lookup table indexed by the
+quantized B, G and R values of a pixel, so classifying a pixel costs a
+single lookup no matter how many colors are calibrated.
+"""
+import json
+import math
+import os
+import time
+
+import numpy as np
+
+# Calibrated colors file, written by the color calibration.
+COLORS_FILE = "colors.json"
+
+# Default maximum per-channel difference for a pixel to match a color.
+COLOR_TOLERANCE = 20
+
+# Lookup table file, saved next to colors.json.
+LUT_FILE = "colors_lut.npz"
+
+# Value of the pixels that don't match any calibrated color.
+NO_COLOR = 0
+
+# Marks the lookup tables that hold one bit per color, see `build_color_lut`.
+LUT_ENCODING = "bits"
+
+# Integer types of the lookup table by the number of colors they fit.
+LUT_DTYPES = ((8, np.uint8), (16, np.uint16), (32, np.uint32))
+
+
+def get_color_list(colors):
+    """
+    Gets the calibrated colors ordered by their class.
+
+    Arguments:
+        colors {dictionary} -- The contents of colors.json, the keys must
+            be named COLOR_1, COLOR_2, ... and the values be in BGR order.
+
+    Returns:
+        List -- The colors, COLOR_k is in the position k - 1.
+    """
+
+    names = sorted(
+        (name for name in colors.keys() if name.startswith("COLOR_")),
+        key=lambda name: int(name[len("COLOR_") :]),
+    )
+
+    return [colors[name] for name in names]
+
+
+def get_color_bit(color_class):
+    """
+    Gets the bit of a color in the lookup table values: 1 << (k - 1) for
+    COLOR_k.
+    """
+
+    return 1 << (color_class - 1)
+
+
+def has_color(classes, color_class):
+    """
+    Gets which pixels match a color.
+
+    Arguments:
+        classes {np.array} -- Values of the lookup table, see `classify_pixels`.
+        color_class {integer} -- k for COLOR_k.
+
+    Returns:
+        np.array -- Boolean mask, the shape of classes.
+    """
+
+    return (classes & get_color_bit(color_class)) != 0
+
+
+def build_color_lut(colors, tolerance=COLOR_TOLERANCE, bits=8, shape="box"):
+    """
+    Compiles the calibrated colors into a lookup table.
+    Each cell of the table corresponds to a quantized BGR value and contains
+    one bit per color that matches it, see `get_color_bit`, so a pixel
+    within the tolerance of several colors keeps all of them, like the
+    per-color comparisons it replaces. NO_COLOR if no color matches.
+
+    Arguments:
+        colors {dictionary} -- The contents of colors.json.
+        tolerance {number} -- The maximum distance from a calibrated color.
+        bits {integer} -- Bits kept per channel, 8 keeps the full resolution
+            (256x256x256 table), 5 gives a 32x32x32 table.
+        shape {string} -- "box" to compare each channel independently or
+            "sphere" to use the euclidean distance.
+
+    Returns:
+        np.array -- The lookup table, with one axis per channel, uint8 for up
+            to 8 colors and wider for more.
+    """
+
+    color_list = get_color_list(colors)
+
+    if not 1 <= bits <= 8:
+        raise ValueError("FAILURE: lookup table bits must be between 1 and 8")
+    dtypes = [dtype for count, dtype in LUT_DTYPES if len(color_list) <= count]
+    if not dtypes:
+        raise ValueError("FAILURE: too many colors for the lookup table")
+
+    shift = 8 - bits
+    size = 1 << bits
+
+    # Compare the center of each cell against the colors.
+    centers = (np.arange(size, dtype=np.int32) << shift) + ((1 << shift) // 2)
+
+    lut = np.full((size, size, size), NO_COLOR, dtypes[0])
+
+    for color_class in range(1, len(color_list) + 1):
+        b, g, r = (
+            np.abs(centers - channel) for channel in color_list[color_class - 1]
+        )
+
+        if shape == "box":
+            inside = (
+                (b <= tolerance)[:, None, None]
+                & (g <= tolerance)[None, :, None]
+                & (r <= tolerance)[None, None, :]
+            )
+        elif shape == "sphere":
+            inside = (
+                (b ** 2)[:, None, None]
+                + (g ** 2)[None, :, None]
+                + (r ** 2)[None, None, :]
+            ) <= tolerance ** 2
+        else:
+            raise ValueError("FAILURE: unknown tolerance shape {}".format(shape))
+
+        lut[inside] |= get_color_bit(color_class)
+
+    return lut
+
+
+def save_color_lut(lut, colors, path=LUT_FILE):
+    """
+    Saves a lookup table along with the colors it was compiled from.
+
+    Arguments:
+        lut {np.array} -- The lookup table.
+        colors {dictionary} -- The colors used to compile the table.
+        path {string} -- Destination file.
+    """
+
+    np.savez_compressed(
+        path,
+        lut=lut,
+        colors=np.array(get_color_list(colors)),
+        encoding=np.array(LUT_ENCODING),
+    )
+
+
+def load_color_lut(colors, path=LUT_FILE):
+    """
+    Loads a lookup table if it was compiled from the given colors.
+
+    Arguments:
+        colors {dictionary} -- The colors the table must correspond to.
+        path {string} -- The lookup table file.
+
+    Returns:
+        np.array -- The lookup table, None if the file doesn't exist, was
+            compiled from different colors or holds one class per cell (the
+            previous format).
+    """
+
+    try:
+        with np.load(path) as data:
+            lut = data["lut"]
+            lut_colors = data["colors"]
+            encoding = str(data["encoding"])
+    except (OSError, KeyError, ValueError):
+        return None
+
+    if encoding != LUT_ENCODING:
+        return None
+
+    if not np.array_equal(lut_colors, np.array(get_color_list(colors))):
+        return None
+
+    return lut
+
+
+def classify_pixels(lut, pixels):
+    """
+    Gets the colors of a pixel, a row or a full image, one bit per color,
+    see `has_color`.
+
+    Arguments:
+        lut {np.array} -- The lookup table.
+        pixels {np.array} -- BGR uint8 pixels, the last axis must be the channels.
+
+    Returns:
+        np.array -- The value of each pixel, shape of pixels without the channels.
+    """
+
+    shift = 8 - (len(lut) - 1).bit_length()
+
+    if shift:
+        pixels = pixels >> shift
+
+    return lut[pixels[..., 0], pixels[..., 1], pixels[..., 2]]
+
+
+class ColorConfig:
+    """
+    Calibrated colors and their lookup table, loaded once and reloaded only
+    when colors.json or the lookup table file change on disk. This allows
+    running the color calibration while the recognizer is live.
+    When a reload fails (for example, the file is being written) the previous
+    colors are kept and the reload is retried on the next check.
+
+    Parameters:
+        path {string} -- The colors file. Defaults to colors.json.
+        lut_path {string} -- The lookup table file. When it doesn't match the
+            colors a table with the default tolerance is compiled.
+        required_colors {tuple} -- Names of the colors that must be defined.
+        check_interval {number} -- Minimum seconds between checks of the
+            files modification times. Defaults to 1.
+    """
+
+    def __init__(
+        self,
+        path=COLORS_FILE,
+        lut_path=LUT_FILE,
+        required_colors=("COLOR_1", "COLOR_2"),
+        check_interval=1.0,
+    ):
+        self.path = path
+        self.lut_path = lut_path
+        self.required_colors = required_colors
+        self.check_interval = check_interval
+
+        self.colors = None
+        self.lut = None
+        self.mtimes = None
+        self.last_check = -math.inf
+
+        self.refresh(force=True)
+
+    def get_mtimes(self):
+        """
+        Gets the modification times of the colors and lookup table files,
+        None for the files that don't exist.
+        """
+
+        mtimes = []
+        for path in (self.path, self.lut_path):
+            try:
+                mtimes.append(os.stat(path).st_mtime_ns)
+            except OSError:
+                mtimes.append(None)
+        return tuple(mtimes)
+
+    def load(self):
+        """
+        Reads and validates the colors file and gets its lookup table.
+        """
+
+        try:
+            with open(self.path) as json_file:
+                colors = json.load(json_file)
+        except:
+            raise Exception(
+                "FAILURE: no colors.json configuration file, calibrate first"
+            )
+
+        for name in self.required_colors:
+            if name not in colors.keys():
+                raise Exception("FAILURE: configuration file is missing " + name)
+
+        lut = load_color_lut(colors, self.lut_path)
+
+        self.colors = colors
+        self.lut = lut if lut is not None else build_color_lut(colors)
+
+    def refresh(self, force=False):
+        """
+        Reloads the configuration if the files changed since the last load.
+        Only looks at the files every check_interval seconds unless forced.
+
+        Arguments:
+            force {boolean} -- Check the files regardless of the interval.
+        """
+
+        now = time.monotonic()
+        if not force and now - self.last_check < self.check_interval:
+            return
+        self.last_check = now
+
+        mtimes = self.get_mtimes()
+        if mtimes == self.mtimes:
+            return
+
+        try:
+            self.load()
+        except Exception:
+            # Keep using the previous colors if there are any.
+            if self.colors is None:
+                raise
+            return
+
+        self.mtimes = mtimes
+
+    def get_lut(self):
+        """
+        Gets the current lookup table, reloading the configuration if needed.
+
+        Returns:
+            np.array -- The lookup table.
+        """
+
+        self.refresh()
+        return self.lut
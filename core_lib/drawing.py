@@ -2,15 +2,45 @@
 Util drawing functions.
 """
 import math
+import time
 import cv2
 import numpy as np
-import matplotlib.cm as cm
-import matplotlib.pyplot as plt
 
 from core_lib.core import Figure
 
-training_dataset = None
+# Plot shown by `draw_training_space`, created on first use.
+training_space_plot = None
 
+# UI shown by `draw_results_ui`, created on first use.
+results_ui = None
+
+
+class RateLimiter:
+    """
+    Lets an action run at most once every interval seconds.
+
+    Parameters:
+        interval {number} -- Minimum seconds between runs, 0 doesn't limit.
+    """
+
+    def __init__(self, interval):
+        self.interval = interval
+        self.last_run = -math.inf
+
+    def ready(self, force=False):
+        """
+        Checks whether the action can run now, and if so counts it as run.
+
+        Arguments:
+            force {boolean} -- Run regardless of the interval.
+        """
+
+        now = time.monotonic()
+        if not force and now - self.last_run < self.interval:
+            return False
+
+        self.last_run = now
+        return True
 
 
 def draw_diameter(image, center, angle, radius):
@@ -93,81 +123,240 @@ def draw_filled_semicircle_from_figures(image, figures_list, center, radius):
     )
 
 
-def draw_training_space(training_params, found_regions):
-    global training_dataset
+class TrainingSpacePlot:
+    """
+    Scatter plot of the phi_1 and phi_2 of the trained samples, one color per
+    figure, along with the regions of the current frame in magenta.
+    The trained samples are rendered once into a cached image with the axes
+    scaled to them, each update copies it and only draws the live regions,
+    which are clamped to the borders when they fall outside.
+
+    Parameters:
+        training_params {list} -- The contents of train_parameters.txt.
+        update_interval {number} -- Minimum seconds between updates of the
+            window, updates in between are skipped. Defaults to 0.
+        size {integer} -- Width and height of the plot in pixels.
+    """
 
-    if not training_dataset:
-        training_dataset = []
-        for training_object in training_params:
-            x = []
-            y = []
+    window_name = "Training space"
+    margin = 40
+    # Blue, green, red and cyan, like the matplotlib plot had.
+    figure_colors = [(255, 0, 0), (0, 128, 0), (0, 0, 255), (191, 191, 0)]
+    region_color = (191, 0, 191)
+
+    def __init__(self, training_params, update_interval=0, size=400):
+        self.training_params = training_params
+        self.rate_limiter = RateLimiter(update_interval)
+        self.size = size
+
+        points = [
+            (point["phi_1"], point["phi_2"])
+            for training_object in training_params
+            for point in training_object["points"]
+        ]
+        if points:
+            low = np.min(points, axis=0)
+            high = np.max(points, axis=0)
+        else:
+            low = np.zeros(2)
+            high = np.ones(2)
+        padding = np.maximum((high - low) * 0.1, 1e-6)
+        self.low = low - padding
+        self.high = high + padding
+
+        self.background = self.render_background()
+
+    def to_pixels(self, phi_1, phi_2):
+        """
+        Gets the pixel of a point of the plot, clamped to the plot area.
+        """
+
+        plot_size = self.size - 2 * self.margin
+        x, y = (np.array([phi_1, phi_2]) - self.low) / (self.high - self.low)
+        x = self.margin + int(round(min(max(x, 0), 1) * plot_size))
+        y = self.size - self.margin - int(round(min(max(y, 0), 1) * plot_size))
+
+        return x, y
+
+    def render_background(self):
+        """
+        Draws the axes and the trained samples.
+        """
+
+        image = np.full((self.size, self.size, 3), 255, np.uint8)
+        far = self.size - self.margin
+        cv2.rectangle(image, (self.margin, self.margin), (far, far), (0, 0, 0), 1)
+
+        font = cv2.FONT_HERSHEY_SIMPLEX
+        black = (0, 0, 0)
+        labels = [
+            ("{:.2f}".format(self.low[0]), (self.margin, far + 15)),
+            ("{:.2f}".format(self.high[0]), (far - 30, far + 15)),
+            ("phi_1", (self.size // 2 - 15, far + 30)),
+            ("{:.2f}".format(self.low[1]), (2, far)),
+            ("{:.2f}".format(self.high[1]), (2, self.margin + 10)),
+            ("phi_2", (2, self.size // 2)),
+        ]
+        for text, position in labels:
+            cv2.putText(image, text, position, font, 0.4, black, 1, cv2.LINE_AA)
+
+        for index, training_object in enumerate(self.training_params):
+            color = self.figure_colors[index % len(self.figure_colors)]
             for point in training_object["points"]:
-                x.append(point["phi_1"])
-                y.append(point["phi_2"])
-            training_dataset.append((x, y))
-        plt.scatter([], [])
-        plt.show(False)
+                center = self.to_pixels(point["phi_1"], point["phi_2"])
+                cv2.circle(image, center, 3, color, cv2.FILLED, cv2.LINE_AA)
 
-    colors = ["b", "g", "r", "c", "m"]
+        return image
 
-    plt.cla()
-    for i, dataset in enumerate(training_dataset):
-        x, y = dataset
-        plt.scatter(x, y, color=colors[i])
+    def draw(self, found_regions):
+        """
+        Gets the plot with the given regions.
 
-    for region in found_regions:
-        plt.scatter([region["phi_1"]], [region["phi_2"]], color=colors[-1])
+        Arguments:
+            found_regions {list} -- The characteristics of the regions.
 
-    plt.draw()
+        Returns:
+            np.array -- The BGR plot.
+        """
 
+        image = self.background.copy()
+        for region in found_regions:
+            center = self.to_pixels(region["phi_1"], region["phi_2"])
+            cv2.circle(image, center, 4, self.region_color, cv2.FILLED, cv2.LINE_AA)
 
-def draw_results_ui(detected_figures):
+        return image
+
+    def update(self, found_regions, force=False):
+        """
+        Shows the plot with the given regions, unless the window was updated
+        less than update_interval seconds ago.
+
+        Arguments:
+            found_regions {list} -- The characteristics of the regions.
+            force {boolean} -- Update regardless of the interval.
+        """
+
+        if not self.rate_limiter.ready(force):
+            return
+
+        cv2.imshow(self.window_name, self.draw(found_regions))
+
+
+def draw_training_space(training_params, found_regions):
+    """
+    Shows the trained samples and the given regions in the phi_1, phi_2 plane.
+    The plot is cached for the last training params given, see
+    `TrainingSpacePlot`.
     """
-    Draws the appropriate UI to represent the detected figures.
 
-    Arguments:
-        detected_figures { list } --- Each element is a tuple that
-            contains a `Figure` and its angle.
+    global training_space_plot
+
+    if (
+        training_space_plot is None
+        or training_space_plot.training_params is not training_params
+    ):
+        training_space_plot = TrainingSpacePlot(training_params)
+
+    training_space_plot.update(found_regions)
+
+
+class ResultsUI:
+    """
+    Represents the detected figures: the quadrant of the compact and long
+    figures found and the orientation of the long one.
+    The circle, axes and labels are drawn once into a template, each frame
+    copies it and only draws the quadrant and the orientation.
     """
 
-    figures_list = []
-    angle = None
-    result_circle_radius = 80
+    window_name = "Results UI"
+    radius = 80
 
-    for figure, figure_angle in detected_figures:
-        figures_list.append(figure)
-        if figure_angle:
-            angle = figure_angle
+    def __init__(self):
+        self.template = self.render_template()
+        self.window_created = False
 
-    # Make sure the window for the results exists.
-    cv2.namedWindow("Results UI")
+    def render_template(self):
+        """
+        Draws the static part of the UI.
+        """
 
-    results_image = np.zeros((300, 300, 3), np.uint8)
+        template = np.zeros((300, 300, 3), np.uint8)
 
-    # Draw main UI.
-    cv2.circle(results_image, (150, 150), result_circle_radius, (255, 255, 255), 2)
-    cv2.line(results_image, (150, 50), (150, 250), (255, 255, 255), 2)
-    cv2.line(results_image, (50, 150), (250, 150), (255, 255, 255), 2)
+        cv2.circle(template, (150, 150), self.radius, (255, 255, 255), 2)
+        cv2.line(template, (150, 50), (150, 250), (255, 255, 255), 2)
+        cv2.line(template, (50, 150), (250, 150), (255, 255, 255), 2)
 
-    cv2.putText(
-        results_image, "L1", (5, 160), cv2.FONT_HERSHEY_COMPLEX, 1, (255, 255, 255)
-    )
-    cv2.putText(
-        results_image, "L2", (260, 160), cv2.FONT_HERSHEY_COMPLEX, 1, (255, 255, 255)
-    )
-    cv2.putText(
-        results_image, "C1", (130, 30), cv2.FONT_HERSHEY_COMPLEX, 1, (255, 255, 255)
-    )
-    cv2.putText(
-        results_image, "C2", (130, 284), cv2.FONT_HERSHEY_COMPLEX, 1, (255, 255, 255)
-    )
+        cv2.putText(
+            template, "L1", (5, 160), cv2.FONT_HERSHEY_COMPLEX, 1, (255, 255, 255)
+        )
+        cv2.putText(
+            template, "L2", (260, 160), cv2.FONT_HERSHEY_COMPLEX, 1, (255, 255, 255)
+        )
+        cv2.putText(
+            template, "C1", (130, 30), cv2.FONT_HERSHEY_COMPLEX, 1, (255, 255, 255)
+        )
+        cv2.putText(
+            template, "C2", (130, 284), cv2.FONT_HERSHEY_COMPLEX, 1, (255, 255, 255)
+        )
 
-    draw_filled_semicircle_from_figures(
-        results_image, figures_list, (150, 150), result_circle_radius
-    )
+        return template
+
+    def draw(self, detected_figures):
+        """
+        Gets the UI for the detected figures.
+
+        Arguments:
+            detected_figures { list } --- Each element is a tuple that
+                contains a `Figure` and its angle.
+
+        Returns:
+            np.array -- The BGR image of the UI.
+        """
+
+        figures_list = []
+        angle = None
+
+        for figure, figure_angle in detected_figures:
+            figures_list.append(figure)
+            if figure_angle:
+                angle = figure_angle
+
+        results_image = self.template.copy()
+
+        draw_filled_semicircle_from_figures(
+            results_image, figures_list, (150, 150), self.radius
+        )
+
+        if angle:
+            # Draw the orientation of the long figure if found
+            draw_diameter(results_image, (150, 150), angle, 100)
+
+        return results_image
+
+    def show(self, detected_figures):
+        """
+        Shows the UI for the detected figures in its window.
+        """
+
+        if not self.window_created:
+            cv2.namedWindow(self.window_name)
+            self.window_created = True
+
+        cv2.imshow(self.window_name, self.draw(detected_figures))
+
+
+def draw_results_ui(detected_figures):
+    """
+    Draws the appropriate UI to represent the detected figures.
+
+    Arguments:
+        detected_figures { list } --- Each element is a tuple that
+            contains a `Figure` and its angle.
+    """
+
+    global results_ui
 
-    if angle:
-        # Draw the orientation of the long figure if found
-        draw_diameter(results_image, (150, 150), angle, 100)
+    if results_ui is None:
+        results_ui = ResultsUI()
 
-    cv2.imshow("Results UI", results_image)
+    results_ui.show(detected_figures)
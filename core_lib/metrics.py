@@ -0,0 +1,331 @@
+"""
+Exports the Metrics class which keeps the latency of each processing stage
+and event counters, and the shared `metrics` object that the recognizer and
+the core_lib functions report to.
+The hooks (`Metrics.timer`, `Metrics.timed` and `Metrics.increment`) barely
+cost anything while the metrics are disabled, which is the default.
+"""
+import contextlib
+import csv
+import functools
+import json
+import os
+import threading
+import time
+from collections import deque
+
+import numpy as np
+
+# Latencies kept per stage to compute the percentiles.
+WINDOW_SIZE = 1000
+
+# Percentiles reported for every stage.
+QUANTILES = (0.5, 0.95, 0.99)
+
+# Prefix of the names of the Prometheus metrics.
+METRIC_PREFIX = "recognizer"
+
+# Returned by `Metrics.timer` while disabled.
+NULL_TIMER = contextlib.nullcontext()
+
+
+class StageTimer:
+    """
+    Context manager that records how long its block takes.
+    """
+
+    def __init__(self, metrics, stage):
+        self.metrics = metrics
+        self.stage = stage
+        self.start = None
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, type, value, tb):
+        self.metrics.record(self.stage, time.perf_counter() - self.start)
+
+
+class Metrics:
+    """
+    Latencies of the processing stages, over a rolling window, and event
+    counters such as frames processed or dropped. Once configured, a
+    summary is periodically appended to a log file (CSV or JSON lines,
+    depending on its extension) and written to a Prometheus text-format
+    file, for example for the node exporter textfile collector.
+
+    Parameters:
+        enabled {boolean} -- Whether the hooks record anything.
+            Defaults to False.
+        window_size {integer} -- Latencies kept per stage. Defaults to
+            WINDOW_SIZE.
+    """
+
+    def __init__(self, enabled=False, window_size=WINDOW_SIZE):
+        self.enabled = enabled
+        self.window_size = window_size
+
+        self.lock = threading.Lock()
+        self.latencies = {}
+        self.totals = {}
+        self.counters = {}
+
+        self.report_interval = None
+        self.log_path = None
+        self.prometheus_path = None
+        self.last_report = time.monotonic()
+
+    def configure(
+        self, enabled=True, report_interval=10.0, log_path=None, prometheus_path=None
+    ):
+        """
+        Enables or disables the metrics and sets where they are reported.
+
+        Arguments:
+            enabled {boolean} -- Whether the hooks record anything.
+            report_interval {number} -- Minimum seconds between reports.
+            log_path {string} -- File the summaries are appended to, CSV if
+                it ends with .csv, JSON lines otherwise. None to skip.
+            prometheus_path {string} -- File rewritten with the current
+                values in Prometheus text format. None to skip.
+        """
+
+        self.enabled = enabled
+        self.report_interval = report_interval
+        self.log_path = log_path
+        self.prometheus_path = prometheus_path
+        self.last_report = time.monotonic()
+
+    def timer(self, stage):
+        """
+        Gets a context manager that records how long its block takes.
+
+        Arguments:
+            stage {string} -- The name of the timed stage.
+
+        Returns:
+            Context manager -- Does nothing while disabled.
+        """
+
+        if not self.enabled:
+            return NULL_TIMER
+
+        return StageTimer(self, stage)
+
+    def timed(self, stage):
+        """
+        Decorator that records how long each call of a function takes.
+
+        Arguments:
+            stage {string} -- The name of the timed stage.
+        """
+
+        def decorator(function):
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return function(*args, **kwargs)
+
+                with StageTimer(self, stage):
+                    return function(*args, **kwargs)
+
+            return wrapper
+
+        return decorator
+
+    def record(self, stage, seconds):
+        """
+        Adds a latency sample to a stage, only while enabled.
+        """
+
+        if not self.enabled:
+            return
+
+        with self.lock:
+            if stage not in self.latencies:
+                self.latencies[stage] = deque(maxlen=self.window_size)
+                self.totals[stage] = [0, 0.0]
+            self.latencies[stage].append(seconds)
+            self.totals[stage][0] += 1
+            self.totals[stage][1] += seconds
+
+    def increment(self, counter, amount=1):
+        """
+        Adds to a counter, only while enabled.
+        """
+
+        if not self.enabled:
+            return
+
+        with self.lock:
+            self.counters[counter] = self.counters.get(counter, 0) + amount
+
+    def take_samples(self):
+        """
+        Gets the latency samples and counters recorded since the last call
+        and forgets them, so another process can merge them with
+        `merge_samples`. Meant for the worker processes, which don't report.
+
+        Returns:
+            Dictionary -- Contains:
+                stages: The latency samples of each stage, in seconds.
+                counters: The increment of each counter.
+        """
+
+        with self.lock:
+            stages = {
+                stage: list(samples) for stage, samples in self.latencies.items()
+            }
+            counters = dict(self.counters)
+            self.latencies.clear()
+            self.totals.clear()
+            self.counters.clear()
+
+        return {"stages": stages, "counters": counters}
+
+    def merge_samples(self, samples):
+        """
+        Adds the samples taken from another process, see `take_samples`,
+        only while enabled.
+        """
+
+        for stage, stage_samples in samples["stages"].items():
+            for seconds in stage_samples:
+                self.record(stage, seconds)
+        for counter, amount in samples["counters"].items():
+            self.increment(counter, amount)
+
+    def get_summary(self):
+        """
+        Gets the current values of the metrics.
+
+        Returns:
+            Dictionary -- Contains:
+                timestamp: Seconds since the epoch.
+                stages: For each stage, the total samples and seconds and the
+                    mean, percentiles and maximum of the window, in ms.
+                counters: The value of each counter.
+        """
+
+        with self.lock:
+            windows = {
+                stage: list(samples) for stage, samples in self.latencies.items()
+            }
+            totals = {stage: list(total) for stage, total in self.totals.items()}
+            counters = dict(self.counters)
+
+        stages = {}
+        for stage, samples in windows.items():
+            milliseconds = np.array(samples) * 1000
+            stages[stage] = {
+                "count": totals[stage][0],
+                "sum_seconds": totals[stage][1],
+                "mean_ms": float(milliseconds.mean()),
+                **{
+                    "p{}_ms".format(round(quantile * 100)): float(
+                        np.quantile(milliseconds, quantile)
+                    )
+                    for quantile in QUANTILES
+                },
+                "max_ms": float(milliseconds.max()),
+            }
+
+        return {"timestamp": time.time(), "stages": stages, "counters": counters}
+
+    def write_log(self, summary):
+        """
+        Appends a summary to the log file, one row per stage and counter
+        for CSV and one line per summary for JSON lines.
+        """
+
+        if not self.log_path.endswith(".csv"):
+            with open(self.log_path, "a") as log_file:
+                log_file.write(json.dumps(summary) + "\n")
+            return
+
+        quantile_fields = ["p{}_ms".format(round(q * 100)) for q in QUANTILES]
+        fields = ["timestamp", "name", "count", "mean_ms"] + quantile_fields
+        fields += ["max_ms", "value"]
+
+        write_header = not os.path.exists(self.log_path)
+        with open(self.log_path, "a", newline="") as log_file:
+            writer = csv.DictWriter(log_file, fields, extrasaction="ignore")
+            if write_header:
+                writer.writeheader()
+            for stage, values in summary["stages"].items():
+                writer.writerow(
+                    {"timestamp": summary["timestamp"], "name": stage, **values}
+                )
+            for counter, value in summary["counters"].items():
+                writer.writerow(
+                    {
+                        "timestamp": summary["timestamp"],
+                        "name": counter,
+                        "value": value,
+                    }
+                )
+
+    def write_prometheus(self, summary):
+        """
+        Rewrites the Prometheus file with a summary. The stage latencies
+        are exported as a summary metric and each counter as a counter.
+        The file is replaced at once so it is never read half written.
+        """
+
+        name = METRIC_PREFIX + "_stage_seconds"
+        lines = [
+            "# HELP {} Latency of each processing stage.".format(name),
+            "# TYPE {} summary".format(name),
+        ]
+        for stage, values in summary["stages"].items():
+            for quantile in QUANTILES:
+                key = "p{}_ms".format(round(quantile * 100))
+                lines.append(
+                    '{}{{stage="{}",quantile="{}"}} {}'.format(
+                        name, stage, quantile, values[key] / 1000
+                    )
+                )
+            lines.append(
+                '{}_sum{{stage="{}"}} {}'.format(name, stage, values["sum_seconds"])
+            )
+            lines.append(
+                '{}_count{{stage="{}"}} {}'.format(name, stage, values["count"])
+            )
+
+        for counter, value in summary["counters"].items():
+            counter_name = "{}_{}_total".format(METRIC_PREFIX, counter)
+            lines.append("# TYPE {} counter".format(counter_name))
+            lines.append("{} {}".format(counter_name, value))
+
+        temporary_path = self.prometheus_path + ".tmp"
+        with open(temporary_path, "w") as prometheus_file:
+            prometheus_file.write("\n".join(lines) + "\n")
+        os.replace(temporary_path, self.prometheus_path)
+
+    def report(self, force=False):
+        """
+        Writes the configured reports if report_interval seconds passed
+        since the last ones. Meant to be called once per frame.
+
+        Arguments:
+            force {boolean} -- Report regardless of the interval.
+        """
+
+        if not self.enabled:
+            return
+
+        now = time.monotonic()
+        if not force and now - self.last_report < self.report_interval:
+            return
+        self.last_report = now
+
+        summary = self.get_summary()
+        if self.log_path:
+            self.write_log(summary)
+        if self.prometheus_path:
+            self.write_prometheus(summary)
+
+
+# Shared by the recognizer and the core_lib functions.
+metrics = Metrics()
@@ -0,0 +1,381 @@
+"""
+Exports the MultiCameraRecognizer class which processes the frames of
+several cameras on a pool of worker processes and merges their results in
+a single stream.
+The frames reach the workers through shared memory slots, only the name of
+the slot travels through the pool, so the images are never pickled.
+"""
+import json
+import multiprocessing
+import os
+import queue
+import signal
+import sys
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from core_lib.metrics import metrics
+from core_lib.recognition import FrameRecognizer
+from core_lib.recognition import get_frame_record
+from core_lib.seeds import get_default_color_config
+from core_lib.video_feed import Frame
+from core_lib.video_feed import open_feed
+
+# Frames of each camera that can be waiting or processing at once.
+SLOTS_PER_CAMERA = 4
+
+# Seconds a capture waits for a free slot before checking if it must stop.
+SLOT_TIMEOUT = 0.1
+
+# Marks the end of the frames of a camera in the result queue, which may
+# be preceded by the exception that stopped its capture.
+END = object()
+
+# The recognizer of a worker process, see `init_worker`.
+worker_recognizer = None
+
+# The shared memory blocks a worker process attached to, by name.
+worker_memories = {}
+
+
+class FrameSlots:
+    """
+    A block of shared memory split in slots that hold one frame each.
+    A slot is acquired by the capture, filled, processed by a worker and
+    released once its result is read.
+
+    Parameters:
+        shape {tuple} -- The shape of the frames, all the same.
+        count {integer} -- The number of slots. Defaults to SLOTS_PER_CAMERA.
+    """
+
+    def __init__(self, shape, count=SLOTS_PER_CAMERA):
+        self.shape = shape
+        frame_size = int(np.prod(shape))
+        self.memory = shared_memory.SharedMemory(create=True, size=frame_size * count)
+        self.frames = np.ndarray((count,) + shape, np.uint8, self.memory.buf)
+
+        self.free_slots = queue.Queue()
+        for index in range(count):
+            self.free_slots.put(index)
+
+    @property
+    def name(self):
+        return self.memory.name
+
+    def acquire(self, timeout=None):
+        """
+        Gets a free slot, waiting up to timeout seconds for one.
+
+        Returns:
+            Integer -- The index of the slot, None if none was freed in time.
+        """
+
+        try:
+            return self.free_slots.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def write(self, index, image):
+        """
+        Copies a frame into an acquired slot.
+        """
+
+        if image.shape != self.shape:
+            raise ValueError(
+                "FAILURE: frame shape {} changed from {}".format(
+                    image.shape, self.shape
+                )
+            )
+
+        np.copyto(self.frames[index], image)
+
+    def release(self, index):
+        """
+        Makes a slot available again.
+        """
+
+        self.free_slots.put(index)
+
+    def close(self):
+        """
+        Frees the shared memory, once no worker uses it.
+        """
+
+        del self.frames
+        self.memory.close()
+        self.memory.unlink()
+
+
+def init_worker(training_params, recognizer_options, metrics_enabled):
+    """
+    Prepares a worker process: builds its recognizer and loads the color
+    configuration once, instead of with every frame.
+
+    Arguments:
+        training_params {list} -- The contents of train_parameters.txt.
+        recognizer_options {dictionary} -- Keyword arguments of
+            `FrameRecognizer` besides the training params.
+        metrics_enabled {boolean} -- Whether the worker records metrics,
+            which the main process merges and reports, see `process_slot`.
+    """
+
+    global worker_recognizer
+
+    # Ctrl+C stops the main process, which then shuts the pool down.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+    if metrics_enabled:
+        metrics.configure()
+
+    # A worker processes one frame at a time and nobody displays them.
+    worker_recognizer = FrameRecognizer(
+        training_params, reuse_buffers=True, label_output=True, **recognizer_options
+    )
+    get_default_color_config()
+
+
+def get_slot_image(memory_name, shape, index):
+    """
+    Gets the frame of a slot in a worker process, attaching to the shared
+    memory the first time.
+    """
+
+    if memory_name not in worker_memories:
+        worker_memories[memory_name] = shared_memory.SharedMemory(memory_name)
+
+    frames = worker_memories[memory_name].buf
+    frame_size = int(np.prod(shape))
+
+    return np.ndarray(shape, np.uint8, frames, index * frame_size)
+
+
+def process_slot(camera_id, memory_name, shape, index, frame_id, timestamp):
+    """
+    Processes the frame of a slot in a worker process.
+
+    Arguments:
+        camera_id {string} -- The source of the frame.
+        memory_name {string} -- The name of the shared memory of the slots.
+        shape {tuple} -- The shape of the frame.
+        index {integer} -- The index of the slot.
+        frame_id {integer} -- Number of the frame in its camera.
+        timestamp {number} -- When the frame was captured.
+
+    Returns:
+        Tuple -- The frame record, see `get_frame_record`, with the camera
+            id, and the metrics recorded while processing it, see
+            `Metrics.take_samples`.
+    """
+
+    image = get_slot_image(memory_name, shape, index)
+    frame = {
+        "frame_id": frame_id,
+        "timestamp": timestamp,
+        "frame": Frame(image, timestamp=timestamp, sequence=frame_id),
+    }
+    timing = worker_recognizer.process_timed(frame)
+    record = {"camera": camera_id, **get_frame_record(frame, timing)}
+
+    return record, metrics.take_samples()
+
+
+class MultiCameraRecognizer:
+    """
+    Runs one capture thread per camera, which copies each frame into a
+    shared memory slot of its camera and submits the slot to a pool of
+    worker processes. The records of the processed frames are written as
+    JSON lines to a single output, in the order the frames were submitted,
+    each one tagged with its camera and capture timestamp. When every slot
+    of a camera is busy its capture waits.
+    Each worker keeps its own recognizer, so frames of the same camera may
+    be processed by different workers and options that depend on the
+    previous frame (seed tracking, ROI) are not supported.
+    The metrics the workers record come back with their results and are
+    reported by the main process.
+
+    Parameters:
+        sources {list} -- The source of each camera, see `open_feed`, also
+            used as its camera id.
+        training_params {list} -- The contents of train_parameters.txt.
+        recognizer_options {dictionary} -- Keyword arguments of
+            `FrameRecognizer` besides the training params, like
+            intensity_threshold and backend.
+        width {integer} -- The target width of the images. Defaults to -1.
+        workers {integer} -- The number of worker processes. Defaults to
+            the number of cores.
+        threaded_capture {boolean} -- Whether cameras are captured in a
+            background thread, see `VideoFeed`.
+        realtime {boolean} -- Whether recorded sessions are replayed at the
+            recorded pace, see `RecordedFeed`.
+    """
+
+    def __init__(
+        self,
+        sources,
+        training_params,
+        recognizer_options,
+        width=-1,
+        workers=None,
+        threaded_capture=False,
+        realtime=False,
+    ):
+        if len(set(map(str, sources))) != len(sources):
+            raise ValueError("FAILURE: every camera needs a different source")
+        if recognizer_options.get("track_seeds") or (
+            recognizer_options.get("roi_margin") is not None
+        ):
+            raise ValueError(
+                "FAILURE: the multi-camera mode doesn't track seeds or use a ROI"
+            )
+
+        self.sources = [str(source) for source in sources]
+        self.training_params = training_params
+        self.recognizer_options = recognizer_options
+        self.width = width
+        self.workers = workers or os.cpu_count()
+        self.threaded_capture = threaded_capture
+        self.realtime = realtime
+
+        self.results = queue.Queue()
+        self.stop_event = threading.Event()
+        self.slots = []
+        self.frame_count = 0
+
+    def capture(self, camera_id, feed, executor):
+        """
+        Submits the frames of a camera to the pool until its feed ends or
+        the recognizer stops. An error is passed on to `write_results`,
+        which raises it.
+        """
+
+        slots = None
+        try:
+            while not self.stop_event.is_set():
+                source = feed.read_frame()
+                if source is None:
+                    break
+
+                image = source.bgr
+                if slots is None:
+                    slots = FrameSlots(image.shape)
+                    self.slots.append(slots)
+
+                index = None
+                while index is None and not self.stop_event.is_set():
+                    index = slots.acquire(SLOT_TIMEOUT)
+                if index is None:
+                    break
+                try:
+                    slots.write(index, image)
+                except ValueError:
+                    slots.release(index)
+                    raise
+
+                future = executor.submit(
+                    process_slot,
+                    camera_id,
+                    slots.name,
+                    slots.shape,
+                    index,
+                    source.sequence,
+                    source.timestamp,
+                )
+                self.results.put((future, slots, index))
+        except Exception as error:
+            self.results.put(error)
+        finally:
+            self.results.put(END)
+
+    def write_results(self, output):
+        """
+        Writes the records of the processed frames until every camera ends,
+        or raises the error that stopped a capture.
+        """
+
+        running_cameras = len(self.sources)
+
+        while running_cameras:
+            item = self.results.get()
+            if item is END:
+                running_cameras -= 1
+                continue
+            if isinstance(item, Exception):
+                raise item
+
+            future, slots, index = item
+            try:
+                record, samples = future.result()
+            finally:
+                slots.release(index)
+
+            output.write(json.dumps(record) + "\n")
+            self.frame_count += 1
+            metrics.merge_samples(samples)
+            metrics.increment("frames")
+            metrics.report()
+
+    def run(self, output):
+        """
+        Processes every frame of the cameras and writes their records, until
+        every feed ends or Ctrl+C is pressed.
+
+        Arguments:
+            output {file} -- Where the JSON lines are written.
+        """
+
+        feeds = [
+            open_feed(source, self.width, self.threaded_capture, self.realtime)
+            for source in self.sources
+        ]
+        start = time.perf_counter()
+
+        # Forking while the capture threads and OpenCV threads run can leave
+        # the workers with locks that nobody will release.
+        with ProcessPoolExecutor(
+            self.workers,
+            multiprocessing.get_context("spawn"),
+            initializer=init_worker,
+            initargs=(self.training_params, self.recognizer_options, metrics.enabled),
+        ) as executor:
+            threads = [
+                threading.Thread(
+                    target=self.capture, args=(camera_id, feed, executor), daemon=True
+                )
+                for camera_id, feed in zip(self.sources, feeds)
+            ]
+            for thread in threads:
+                thread.start()
+
+            try:
+                self.write_results(output)
+            except KeyboardInterrupt:
+                # Cameras never end.
+                pass
+            finally:
+                self.stop_event.set()
+                for thread in threads:
+                    thread.join()
+                for feed in feeds:
+                    feed.release()
+                executor.shutdown(cancel_futures=True)
+                # The workers are gone, nobody uses the slots anymore.
+                for slots in self.slots:
+                    slots.close()
+
+        frame_count = self.frame_count
+
+        elapsed = time.perf_counter() - start
+        print(
+            "Processed {} frames of {} cameras in {:.2f}s ({:.1f} fps)".format(
+                frame_count,
+                len(self.sources),
+                elapsed,
+                frame_count / elapsed if elapsed else 0,
+            ),
+            file=sys.stderr,
+        )
@@ -0,0 +1,178 @@
+"""
+Exports the Pipeline class which runs a sequence of stages on worker threads.
+"""
+import queue
+import threading
+
+from core_lib.metrics import metrics
+
+# Marks the end of the items in a queue.
+END = object()
+
+
+class StageError:
+    """
+    Carries the exception raised by a stage to the output of the pipeline.
+    """
+
+    def __init__(self, exception):
+        self.exception = exception
+
+
+class Pipeline:
+    """
+    Runs a sequence of stages, each one on its own worker thread, connected
+    by bounded queues, so the throughput approaches the one of the slowest
+    stage instead of the sum of all of them. Items keep their order and
+    carry the id they were submitted with.
+    When a stage falls behind the queues fill up and the workers before it
+    wait (back-pressure). Submitting to a full pipeline either waits too or
+    drops the oldest item that didn't start processing yet. The output is
+    bounded too: when the consumer of `get` falls behind, for example the
+    display, the last stage either waits or drops the oldest result that
+    wasn't read, failed ones included. The end mark always waits, so a
+    consumer that stops reading early must `drain` the pipeline for `close`
+    to return.
+
+    Parameters:
+        stages {list} -- Functions, each one receives the result of the
+            previous one and the first one the submitted item.
+        queue_size {integer} -- Maximum items waiting before each stage and
+            in the output. Defaults to 1.
+        drop_items {boolean} -- Whether submitting to a full pipeline, or
+            finishing an item with a full output, drops the oldest waiting
+            item instead of waiting. Defaults to True.
+    """
+
+    def __init__(self, stages, queue_size=1, drop_items=True):
+        self.drop_items = drop_items
+        self.dropped_items = 0
+
+        self.queues = [queue.Queue(queue_size) for _ in stages]
+        self.output = queue.Queue(queue_size)
+        self.workers = []
+
+        for index, stage in enumerate(stages):
+            is_last = index + 1 == len(stages)
+            next_queue = self.output if is_last else self.queues[index + 1]
+            worker = threading.Thread(
+                target=self.run_stage,
+                args=(stage, self.queues[index], next_queue, is_last),
+                daemon=True,
+            )
+            worker.start()
+            self.workers.append(worker)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, tb):
+        self.close()
+
+    def run_stage(self, stage, input_queue, output_queue, is_last):
+        """
+        Processes the items of a queue until the end mark arrives.
+        Errors are passed along so they reach the output.
+        """
+
+        put = self.put if is_last else output_queue.put
+
+        while True:
+            item = input_queue.get()
+            if item is END:
+                output_queue.put(END)
+                return
+
+            item_id, value = item
+            if not isinstance(value, StageError):
+                try:
+                    value = stage(value)
+                except Exception as exception:
+                    value = StageError(exception)
+
+            put((item_id, value))
+
+    def put(self, item):
+        """
+        Adds a finished item to the output, dropping the oldest unread one
+        while it is full if drop_items is set.
+        """
+
+        self.put_dropping(self.output, item)
+
+    def put_dropping(self, target_queue, item):
+        """
+        Adds an item to a queue, dropping the oldest one while it is full if
+        drop_items is set, waiting otherwise.
+        """
+
+        while self.drop_items:
+            try:
+                target_queue.put_nowait(item)
+                return
+            except queue.Full:
+                pass
+
+            try:
+                target_queue.get_nowait()
+                self.dropped_items += 1
+                metrics.increment("pipeline_dropped_items")
+            except queue.Empty:
+                pass
+
+        target_queue.put(item)
+
+    def submit(self, item_id, item):
+        """
+        Adds an item to the pipeline.
+
+        Arguments:
+            item_id {any} -- Identifies the item in the output, usually the
+                frame number.
+            item {any} -- The input of the first stage.
+        """
+
+        self.put_dropping(self.queues[0], (item_id, item))
+
+    def get(self, timeout=None):
+        """
+        Gets the next processed item.
+
+        Arguments:
+            timeout {number} -- Maximum seconds to wait, None waits forever.
+
+        Returns:
+            Tuple -- The id and the result of the last stage, None if there
+                was no item in time or the pipeline was closed.
+        """
+
+        try:
+            item = self.output.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+        if item is END:
+            return None
+
+        item_id, value = item
+        if isinstance(value, StageError):
+            raise value.exception
+
+        return item_id, value
+
+    def drain(self):
+        """
+        Discards the output until the pipeline is closed, errors included.
+        """
+
+        while self.output.get() is not END:
+            pass
+
+    def close(self):
+        """
+        Lets the submitted items finish and stops the workers.
+        """
+
+        self.queues[0].put(END)
+        for worker in self.workers:
+            worker.join()
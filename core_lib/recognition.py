@@ -0,0 +1,339 @@
+"""
+Exports the FrameRecognizer class which finds and identifies the figures
+of the frames of a video.
+"""
+import time
+
+from core_lib.core import Figure
+from core_lib.metrics import metrics
+from core_lib.region_identifier import get_figure
+from core_lib.region_identifier import region_classifiers
+from core_lib.seeds import SeedTracker
+from core_lib.seeds import get_seeds
+from core_lib.segmentation import SegmentationContext
+from core_lib.segmentation import get_regions_roi
+from core_lib.segmentation import label_regions
+from core_lib.segmentation import label_regions_tiled
+from core_lib.segmentation import paint_labels
+from core_lib.segmentation import region_expander
+from core_lib.segmentation import region_expander_pyramid
+from core_lib.video_feed import Frame
+
+
+class FrameRecognizer:
+    """
+    Finds and identifies the figures of consecutive frames.
+    The work is split in stages that receive a frame dictionary, add their
+    results to it and return it, so they can run one after the other with
+    `process` or on different threads:
+        find_seeds: adds gray_image, seeds and frame (the `Frame`), needs
+            image or a `Frame` in frame, whose grayscale image is then
+            shared.
+        segment: adds result_image, or labels with label_output, and
+            found_regions (without the overflowed regions), needs
+            gray_image and seeds.
+        classify: adds detected_figures, needs found_regions.
+
+    Parameters:
+        training_params {list} -- The contents of train_parameters.txt.
+        intensity_threshold {number} -- The maximum distance for 2 pixels to
+            be considered in the same region.
+        backend {string} -- The region growing backend, see `region_expander`.
+        budget {dictionary} -- Limits of each region, see `region_expander`.
+        track_seeds {boolean} -- Whether to use the centroids of the previous
+            frame as seeds when possible, see `SeedTracker`.
+        roi_margin {integer} -- When given, the regions only grow around the
+            regions of the previous frame, with this margin.
+        classifier {string} -- How the regions are matched with the trained
+            figures, one of `region_classifiers`: "box" (default) or
+            "mahalanobis".
+        reuse_buffers {boolean} -- Whether the grayscale image, the visited
+            matrix and the result image are reused between frames, see
+            `SegmentationContext`. The images of a frame are then only valid
+            until the next frame is processed, so it can't be used when
+            frames are processed concurrently.
+        label_output {boolean} -- Whether the segmentation outputs a label
+            mask instead of painting result_image, when nobody displays it.
+        pyramid_levels {integer} -- When greater than 0, the regions grow on
+            the frame downsampled this many times by half and only their
+            border is refined at full resolution, see
+            `region_expander_pyramid`. For high resolution cameras. It can't
+            be combined with roi_margin and it always paints result_image.
+        tile_size {integer} -- When given, the regions grow tile by tile on
+            a thread pool with tiles of this side, see `label_regions_tiled`.
+            Only for regions that span many tiles on multi-core machines.
+            It ignores backend and can't be combined with roi_margin or
+            pyramid_levels.
+        batch_statistics {boolean} -- Whether the regions grow into a single
+            label image whose statistics are computed in one pass, see
+            `label_regions`. Each seed still grows on its own with the
+            scanline fill, so it ignores backend, and it can't be combined
+            with roi_margin, pyramid_levels or tile_size. Like tile_size, it
+            counts each seed once and lets a region take the pixels that a
+            previous region rejected, so the regions, and sometimes the
+            figures, differ from the default segmentation.
+    """
+
+    def __init__(
+        self,
+        training_params,
+        intensity_threshold,
+        backend="scanline",
+        budget=None,
+        track_seeds=False,
+        roi_margin=None,
+        classifier="box",
+        reuse_buffers=False,
+        label_output=False,
+        pyramid_levels=0,
+        tile_size=None,
+        batch_statistics=False,
+    ):
+        if pyramid_levels and roi_margin is not None:
+            raise ValueError("FAILURE: the pyramid segmentation doesn't use a ROI")
+        if tile_size and (pyramid_levels or roi_margin is not None):
+            raise ValueError(
+                "FAILURE: the tiled segmentation doesn't use a ROI or a pyramid"
+            )
+        if batch_statistics and (pyramid_levels or tile_size or roi_margin is not None):
+            raise ValueError(
+                "FAILURE: the batch statistics don't use a ROI, a pyramid or tiles"
+            )
+        self.training_params = training_params
+        if classifier not in region_classifiers:
+            raise ValueError("FAILURE: unknown region classifier " + classifier)
+        self.classifier = region_classifiers[classifier](training_params)
+        self.intensity_threshold = intensity_threshold
+        self.backend = backend
+        self.budget = budget
+        self.seed_tracker = SeedTracker() if track_seeds else None
+        self.roi_margin = roi_margin
+        self.previous_regions = []
+        self.output = "labels" if label_output else "image"
+        self.context = SegmentationContext(self.output) if reuse_buffers else None
+        self.pyramid_levels = pyramid_levels
+        self.tile_size = tile_size
+        self.batch_statistics = batch_statistics
+
+    def find_seeds(self, frame):
+        """
+        Converts the frame to grayscale and finds its seeds.
+        """
+
+        source = frame.get("frame") or Frame(frame["image"])
+        frame["frame"] = source
+        image = source.bgr
+        with metrics.timer("grayscale"):
+            buffer = None
+            if self.context:
+                buffer = self.context.get_gray_buffer(image.shape[:2])
+            frame["gray_image"] = source.get_gray(buffer)
+
+        with metrics.timer("seeds"):
+            if self.seed_tracker:
+                frame["seeds"] = self.seed_tracker.get_seeds(source)
+            else:
+                frame["seeds"] = get_seeds(source)
+
+        return frame
+
+    def segment(self, frame):
+        """
+        Grows the regions of the frame from its seeds.
+        """
+
+        if self.pyramid_levels:
+            return self.segment_pyramid(frame)
+        if self.tile_size:
+            return self.segment_tiled(frame)
+        if self.batch_statistics:
+            return self.segment_labels(frame)
+
+        gray_image = frame["gray_image"]
+
+        roi = None
+        if self.roi_margin is not None:
+            roi = get_regions_roi(
+                self.previous_regions, gray_image.shape, self.roi_margin
+            )
+
+        context = self.context
+        if context is None and self.output == "labels":
+            context = SegmentationContext(self.output)
+
+        result_image, found_regions = region_expander(
+            gray_image,
+            frame["seeds"],
+            self.intensity_threshold,
+            self.backend,
+            self.budget,
+            roi,
+            context,
+        )
+        if self.output == "labels":
+            frame["labels"] = result_image
+        else:
+            frame["result_image"] = result_image
+
+        return self.set_found_regions(frame, found_regions)
+
+    def segment_pyramid(self, frame):
+        """
+        Grows the regions of the frame coarse to fine, on its pyramid.
+        """
+
+        pyramid = [
+            frame["frame"].get_pyramid_level(level)
+            for level in range(self.pyramid_levels + 1)
+        ]
+
+        frame["result_image"], found_regions = region_expander_pyramid(
+            frame["gray_image"],
+            frame["seeds"],
+            self.intensity_threshold,
+            self.pyramid_levels,
+            self.backend,
+            self.budget,
+            pyramid,
+        )
+
+        return self.set_found_regions(frame, found_regions)
+
+    def segment_tiled(self, frame):
+        """
+        Grows the regions of the frame tile by tile on a thread pool.
+        """
+
+        labels, found_regions = label_regions_tiled(
+            frame["gray_image"],
+            frame["seeds"],
+            self.intensity_threshold,
+            self.budget,
+            self.tile_size,
+        )
+
+        return self.set_labels(frame, labels, found_regions)
+
+    def segment_labels(self, frame):
+        """
+        Grows the regions of the frame into one label image and computes
+        their statistics at once.
+        """
+
+        labels, found_regions = label_regions(
+            frame["gray_image"],
+            frame["seeds"],
+            self.intensity_threshold,
+            self.budget,
+        )
+
+        return self.set_labels(frame, labels, found_regions)
+
+    def set_labels(self, frame, labels, found_regions):
+        """
+        Adds a label image to the frame, painted unless label_output is set,
+        and its regions.
+        """
+
+        if self.output == "labels":
+            frame["labels"] = labels
+        else:
+            frame["result_image"] = paint_labels(labels, len(frame["seeds"]))
+
+        return self.set_found_regions(frame, found_regions)
+
+    def set_found_regions(self, frame, found_regions):
+        """
+        Adds the regions that can be classified to the frame and remembers
+        them for the next frame.
+        """
+
+        self.previous_regions = found_regions
+        if self.seed_tracker:
+            self.seed_tracker.update(found_regions)
+
+        # Regions that leaked into the background can't be classified.
+        frame["found_regions"] = [
+            region for region in found_regions if not region["overflowed"]
+        ]
+
+        return frame
+
+    def classify(self, frame):
+        """
+        Identifies the figure of each region of the frame.
+        """
+
+        frame["detected_figures"] = self.classifier.classify(frame["found_regions"])
+
+        return frame
+
+    def process(self, frame):
+        """
+        Runs all the stages on a frame.
+        """
+
+        return self.classify(self.segment(self.find_seeds(frame)))
+
+    def process_timed(self, frame):
+        """
+        Runs all the stages on a frame and measures each one.
+
+        Returns:
+            Dictionary -- Seconds spent in each stage and in total.
+        """
+
+        stages = (
+            ("seeds", self.find_seeds),
+            ("segmentation", self.segment),
+            ("classification", self.classify),
+        )
+
+        timing = {}
+        for name, stage in stages:
+            stage_start = time.perf_counter()
+            stage(frame)
+            timing[name] = time.perf_counter() - stage_start
+        timing["total"] = sum(timing.values())
+
+        return timing
+
+
+def get_frame_record(frame, timing):
+    """
+    Gets the JSON serializable record of a processed frame.
+
+    Arguments:
+        frame {dictionary} -- The processed frame.
+        timing {dictionary} -- Seconds spent in each stage.
+
+    Returns:
+        Dictionary -- The frame id, its capture timestamp, the timing and
+            the detections, one per found region.
+    """
+
+    detections = []
+
+    for region, (figure, angle) in zip(
+        frame["found_regions"], frame["detected_figures"]
+    ):
+        if not isinstance(figure, Figure):
+            figure = get_figure(figure)
+
+        detection = {
+            "figure": figure.name if isinstance(figure, Figure) else figure,
+            "angle": angle,
+            "x_center": region["x_center"],
+            "y_center": region["y_center"],
+        }
+        detection.update(
+            {key: value for key, value in region.items() if key.startswith("phi_")}
+        )
+        detections.append(detection)
+
+    return {
+        "frame_id": frame["frame_id"],
+        "timestamp": frame["timestamp"],
+        "timing": timing,
+        "detections": detections,
+    }
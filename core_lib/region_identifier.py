@@ -1,43 +1,353 @@
+import logging
 import math
 import json
+
+import numpy as np
+
 from .core import Figure
+from .metrics import metrics
 
 threshold = 0.7
 
+# Figures whose angle is reported.
+LONG_FIGURES = (Figure.LONG_1, Figure.LONG_2)
+
+# Region reported for the objects that don't match any figure.
+UNKNOWN_REGION = "5"
+
+logger = logging.getLogger(__name__)
+
+# Classifier of the last training params given to `identify_region`.
+cached_classifier = None
+
+
+def get_figure(object_id):
+    """
+    Gets the figure of a trained object id, the id itself for objects that
+    are not one of the `Figure` values.
+    """
+
+    try:
+        return Figure(int(object_id))
+    except ValueError:
+        return object_id
+
+
+def get_closest_figures(potential_objects, distances, labels, long_figures):
+    """
+    Pairs each object with its closest figure.
+
+    Arguments:
+        potential_objects {list} -- The characteristics of the objects.
+        distances {np.array} -- One row per object and one column per figure,
+            infinite for the figures an object can't match.
+        labels {list} -- The region reported for each figure.
+        long_figures {np.array} -- Whether the angle of each figure is reported.
+
+    Returns:
+        List -- A (region, angle) pair per object, see `RegionClassifier.classify`.
+    """
+
+    # The first of the closest figures wins.
+    closest = np.argmin(distances, axis=1)
+    matched = distances[np.arange(len(closest)), closest] < math.inf
+
+    objects = []
+    for region, figure_index, is_match in zip(potential_objects, closest, matched):
+        if not is_match:
+            objects.append((UNKNOWN_REGION, None))
+        elif long_figures[figure_index]:
+            objects.append((labels[figure_index], region["theta"]))
+        else:
+            objects.append((labels[figure_index], None))
+
+    return objects
+
+
+def get_gaussian_params(points, features):
+    """
+    Estimates the distribution of the features of the samples of a figure,
+    with the inverse and the log-determinant of the covariance precomputed
+    so classifying doesn't need any matrix inversion.
+
+    Arguments:
+        points {list} -- The characteristics of the samples of the figure.
+        features {list} -- The names of the characteristics used, e.g. phi_1.
+
+    Returns:
+        Dictionary -- The mean vector, covariance, inverse_covariance and
+            log_determinant, as lists so they can be stored as JSON.
+    """
+
+    samples = np.array(
+        [[point[feature] for feature in features] for point in points], np.float64
+    )
+    if len(samples) <= len(features):
+        raise ValueError("FAILURE: need more samples than features per figure")
+
+    covariance = np.cov(samples, rowvar=False).reshape(len(features), len(features))
+    sign, log_determinant = np.linalg.slogdet(covariance)
+    if sign <= 0:
+        raise ValueError("FAILURE: the samples of a figure have a singular covariance")
+
+    return {
+        "mean": samples.mean(axis=0).tolist(),
+        "covariance": covariance.tolist(),
+        "inverse_covariance": np.linalg.inv(covariance).tolist(),
+        "log_determinant": float(log_determinant),
+    }
+
+
+class RegionClassifier:
+    """
+    Matches the regions detected in real time with the trained figures.
+    The means, inverse standard deviations and range limits of all the
+    figures are compiled into arrays once, so all the regions of a frame
+    are compared against all the figures at once, no matter how many
+    figures were trained.
+    An object matches the closest figure, in terms of phi_1 and phi_2
+    considering the standard deviation (see `get_distance`), among the ones
+    it is in range of (see `in_range`). On ties the first trained figure wins.
+
+    Parameters:
+        trainer_params {list} -- Training data that characterizes each
+            figure, the contents of train_parameters.txt.
+        range_threshold {number} -- Maximum difference with the mean of a
+            figure in each axis. Defaults to threshold.
+    """
+
+    def __init__(self, trainer_params, range_threshold=None):
+        if range_threshold is None:
+            range_threshold = threshold
+
+        self.trainer_params = trainer_params
+        self.labels = [get_figure(figure["object_id"]) for figure in trainer_params]
+        self.long_figures = np.array(
+            [label in LONG_FIGURES for label in self.labels], bool
+        )
+
+        means = np.array(
+            [[figure["mean_phi_1"], figure["mean_phi_2"]] for figure in trainer_params],
+            np.float64,
+        ).reshape(-1, 2)
+        sigmas = np.array(
+            [
+                [figure["sigma_phi_1"], figure["sigma_phi_2"]]
+                for figure in trainer_params
+            ],
+            np.float64,
+        ).reshape(-1, 2)
+
+        if np.any(sigmas == 0):
+            raise ValueError("FAILURE: trained figures need a non zero sigma")
+
+        self.means = means
+        self.inverse_sigmas = 1 / sigmas
+        self.lower_limits = means - range_threshold
+        self.upper_limits = means + range_threshold
+
+    def get_distances(self, features):
+        """
+        Gets the distance of every object to every figure.
+
+        Arguments:
+            features {np.array} -- The phi_1 and phi_2 of each object.
+
+        Returns:
+            np.array -- One row per object and one column per figure.
+        """
+
+        deviations = (features[:, None, :] - self.means) * self.inverse_sigmas
+        return (deviations ** 2).sum(axis=2)
+
+    @metrics.timed("classification")
+    def classify(self, potential_objects):
+        """
+        Matches objects being detected in real time with the trained figures.
+
+        Arguments:
+            potential_objects {list} -- The characteristics of the objects.
+
+        Returns:
+            List -- A (region, angle) pair per object: the `Figure` (the
+                object id for ids that aren't a `Figure`) or UNKNOWN_REGION,
+                and the angle of long figures, None otherwise.
+        """
+
+        if not potential_objects:
+            return []
+        if not self.labels:
+            return [(UNKNOWN_REGION, None) for _ in potential_objects]
+
+        features = np.array(
+            [[region["phi_1"], region["phi_2"]] for region in potential_objects],
+            np.float64,
+        )
+
+        distances = self.get_distances(features)
+        in_range = np.all(
+            (self.lower_limits <= features[:, None, :])
+            & (features[:, None, :] <= self.upper_limits),
+            axis=2,
+        )
+        distances = np.where(in_range, distances, math.inf)
+
+        if logger.isEnabledFor(logging.DEBUG):
+            for features_row, distances_row in zip(features, distances):
+                logger.debug(
+                    "phi1 = %s phi2 = %s distances = %s",
+                    features_row[0],
+                    features_row[1],
+                    distances_row,
+                )
+
+        return get_closest_figures(
+            potential_objects, distances, self.labels, self.long_figures
+        )
+
+
+class MahalanobisClassifier:
+    """
+    Matches the regions detected in real time with the trained figures
+    using the full covariance of the features of each figure, which can
+    include more Hu invariants than phi_1 and phi_2.
+    The score of an object for a figure is its squared Mahalanobis distance
+    plus the log-determinant of the covariance, so wide figures don't win
+    over tight ones. Objects farther than max_distance from every figure
+    are unknown. The inverses are precomputed by the training (see
+    `get_gaussian_params`), or computed here from the stored samples, so a
+    frame is classified with a single batched product.
+
+    Parameters:
+        trainer_params {list} -- Training data that characterizes each
+            figure, the contents of train_parameters.txt.
+        max_distance {number} -- Maximum Mahalanobis distance to a figure,
+            in standard deviations. Defaults to 3.
+    """
+
+    def __init__(self, trainer_params, max_distance=3.0):
+        self.trainer_params = trainer_params
+        self.labels = [get_figure(figure["object_id"]) for figure in trainer_params]
+        self.long_figures = np.array(
+            [label in LONG_FIGURES for label in self.labels], bool
+        )
+        self.max_distance = max_distance
+
+        feature_lists = {
+            tuple(figure.get("features", ("phi_1", "phi_2")))
+            for figure in trainer_params
+        }
+        if len(feature_lists) > 1:
+            raise ValueError(
+                "FAILURE: all figures must be trained on the same features"
+            )
+        self.features = list(feature_lists.pop()) if feature_lists else []
+
+        params = [
+            figure
+            if "inverse_covariance" in figure
+            else get_gaussian_params(figure["points"], self.features)
+            for figure in trainer_params
+        ]
+
+        size = len(self.features)
+        self.means = np.array(
+            [figure["mean"] for figure in params], np.float64
+        ).reshape(-1, size)
+        self.inverse_covariances = np.array(
+            [figure["inverse_covariance"] for figure in params], np.float64
+        ).reshape(-1, size, size)
+        self.log_determinants = np.array(
+            [figure["log_determinant"] for figure in params], np.float64
+        )
+
+    def get_distances(self, features):
+        """
+        Gets the squared Mahalanobis distance of every object to every figure.
+
+        Arguments:
+            features {np.array} -- The features of each object.
+
+        Returns:
+            np.array -- One row per object and one column per figure.
+        """
+
+        deviations = features[:, None, :] - self.means
+        return np.einsum(
+            "rci,cij,rcj->rc", deviations, self.inverse_covariances, deviations
+        )
+
+    @metrics.timed("classification")
+    def classify(self, potential_objects):
+        """
+        Matches objects being detected in real time with the trained figures.
+
+        Arguments:
+            potential_objects {list} -- The characteristics of the objects.
+
+        Returns:
+            List -- A (region, angle) pair per object, see
+                `RegionClassifier.classify`.
+        """
+
+        if not potential_objects:
+            return []
+        if not self.labels:
+            return [(UNKNOWN_REGION, None) for _ in potential_objects]
+
+        features = np.array(
+            [
+                [region[feature] for feature in self.features]
+                for region in potential_objects
+            ],
+            np.float64,
+        )
+
+        distances = self.get_distances(features)
+        scores = np.where(
+            distances <= self.max_distance ** 2,
+            distances + self.log_determinants,
+            math.inf,
+        )
+
+        if logger.isEnabledFor(logging.DEBUG):
+            for features_row, distances_row in zip(features, distances):
+                logger.debug(
+                    "features = %s distances = %s", features_row, distances_row
+                )
+
+        return get_closest_figures(
+            potential_objects, scores, self.labels, self.long_figures
+        )
+
+
+# Classifiers by name.
+region_classifiers = {
+    "box": RegionClassifier,
+    "mahalanobis": MahalanobisClassifier,
+}
+
+
 def identify_region(trainer_params, potential_objects):
     """
     Matches an object being detected in real time with a specific type of object previously defined.
+    The training params are compiled into a `RegionClassifier` the first time they are given,
+    a new list must be given if they change.
     Arguments:
         trainer_params {dictionary} - Training data that characterizes each region.
         potential_objects {array} - Objects to be matched with a region.
     Returns:
         Array -- Array of pairs representing the corresponding region and, if a long object, its angle, otherwise the angle is None.
     """
-    objects = []
-    for curr_obj in potential_objects:
-        distance = math.inf
-        region = "5"
-        angle = None
-        phi_1 = curr_obj["phi_1"]
-        phi_2 = curr_obj["phi_2"]
-        print("phi1 = ", phi_1, "\tphi2 = ", phi_2, "\n")
-        for figure in trainer_params:
-            sigma_phi_1 = figure["sigma_phi_1"]
-            sigma_phi_2 = figure["sigma_phi_2"]
-            mean_phi_1 = figure["mean_phi_1"]
-            mean_phi_2 = figure["mean_phi_2"]
-            ind_distance = get_distance(sigma_phi_1, sigma_phi_2, mean_phi_1, mean_phi_2, phi_1, phi_2)
-            print("object = ", figure["object_id"], "\tphi1 = ", mean_phi_1, "\tphi2 = ", mean_phi_2, "\tsigma_phi1 = ", sigma_phi_1, "\tsigma_phi2 = ", sigma_phi_2, "\tdist = ", ind_distance, "\n")
-            if  in_range(mean_phi_1, mean_phi_2, phi_1, phi_2) and ind_distance < distance:
-                distance = ind_distance
-                region = Figure(int(figure["object_id"]))
-                # If it is an object of type long, update the angle
-                if region == Figure.LONG_1 or region == Figure.LONG_2:
-                    angle = curr_obj["theta"]
-                else:
-                    angle = None
-        objects.append((region, angle))
-    return objects
+    global cached_classifier
+
+    if (
+        cached_classifier is None
+        or cached_classifier.trainer_params is not trainer_params
+    ):
+        cached_classifier = RegionClassifier(trainer_params)
+
+    return cached_classifier.classify(potential_objects)
 
 def in_range(mean_phi_1, mean_phi_2, phi_1, phi_2):
     """
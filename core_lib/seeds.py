@@ -1,137 +1,272 @@
-import json
-
-
-def get_seeds_helper(
-    image,
-    lower_height_limit,
-    upper_height_limit,
-    data,
-    count_to_update,
-    COLOR_1,
-    COLOR_2,
-):
+from functools import lru_cache
+
+import numpy as np
+
+from core_lib.colors import ColorConfig
+from core_lib.colors import classify_pixels
+from core_lib.colors import has_color
+
+# Maximum number of rows analyzed on each half of the image.
+MAX_ROWS_PER_HALF = 10
+
+# Color configuration used when no other is given, created on first use.
+default_color_config = None
+
+
+def get_rows_helper(lower_height_limit, upper_height_limit, rows):
     """
-    Get the possible seeds of an image based on the 2 colors defined on the global scope.
-    The name of the colors must be COLOR_1 and COLOR_2 and be in BGR order.
-    Analyzes the row in the middle of lower_height_limit and upper_height_limit and
-    recursively calls the same function for the images that the middle cuts in half.
-    In order to keep the algorithm fast, it stops at 20 iterations and considers there's no
-    seeds in this image, it also starts when the 2 seeds are found.
+    Appends the rows of the image that the bisection search analyzes between
+    lower_height_limit and upper_height_limit.
+    Takes the row in the middle of both limits and recursively does the same
+    for the two halves that the middle cuts, lower half first.
+    Stops when MAX_ROWS_PER_HALF rows have been collected.
 
     Arguments:
-        image {np.array} -- The image to traverse
         lower_height_limit {integer}
         upper_height_limit {integer}
-        data {dictionary} -- Pre-existing data, can contain:
-            seed_1: The coordiantes for the seed_1
-            seed_2: The coordiantes for seed_2
-            count: The total iterations counts
-
-    Returns:
-        Dictionary -- The updated data dictionary
+        rows {list} -- The rows collected so far, updated in place.
     """
 
-    if ("seed_1" in data and "seed_2" in data) or data[count_to_update] == 10:
-        return None
+    if len(rows) == MAX_ROWS_PER_HALF:
+        return
 
     middle_height = int(
         lower_height_limit + (upper_height_limit - lower_height_limit) / 2
     )
+    rows.append(middle_height)
 
-    # TODO: Get rid of this repeated code.
-    for x in range(0, len(image[0])):
-        pixel = image[middle_height][x]
-        if (
-            COLOR_1[0] - 20 <= pixel[0] <= COLOR_1[0] + 20
-            and COLOR_1[1] - 20 <= pixel[1] <= COLOR_1[1] + 20
-            and COLOR_1[2] - 20 <= pixel[2] <= COLOR_1[2] + 20
-        ):
-            data["seed_1"] = (x, middle_height)
+    get_rows_helper(lower_height_limit, middle_height, rows)
+    get_rows_helper(middle_height, upper_height_limit, rows)
 
-        if (
-            COLOR_2[0] - 20 <= pixel[0] <= COLOR_2[0] + 20
-            and COLOR_2[1] - 20 <= pixel[1] <= COLOR_2[1] + 20
-            and COLOR_2[2] - 20 <= pixel[2] <= COLOR_2[2] + 20
-        ):
-            data["seed_2"] = (x, middle_height)
-
-    data[count_to_update] += 1
-
-    get_seeds_helper(
-        image,
-        lower_height_limit,
-        middle_height,
-        data,
-        count_to_update,
-        COLOR_1,
-        COLOR_2,
-    )
-    get_seeds_helper(
-        image,
-        middle_height,
-        upper_height_limit,
-        data,
-        count_to_update,
-        COLOR_1,
-        COLOR_2,
-    )
 
+@lru_cache(maxsize=8)
+def get_scan_rows(height):
+    """
+    Gets the rows analyzed by the seed search, in the order they are analyzed.
+    The middle row goes first, then the bisection of the lower half and
+    finally the bisection of the upper half.
+
+    Arguments:
+        height {integer} -- The height of the image.
+
+    Returns:
+        Tuple -- The row indices, can contain repeated rows.
+    """
+
+    middle_height = int(height / 2)
 
-def get_seeds(image):
+    lower_rows = []
+    upper_rows = []
+    get_rows_helper(0, middle_height, lower_rows)
+    get_rows_helper(middle_height, height, upper_rows)
+
+    return tuple([middle_height] + lower_rows + upper_rows)
+
+
+def get_last_matches(mask):
     """
-    Gets the seeds of an image.
+    Gets the last matching column of every row of a mask.
 
     Arguments:
-        image {np.array} -- The image to traverse.
+        mask {np.array} -- Boolean mask, one row per analyzed image row.
+
+    Returns:
+        Tuple -- Contains:
+            found: Whether each row has at least one match.
+            columns: The last matching column of each row, meaningless
+                for the rows without matches.
     """
 
-    # Get colors from configuration file
-    try:
-        with open("colors.json") as json_file:
-            colors = json.load(json_file)
-    except:
-        raise Exception("FAILURE: no colors.json configuration file, calibrate first")
+    width = mask.shape[1]
+    found = mask.any(axis=1)
+    columns = width - 1 - np.argmax(mask[:, ::-1], axis=1)
 
-    if "COLOR_1" in colors.keys():
-        COLOR_1 = colors["COLOR_1"]
-    else:
-        raise Exception("FAILURE: configuration file is missing COLOR_1")
+    return found, columns
+
+
+def get_default_color_config():
+    """
+    Gets the color configuration shared by all the callers that don't
+    provide their own, loading colors.json the first time.
+
+    Returns:
+        ColorConfig -- The shared configuration.
+    """
+
+    global default_color_config
+
+    if default_color_config is None:
+        default_color_config = ColorConfig()
+
+    return default_color_config
 
-    if "COLOR_2" in colors.keys():
-        COLOR_2 = colors["COLOR_2"]
+
+def get_seeds(image, color_config=None):
+    """
+    Gets the seeds of an image based on the 2 colors defined in colors.json.
+    The name of the colors must be COLOR_1 and COLOR_2 and be in BGR order.
+    Analyzes the row in the middle of the image and then bisects each half,
+    up to MAX_ROWS_PER_HALF rows per half. All the rows are classified at once
+    with the color lookup table, the search stops as soon as both seeds are found.
+    The seed of a color is the last matching pixel of the last analyzed row
+    that contains the color.
+
+    Arguments:
+        image {np.array|Frame} -- The image to traverse, or a `Frame` whose
+            memoized color classes are used.
+        color_config {ColorConfig} -- The calibrated colors. Defaults to the
+            shared configuration loaded from colors.json, or to the one of
+            the frame.
+
+    Returns:
+        List -- The (x, y) coordinates of the found seeds, seed_1 first.
+    """
+
+    if isinstance(image, np.ndarray):
+        rows = get_scan_rows(len(image))
+        color_config = color_config or get_default_color_config()
+        classes = classify_pixels(color_config.get_lut(), image[list(rows)])
+    elif color_config is None:
+        rows = get_scan_rows(len(image.bgr))
+        classes = image.get_color_classes(rows)
     else:
-        raise Exception("FAILURE: configuration file is missing COLOR_2")
+        rows = get_scan_rows(len(image.bgr))
+        classes = classify_pixels(color_config.get_lut(), image.bgr[list(rows)])
 
-    data = {"upper_count": 0, "lower_count": 0}
+    return get_row_seeds(rows, classes)
 
-    middle_height = int(len(image) / 2)
 
-    for x in range(0, len(image[0])):
-        pixel = image[middle_height][x]
-        if (
-            COLOR_1[0] - 20 <= pixel[0] <= COLOR_1[0] + 20
-            and COLOR_1[1] - 20 <= pixel[1] <= COLOR_1[1] + 20
-            and COLOR_1[2] - 20 <= pixel[2] <= COLOR_1[2] + 20
-        ):
-            data["seed_1"] = (x, middle_height)
+def get_row_seeds(rows, classes):
+    """
+    Gets the seeds from the color classes of the analyzed rows, see
+    `get_seeds`.
 
-        if (
-            COLOR_2[0] - 20 <= pixel[0] <= COLOR_2[0] + 20
-            and COLOR_2[1] - 20 <= pixel[1] <= COLOR_2[1] + 20
-            and COLOR_2[2] - 20 <= pixel[2] <= COLOR_2[2] + 20
-        ):
-            data["seed_2"] = (x, middle_height)
+    Arguments:
+        rows {tuple} -- The analyzed rows, in order.
+        classes {np.array} -- The color class of each pixel of the rows.
 
-    get_seeds_helper(image, 0, middle_height, data, "lower_count", COLOR_1, COLOR_2)
-    get_seeds_helper(
-        image, middle_height, len(image), data, "upper_count", COLOR_1, COLOR_2
-    )
+    Returns:
+        List -- The (x, y) coordinates of the found seeds, seed_1 first.
+    """
+
+    found_1, columns_1 = get_last_matches(has_color(classes, 1))
+    found_2, columns_2 = get_last_matches(has_color(classes, 2))
+
+    seed_1 = None
+    seed_2 = None
+
+    for index, y in enumerate(rows):
+        if seed_1 is not None and seed_2 is not None:
+            break
+        if found_1[index]:
+            seed_1 = (int(columns_1[index]), y)
+        if found_2[index]:
+            seed_2 = (int(columns_2[index]), y)
 
     result = []
 
-    if "seed_1" in data:
-        result.append(data["seed_1"])
-    if "seed_2" in data:
-        result.append(data["seed_2"])
+    if seed_1 is not None:
+        result.append(seed_1)
+    if seed_2 is not None:
+        result.append(seed_2)
 
     return result
+
+
+class SeedTracker:
+    """
+    Gets the seeds of consecutive frames of a video. Objects barely move
+    between frames, so the centroids of the regions found in the previous
+    frame are tried first, and they are used as seeds if their pixels still
+    match COLOR_1 and COLOR_2. The full search of `get_seeds` only runs when
+    that check fails.
+
+    Parameters:
+        color_config {ColorConfig} -- The calibrated colors. Defaults to the
+            shared configuration loaded from colors.json.
+    """
+
+    def __init__(self, color_config=None):
+        self.color_config = color_config
+        self.previous_centroids = []
+        self.tracked_frames = 0
+        self.searched_frames = 0
+
+    def get_tracked_seeds(self, image, lut):
+        """
+        Checks the centroids of the previous frame against the colors.
+
+        Arguments:
+            image {np.array} -- The image of the current frame.
+            lut {np.array} -- The color lookup table.
+
+        Returns:
+            List -- The (x, y) coordinates of both seeds, seed_1 first, or None
+                if any of them couldn't be found.
+        """
+
+        height, width = image.shape[:2]
+        centroids = [
+            (x, y)
+            for x, y in self.previous_centroids
+            if 0 <= x < width and 0 <= y < height
+        ]
+        if not centroids:
+            return None
+
+        xs, ys = zip(*centroids)
+        classes = classify_pixels(lut, image[list(ys), list(xs)])
+
+        seed_1 = None
+        seed_2 = None
+
+        for centroid, is_color_1, is_color_2 in zip(
+            centroids, has_color(classes, 1), has_color(classes, 2)
+        ):
+            if is_color_1 and seed_1 is None:
+                seed_1 = centroid
+            if is_color_2 and seed_2 is None:
+                seed_2 = centroid
+
+        if seed_1 is None or seed_2 is None:
+            return None
+
+        return [seed_1, seed_2]
+
+    def get_seeds(self, image):
+        """
+        Gets the seeds of the next frame.
+
+        Arguments:
+            image {np.array|Frame} -- The image to traverse, or a `Frame`
+                whose memoized color classes are used by the full search.
+
+        Returns:
+            List -- The (x, y) coordinates of the found seeds, seed_1 first.
+        """
+
+        pixels = image if isinstance(image, np.ndarray) else image.bgr
+        color_config = self.color_config or get_default_color_config()
+
+        seeds = self.get_tracked_seeds(pixels, color_config.get_lut())
+        if seeds is not None:
+            self.tracked_frames += 1
+            return seeds
+
+        self.searched_frames += 1
+        return get_seeds(image, self.color_config)
+
+    def update(self, found_regions):
+        """
+        Remembers the centroids of the regions found in the current frame.
+
+        Arguments:
+            found_regions {list} -- The characteristics of the regions, as
+                returned by `region_expander`.
+        """
+
+        self.previous_centroids = [
+            (region["x_center"], region["y_center"])
+            for region in found_regions
+            if not region.get("overflowed", False)
+        ]
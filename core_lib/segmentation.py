@@ -1,6 +1,31 @@
+import functools
 import math
+import os
+from bisect import bisect_left
+from bisect import bisect_right
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
 import numpy as np
 
+from core_lib.metrics import metrics
+
+# Structuring element with the 4-neighbourhood of a pixel.
+CROSS_KERNEL = cv2.getStructuringElement(cv2.MORPH_CROSS, (3, 3))
+
+# Mask value of the pixels filled by cv2.floodFill, visited pixels are 1.
+FLOOD_FILL_VALUE = 2
+
+# Side of the square tiles of `label_regions_tiled`.
+TILE_SIZE = 256
+
+# Offsets (rows, columns) of the tiles that share a border with a tile.
+TILE_NEIGHBOURS = ((0, 1), (1, 0), (0, -1), (-1, 0))
+
+# Thread pool of the tiled segmentation, see `get_tile_executor`.
+tile_executor = None
+
 
 def get_neighbours(point, image, visited):
     """
@@ -54,6 +79,10 @@ def update_region_data(region_data, point):
                 "11": 0,
                 "20": 0,
                 "02": 0,
+                "30": 0,
+                "21": 0,
+                "12": 0,
+                "03": 0,
                 "min_x": float("inf"),
                 "max_x": float("-inf"),
                 "min_y": float("inf"),
@@ -69,6 +98,10 @@ def update_region_data(region_data, point):
     region_data["11"] += x_coordinate * y_coordinate
     region_data["20"] += x_coordinate * x_coordinate
     region_data["02"] += y_coordinate * y_coordinate
+    region_data["30"] += x_coordinate * x_coordinate * x_coordinate
+    region_data["21"] += x_coordinate * x_coordinate * y_coordinate
+    region_data["12"] += x_coordinate * y_coordinate * y_coordinate
+    region_data["03"] += y_coordinate * y_coordinate * y_coordinate
     region_data["min_x"] = min(region_data["min_x"], x_coordinate)
     region_data["max_x"] = max(region_data["max_x"], x_coordinate)
     region_data["min_y"] = min(region_data["min_y"], y_coordinate)
@@ -89,6 +122,10 @@ def get_region_characteristics(region_data):
             theta: The orientation of the region.
             phi_1: First Hu moment.
             phi_2: Second Hu moment.
+            phi_3 to phi_7: The rest of the Hu moments.
+            width: Width of the bounding box.
+            height: Height of the bounding box.
+            min_x, max_x, min_y, max_y: Bounds of the region.
     """
 
     # Location of the region.
@@ -118,69 +155,1980 @@ def get_region_characteristics(region_data):
         "theta": theta,
         "phi_1": phi_1,
         "phi_2": phi_2,
+        **get_higher_hu_moments(region_data),
         "width": region_data["max_x"] - region_data["min_x"],
         "height": region_data["max_y"] - region_data["min_y"],
+        "min_x": region_data["min_x"],
+        "max_x": region_data["max_x"],
+        "min_y": region_data["min_y"],
+        "max_y": region_data["max_y"],
     }
 
 
-def region_expander(image, seed_coordinates_list, intensity_threshold):
+def get_higher_hu_moments(region_data):
     """
-    Expands regions given a grayscale image, a threshold and a list of seeds.
+    Calculate the third to seventh Hu moments of a region given its moments.
+    Unlike phi_1 and phi_2, which keep the integer centroid the training data
+    was gathered with, these use the exact centroid.
+
+    Arguments:
+        region_data {dictionary} -- Contains the ordinary moments up to the
+            third order.
+
+    Returns:
+        Dictionary -- Contains phi_3, phi_4, phi_5, phi_6 and phi_7.
+    """
+
+    m_00 = region_data["00"]
+    x_mean = region_data["10"] / m_00
+    y_mean = region_data["01"] / m_00
+
+    # Centralized moments.
+    mu_11 = region_data["11"] - x_mean * region_data["01"]
+    mu_20 = region_data["20"] - x_mean * region_data["10"]
+    mu_02 = region_data["02"] - y_mean * region_data["01"]
+    mu_30 = (
+        region_data["30"]
+        - 3 * x_mean * region_data["20"]
+        + 2 * x_mean ** 2 * region_data["10"]
+    )
+    mu_03 = (
+        region_data["03"]
+        - 3 * y_mean * region_data["02"]
+        + 2 * y_mean ** 2 * region_data["01"]
+    )
+    mu_21 = (
+        region_data["21"]
+        - 2 * x_mean * region_data["11"]
+        - y_mean * region_data["20"]
+        + 2 * x_mean ** 2 * region_data["01"]
+    )
+    mu_12 = (
+        region_data["12"]
+        - 2 * y_mean * region_data["11"]
+        - x_mean * region_data["02"]
+        + 2 * y_mean ** 2 * region_data["10"]
+    )
+
+    # Normalized moments.
+    nu_11 = mu_11 / m_00 ** 2
+    nu_20 = mu_20 / m_00 ** 2
+    nu_02 = mu_02 / m_00 ** 2
+    nu_30 = mu_30 / m_00 ** 2.5
+    nu_03 = mu_03 / m_00 ** 2.5
+    nu_21 = mu_21 / m_00 ** 2.5
+    nu_12 = mu_12 / m_00 ** 2.5
+
+    # Repeated terms.
+    a = nu_30 - 3 * nu_12
+    b = 3 * nu_21 - nu_03
+    c = nu_30 + nu_12
+    d = nu_21 + nu_03
+
+    return {
+        "phi_3": a ** 2 + b ** 2,
+        "phi_4": c ** 2 + d ** 2,
+        "phi_5": a * c * (c ** 2 - 3 * d ** 2) + b * d * (3 * c ** 2 - d ** 2),
+        "phi_6": (nu_20 - nu_02) * (c ** 2 - d ** 2) + 4 * nu_11 * c * d,
+        "phi_7": b * c * (c ** 2 - 3 * d ** 2) - a * d * (3 * c ** 2 - d ** 2),
+    }
+
+
+def translate_region_data(region_data, x_offset, y_offset):
+    """
+    Moves the moments of a region to another origin, for example from the
+    coordinates of a crop to the coordinates of the full image.
+
+    Arguments:
+        region_data {dictionary} -- The region data, see `update_region_data`.
+        x_offset {integer} -- Amount added to the x coordinates.
+        y_offset {integer} -- Amount added to the y coordinates.
+
+    Returns:
+        Dictionary -- The translated region data.
+    """
+
+    a = x_offset
+    b = y_offset
+    m = region_data
+
+    return {
+        **region_data,
+        "10": m["10"] + a * m["00"],
+        "01": m["01"] + b * m["00"],
+        "11": m["11"] + a * m["01"] + b * m["10"] + a * b * m["00"],
+        "20": m["20"] + 2 * a * m["10"] + a * a * m["00"],
+        "02": m["02"] + 2 * b * m["01"] + b * b * m["00"],
+        "30": m["30"] + 3 * a * m["20"] + 3 * a * a * m["10"] + a ** 3 * m["00"],
+        "21": m["21"]
+        + b * m["20"]
+        + 2 * a * m["11"]
+        + 2 * a * b * m["10"]
+        + a * a * m["01"]
+        + a * a * b * m["00"],
+        "12": m["12"]
+        + a * m["02"]
+        + 2 * b * m["11"]
+        + 2 * a * b * m["01"]
+        + b * b * m["10"]
+        + a * b * b * m["00"],
+        "03": m["03"] + 3 * b * m["02"] + 3 * b * b * m["01"] + b ** 3 * m["00"],
+        "min_x": m["min_x"] + a,
+        "max_x": m["max_x"] + a,
+        "min_y": m["min_y"] + b,
+        "max_y": m["max_y"] + b,
+    }
+
+
+def exceeds_budget(budget, area, width, height, visited_count):
+    """
+    Checks whether a region being expanded went over its budget.
+
+    Arguments:
+        budget {dictionary} -- Can contain any of max_area, max_width,
+            max_height and max_visited, missing or None limits are ignored.
+            None means there is no budget.
+        area {integer} -- Pixels in the region so far.
+        width {integer} -- Width of the bounding box so far.
+        height {integer} -- Height of the bounding box so far.
+        visited_count {integer} -- Pixels examined so far.
+
+    Returns:
+        Boolean -- True if any of the limits was exceeded.
+    """
+
+    if budget is None:
+        return False
+
+    for key, value in (
+        ("max_area", area),
+        ("max_width", width),
+        ("max_height", height),
+        ("max_visited", visited_count),
+    ):
+        limit = budget.get(key)
+        if limit is not None and value > limit:
+            return True
+
+    return False
+
+
+def expand_region_reference(
+    image,
+    seed_coordinates,
+    intensity_threshold,
+    visited,
+    result_image,
+    color,
+    budget=None,
+):
+    """
+    Expands a single region pixel by pixel, reference implementation of
+    the region growing. The visited pixels counted for the budget are the
+    region pixels and the neighbours checked.
+
+    Arguments:
+        image {np.array} -- the original image in grayscale.
+        seed_coordinates {tuple} -- x, y coordinates of the seed.
+        intensity_threshold {number} -- the maximum intensity difference of the seed
+            and any neighbour pixel.
+        visited {np.array} -- visited matrix (booleans), updated in place.
+        result_image {np.array} -- image where the region is painted.
+        color {tuple} -- the color used to paint the region.
+        budget {dictionary} -- Limits of the region, see `exceeds_budget`.
+
+    Returns:
+        Dictionary -- The region data, see `update_region_data`. Contains
+            overflowed: True when the expansion stopped because the region
+            exceeded the budget.
+    """
+
+    pending_points = []
+    region_data = {}
+
+    x_seed, y_seed = seed_coordinates
+    seed_intensity = image[y_seed][x_seed]
+
+    pending_points.append((x_seed, y_seed, seed_intensity))
+    visited_count = 1
+
+    while len(pending_points) > 0:
+        current_point = pending_points.pop(0)
+        current_x, current_y, _ = current_point
+
+        result_image[current_y][current_x] = color
+        update_region_data(region_data, current_point)
+
+        neighbours = get_neighbours(current_point, image, visited)
+        visited_count += len(neighbours)
+
+        for neighbour in neighbours:
+            intensity = neighbour[2]
+            distance = abs(int(seed_intensity) - int(intensity))
+            if distance <= intensity_threshold:
+                pending_points.append(neighbour)
+
+        if budget is not None and exceeds_budget(
+            budget,
+            region_data["00"],
+            region_data["max_x"] - region_data["min_x"] + 1,
+            region_data["max_y"] - region_data["min_y"] + 1,
+            visited_count,
+        ):
+            region_data["overflowed"] = True
+            break
+
+    return region_data
+
+
+def get_fillable_row(image, y, seed_intensity, intensity_threshold, visited):
+    """
+    Gets which pixels of a row are unvisited and have an intensity within the
+    threshold of the seed intensity.
+
+    Arguments:
+        image {np.array} -- the original image in grayscale.
+        y {integer} -- the row.
+        seed_intensity {number} -- the intensity of the seed.
+        intensity_threshold {number} -- the maximum intensity difference.
+        visited {np.array} -- visited matrix, any non zero value is visited.
+
+    Returns:
+        np.array -- Boolean mask of the row.
+    """
+
+    distance = np.abs(image[y].astype(np.int32) - int(seed_intensity))
+
+    return (distance <= intensity_threshold) & np.logical_not(visited[y])
+
+
+def get_runs(mask_row):
+    """
+    Gets the runs of consecutive True values of a boolean row.
+
+    Arguments:
+        mask_row {np.array} -- the boolean row.
+
+    Returns:
+        Tuple -- Lists with the first and last (inclusive) index of each run.
+    """
+
+    padded = np.concatenate(([False], mask_row, [False]))
+    changes = np.flatnonzero(padded[1:] != padded[:-1])
+
+    return changes[0::2].tolist(), (changes[1::2] - 1).tolist()
+
+
+def get_runs_region_data(ys, starts, ends):
+    """
+    Calculates the region data of a region made of horizontal runs, using the
+    closed forms of the sums of x, x ** 2 and x ** 3 over each run.
+
+    Arguments:
+        ys {np.array} -- the row of each run.
+        starts {np.array} -- the first x coordinate of each run.
+        ends {np.array} -- the last x coordinate (inclusive) of each run.
+
+    Returns:
+        Dictionary -- The region data, see `update_region_data`.
+    """
+
+    ys = np.asarray(ys, np.int64)
+    starts = np.asarray(starts, np.int64)
+    ends = np.asarray(ends, np.int64)
+
+    counts = ends - starts + 1
+    sum_x = (starts + ends) * counts // 2
+    sum_xx = (
+        ends * (ends + 1) * (2 * ends + 1) - (starts - 1) * starts * (2 * starts - 1)
+    ) // 6
+    sum_xxx = (ends * (ends + 1) // 2) ** 2 - ((starts - 1) * starts // 2) ** 2
+
+    return {
+        "00": int(counts.sum()),
+        "10": int(sum_x.sum()),
+        "01": int((ys * counts).sum()),
+        "11": int((ys * sum_x).sum()),
+        "20": int(sum_xx.sum()),
+        "02": int((ys * ys * counts).sum()),
+        "30": int(sum_xxx.sum()),
+        "21": int((ys * sum_xx).sum()),
+        "12": int((ys * ys * sum_x).sum()),
+        "03": int((ys * ys * ys * counts).sum()),
+        "min_x": int(starts.min()),
+        "max_x": int(ends.max()),
+        "min_y": int(ys.min()),
+        "max_y": int(ys.max()),
+    }
+
+
+def grow_runs(
+    image, seed_coordinates, intensity_threshold, visited, budget=None, row_width=None
+):
+    """
+    Finds the runs of a region. Each row is split in runs of consecutive
+    fillable pixels with NumPy, the first time the region reaches it, and the
+    region grows through the runs that overlap in adjacent rows, which is
+    equivalent to growing with 4-connectivity. The seed always belongs to the
+    region, even if it is visited.
+    The visited pixels counted for the budget are the pixels of the rows
+    split in runs.
 
     Arguments:
         image {np.array} -- the original image in grayscale.
+        seed_coordinates {tuple} -- x, y coordinates of the seed.
         intensity_threshold {number} -- the maximum intensity difference of the seed
             and any neighbour pixel.
+        visited {np.array} -- visited matrix, any non zero value is visited.
+        budget {dictionary} -- Limits of the region, see `exceeds_budget`.
+        row_width {integer} -- The pixels counted as visited per row, when
+            image is a window of the frame. Defaults to the image width.
 
     Returns:
         Tuple -- Contains:
-            result_image: An image with the found regions marked with white.
-            found_regions: An array of dictionaries containing the characteristics
-                of the fount regions.
+            ys, run_starts, run_ends: Lists with the row, the first x and the
+                last x (inclusive) of each run.
+            overflowed: True when the growth stopped because the region
+                exceeded the budget.
+    """
+
+    height = len(image)
+    x_seed, y_seed = seed_coordinates
+    seed_intensity = image[y_seed][x_seed]
+
+    # The runs of every row are computed against the visited matrix as it is
+    # when the row is first reached, it must not change during the expansion.
+    row_runs = {}
+
+    def get_runs_of(y):
+        if y not in row_runs:
+            row_runs[y] = get_runs(
+                get_fillable_row(image, y, seed_intensity, intensity_threshold, visited)
+            )
+        return row_runs[y]
+
+    width = row_width or len(image[0])
+    area = 0
+    min_x = max_x = x_seed
+    min_y = max_y = y_seed
+    overflowed = False
+
+    # The seed always belongs to the region.
+    fillable = get_fillable_row(
+        image, y_seed, seed_intensity, intensity_threshold, visited
+    )
+    fillable[x_seed] = True
+    row_runs[y_seed] = get_runs(fillable)
+
+    seed_run = (y_seed, bisect_right(row_runs[y_seed][0], x_seed) - 1)
+    pending_runs = deque([seed_run])
+    queued_runs = {seed_run}
+
+    ys = []
+    run_starts = []
+    run_ends = []
+
+    while pending_runs:
+        y, index = pending_runs.popleft()
+        starts, ends = row_runs[y]
+        x_start = starts[index]
+        x_end = ends[index]
+
+        ys.append(y)
+        run_starts.append(x_start)
+        run_ends.append(x_end)
+
+        if budget is not None:
+            area += x_end - x_start + 1
+            min_x = min(min_x, x_start)
+            max_x = max(max_x, x_end)
+            min_y = min(min_y, y)
+            max_y = max(max_y, y)
+            if exceeds_budget(
+                budget,
+                area,
+                max_x - min_x + 1,
+                max_y - min_y + 1,
+                len(row_runs) * width,
+            ):
+                overflowed = True
+                break
+
+        for neighbour_y in (y - 1, y + 1):
+            if not 0 <= neighbour_y < height:
+                continue
+
+            neighbour_starts, neighbour_ends = get_runs_of(neighbour_y)
+
+            # Runs that overlap [x_start, x_end].
+            neighbour_index = bisect_left(neighbour_ends, x_start)
+            while (
+                neighbour_index < len(neighbour_starts)
+                and neighbour_starts[neighbour_index] <= x_end
+            ):
+                run = (neighbour_y, neighbour_index)
+                if run not in queued_runs:
+                    queued_runs.add(run)
+                    pending_runs.append(run)
+                neighbour_index += 1
+
+    return ys, run_starts, run_ends, overflowed
+
+
+def expand_region_scanline(
+    image,
+    seed_coordinates,
+    intensity_threshold,
+    visited,
+    result_image,
+    color,
+    budget=None,
+    row_width=None,
+):
+    """
+    Expands a single region run by run, see `grow_runs`.
+    Produces the same result_image, visited matrix and region data as
+    `expand_region_reference`, including that the seed is counted twice
+    whenever the region has more pixels and that the rejected neighbours of
+    the region are marked as visited.
+
+    Arguments:
+        image {np.array} -- the original image in grayscale.
+        seed_coordinates {tuple} -- x, y coordinates of the seed.
+        intensity_threshold {number} -- the maximum intensity difference of the seed
+            and any neighbour pixel.
+        visited {np.array} -- visited matrix (booleans), updated in place.
+        result_image {np.array} -- image where the region is painted.
+        color {tuple} -- the color used to paint the region.
+        budget {dictionary} -- Limits of the region, see `exceeds_budget`.
+        row_width {integer} -- The pixels counted as visited per row, see
+            `grow_runs`.
 
+    Returns:
+        Dictionary -- The region data, see `update_region_data`. Contains
+            overflowed: True when the expansion stopped because the region
+            exceeded the budget.
+    """
+
+    height = len(image)
+    x_seed, y_seed = seed_coordinates
+    seed_was_visited = bool(visited[y_seed][x_seed])
+
+    # The visited matrix is only updated once the region is complete.
+    ys, run_starts, run_ends, overflowed = grow_runs(
+        image, seed_coordinates, intensity_threshold, visited, budget, row_width
+    )
+
+    for y, x_start, x_end in zip(ys, run_starts, run_ends):
+        result_image[y, x_start : x_end + 1] = color
+
+        # Mark the region and every neighbour of it as visited.
+        visited[y, max(x_start - 1, 0) : x_end + 2] = True
+        if y > 0:
+            visited[y - 1, x_start : x_end + 1] = True
+        if y < height - 1:
+            visited[y + 1, x_start : x_end + 1] = True
+
+    region_data = get_runs_region_data(ys, run_starts, run_ends)
+    revisit_seed(region_data, seed_coordinates, seed_was_visited, visited)
+
+    if overflowed:
+        region_data["overflowed"] = True
+
+    return region_data
+
+
+def revisit_seed(region_data, seed_coordinates, seed_was_visited, visited):
+    """
+    Reproduces how `expand_region_reference` treats the seed, which is not
+    marked as visited when the expansion starts: unless the seed was already
+    visited it is counted again when its first neighbour is processed, and it
+    stays unvisited when the region has no other pixel.
+
+    Arguments:
+        region_data {dictionary} -- The region data, updated in place.
+        seed_coordinates {tuple} -- x, y coordinates of the seed.
+        seed_was_visited {boolean} -- Whether the seed was visited before
+            the expansion.
+        visited {np.array} -- visited matrix (booleans), updated in place.
+    """
+
+    if seed_was_visited:
+        return
+
+    x_seed, y_seed = seed_coordinates
+
+    if region_data["00"] == 1:
+        visited[y_seed][x_seed] = False
+    else:
+        update_region_data(region_data, (x_seed, y_seed, None))
+
+
+def get_mask_region_data(mask, x_offset=0, y_offset=0):
+    """
+    Calculates the region data of a region given as a boolean mask in bulk:
+    the moments with `cv2.moments` and the bounds from the extents of the
+    rows and columns that contain region pixels.
+
+    Arguments:
+        mask {np.array} -- the region pixels (booleans), must not be empty.
+        x_offset {integer} -- x coordinate of the mask origin in the image.
+        y_offset {integer} -- y coordinate of the mask origin in the image.
+
+    Returns:
+        Dictionary -- The region data, see `update_region_data`.
+    """
+
+    moments = cv2.moments(mask.view(np.uint8), True)
+    rows = np.flatnonzero(mask.any(axis=1))
+    columns = np.flatnonzero(mask.any(axis=0))
+
+    region_data = {
+        key: int(round(moments["m" + key]))
+        for key in ("00", "10", "01", "11", "20", "02", "30", "21", "12", "03")
+    }
+    region_data.update(
+        {
+            "min_x": int(columns[0]),
+            "max_x": int(columns[-1]),
+            "min_y": int(rows[0]),
+            "max_y": int(rows[-1]),
+        }
+    )
+
+    return translate_region_data(region_data, x_offset, y_offset)
+
+
+def expand_region_opencv(
+    image,
+    seed_coordinates,
+    intensity_threshold,
+    visited,
+    result_image,
+    color,
+    budget=None,
+):
+    """
+    Expands a single region with `cv2.floodFill`, using a fixed range around
+    the seed intensity and 4-connectivity. The visited pixels are passed as
+    the flood fill mask so they block the expansion, and the moments are
+    calculated from the filled mask.
+    Produces the same result as `expand_region_reference` for non negative
+    thresholds.
+    The flood fill can't be stopped, so a max_width or max_height budget
+    limits it to a window around the seed just big enough to detect that the
+    region exceeded them. The visited pixels counted for the budget are the
+    region pixels and their neighbours.
+
+    Arguments:
+        image {np.array} -- the original image in grayscale (uint8).
+        seed_coordinates {tuple} -- x, y coordinates of the seed.
+        intensity_threshold {number} -- the maximum intensity difference of the seed
+            and any neighbour pixel.
+        visited {np.array} -- visited matrix (booleans), updated in place.
+        result_image {np.array} -- image where the region is painted.
+        color {tuple} -- the color used to paint the region.
+        budget {dictionary} -- Limits of the region, see `exceeds_budget`.
+
+    Returns:
+        Dictionary -- The region data, see `update_region_data`. Contains
+            overflowed: True when the expansion stopped because the region
+            exceeded the budget.
+    """
+
+    height, width = image.shape[:2]
+    x_seed, y_seed = seed_coordinates
+    seed_was_visited = bool(visited[y_seed][x_seed])
+
+    # Window of the image where the region can grow.
+    budget = budget or {}
+    max_width = budget.get("max_width")
+    max_height = budget.get("max_height")
+    window_x = 0 if max_width is None else max(x_seed - max_width, 0)
+    window_y = 0 if max_height is None else max(y_seed - max_height, 0)
+    window_width = width if max_width is None else min(x_seed + max_width + 1, width)
+    window_height = (
+        height if max_height is None else min(y_seed + max_height + 1, height)
+    )
+    window_width -= window_x
+    window_height -= window_y
+
+    window = (
+        slice(window_y, window_y + window_height),
+        slice(window_x, window_x + window_width),
+    )
+
+    # The flood fill mask must be 2 pixels bigger than the image.
+    mask = np.zeros((window_height + 2, window_width + 2), np.uint8)
+    mask[1:-1, 1:-1] = visited[window]
+    # The seed always belongs to the region.
+    mask[y_seed - window_y + 1, x_seed - window_x + 1] = 0
+
+    threshold = max(intensity_threshold, 0)
+    flags = (
+        4
+        | cv2.FLOODFILL_FIXED_RANGE
+        | cv2.FLOODFILL_MASK_ONLY
+        | (FLOOD_FILL_VALUE << 8)
+    )
+    _, _, _, (x, y, rect_width, rect_height) = cv2.floodFill(
+        image[window],
+        mask,
+        (x_seed - window_x, y_seed - window_y),
+        0,
+        threshold,
+        threshold,
+        flags,
+    )
+
+    # Work on the filled rectangle grown by one pixel for the neighbours.
+    x_start = max(x - 1, 0)
+    y_start = max(y - 1, 0)
+    x_end = min(x + rect_width + 1, window_width)
+    y_end = min(y + rect_height + 1, window_height)
+
+    region = mask[y_start + 1 : y_end + 1, x_start + 1 : x_end + 1] == FLOOD_FILL_VALUE
+
+    # Back to image coordinates.
+    x_start += window_x
+    x_end += window_x
+    y_start += window_y
+    y_end += window_y
+
+    result_image[y_start:y_end, x_start:x_end][region] = color
+
+    # Mark the region and every neighbour of it as visited.
+    neighbourhood = cv2.dilate(region.astype(np.uint8), CROSS_KERNEL)
+    visited[y_start:y_end, x_start:x_end] |= neighbourhood.astype(bool)
+
+    region_data = get_mask_region_data(region, x_start, y_start)
+    revisit_seed(region_data, seed_coordinates, seed_was_visited, visited)
+
+    if exceeds_budget(
+        budget,
+        region_data["00"],
+        region_data["max_x"] - region_data["min_x"] + 1,
+        region_data["max_y"] - region_data["min_y"] + 1,
+        int(np.count_nonzero(neighbourhood)),
+    ):
+        region_data["overflowed"] = True
+
+    return region_data
+
+
+# Available implementations of the expansion of a single region.
+region_expansion_backends = {
+    "reference": expand_region_reference,
+    "scanline": expand_region_scanline,
+    "opencv": expand_region_opencv,
+}
+
+
+def grow_regions(
+    image,
+    seed_coordinates_list,
+    intensity_threshold,
+    expand_region,
+    budget,
+    result_image,
+    visited=None,
+    region_colors=None,
+):
+    """
+    Expands every seed in order on a shared visited matrix.
+
+    Arguments:
+        image {np.array} -- the original image in grayscale.
+        seed_coordinates_list {list} -- x, y coordinates of the seeds.
+        intensity_threshold {number} -- the maximum intensity difference of the seed
+            and any neighbour pixel.
+        expand_region {function} -- One of `region_expansion_backends`.
+        budget {dictionary} -- Limits of each region, see `exceeds_budget`.
+        result_image {np.array} -- image where the regions are painted.
+        visited {np.array} -- Visited matrix to use, all False. Defaults to
+            a new one.
+        region_colors {list} -- The colors the regions are painted with, in
+            turns. Defaults to red and green.
+
+    Returns:
+        List -- The region data of each seed, see `update_region_data`.
     """
 
     height = len(image)
     width = len(image[0])
     # Paint each region with a different object, we have only two regions
-    region_colors = [(255, 0, 0), (0, 255, 0)]
+    if region_colors is None:
+        region_colors = [(255, 0, 0), (0, 255, 0)]
 
     # Generate a visited list with the same dimensions as the original image.
-    visited = np.full((height, width), False)
-
-    # Generate a blank image to draw the points on.
-    result_image = np.zeros((height, width, 3), np.uint8)
+    if visited is None:
+        visited = np.full((height, width), False)
 
-    found_regions = []
+    regions_data = []
     color_selector = 0
 
     for seed_coordinates in seed_coordinates_list:
-        pending_points = []
-        region_data = {}
+        region_data = expand_region(
+            image,
+            seed_coordinates,
+            intensity_threshold,
+            visited,
+            result_image,
+            region_colors[color_selector],
+            budget,
+        )
+        regions_data.append(region_data)
 
-        x_seed, y_seed = seed_coordinates
-        seed_intensity = image[y_seed][x_seed]
+        color_selector = (color_selector + 1) % len(region_colors)
+
+    return regions_data
+
+
+def get_regions_roi(regions, image_shape, margin):
+    """
+    Gets the region of interest that contains a set of regions, usually the
+    ones found in the previous frame.
+
+    Arguments:
+        regions {list} -- The characteristics of the regions, as returned by
+            `region_expander`. Overflowed regions are ignored.
+        image_shape {tuple} -- The height and width of the image.
+        margin {integer} -- Pixels added around the bounds of the regions.
+
+    Returns:
+        Tuple -- x_start, y_start, x_end, y_end of the region of interest
+            (ends excluded), None if there are no regions.
+    """
+
+    regions = [region for region in regions if not region.get("overflowed", False)]
+    if not regions:
+        return None
+
+    height, width = image_shape[:2]
+
+    return (
+        max(min(region["min_x"] for region in regions) - margin, 0),
+        max(min(region["min_y"] for region in regions) - margin, 0),
+        min(max(region["max_x"] for region in regions) + margin + 1, width),
+        min(max(region["max_y"] for region in regions) + margin + 1, height),
+    )
+
+
+def touches_roi_border(region_data, roi, image_shape):
+    """
+    Checks whether a region grown inside a region of interest reaches any of
+    its borders that is not a border of the image too, in which case the
+    region could continue outside of it.
+
+    Arguments:
+        region_data {dictionary} -- The region data in image coordinates.
+        roi {tuple} -- x_start, y_start, x_end, y_end of the region of interest.
+        image_shape {tuple} -- The height and width of the image.
+
+    Returns:
+        Boolean -- True if the region reaches an inner border.
+    """
+
+    x_start, y_start, x_end, y_end = roi
+    height, width = image_shape[:2]
+
+    return (
+        (x_start > 0 and region_data["min_x"] == x_start)
+        or (y_start > 0 and region_data["min_y"] == y_start)
+        or (x_end < width and region_data["max_x"] == x_end - 1)
+        or (y_end < height and region_data["max_y"] == y_end - 1)
+    )
+
+
+class SegmentationContext:
+    """
+    Buffers reused by `region_expander` on consecutive frames: the visited
+    matrix, the result image and a grayscale image. They are allocated once
+    per frame shape, and between frames only the bounding boxes of the
+    regions found (grown by the pixel of neighbours that the expansion
+    marks as visited) are cleared, instead of allocating and zeroing whole
+    frames.
+    The result is either the usual BGR image or, when nobody displays it,
+    a single channel label mask with the number of the seed (1 for the
+    first one) that reached each pixel, which skips painting 3 channels.
+
+    Parameters:
+        output {string} -- "image" (default) or "labels".
+    """
+
+    def __init__(self, output="image"):
+        if output not in ("image", "labels"):
+            raise ValueError("FAILURE: unknown segmentation output " + output)
+
+        self.output = output
+        self.shape = None
+        self.visited = None
+        self.result_image = None
+        self.gray_image = None
+        # y_start, y_end, x_start, x_end of the areas to clear.
+        self.touched = []
+
+    def prepare(self, shape):
+        """
+        Gets clean buffers for a frame.
+
+        Arguments:
+            shape {tuple} -- The height and width of the frame.
+
+        Returns:
+            Tuple -- The visited matrix and the result image.
+        """
+
+        if shape != self.shape:
+            self.shape = shape
+            self.visited = np.full(shape, False)
+            if self.output == "labels":
+                self.result_image = np.zeros(shape, np.int32)
+            else:
+                self.result_image = np.zeros(shape + (3,), np.uint8)
+            self.touched = []
+        else:
+            self.reset()
+
+        return self.visited, self.result_image
+
+    def get_region_colors(self, seed_count):
+        """
+        Gets the color of each region: the label of each seed in labels
+        output, red and green in turns otherwise.
+        """
+
+        if self.output == "labels":
+            return list(range(1, seed_count + 1)) or [1]
+
+        return [(255, 0, 0), (0, 255, 0)]
+
+    def mark(self, regions_data):
+        """
+        Remembers the areas of the buffers that some regions touched.
+
+        Arguments:
+            regions_data {list} -- The region data in frame coordinates.
+        """
+
+        height, width = self.shape
+        for region_data in regions_data:
+            self.touched.append(
+                (
+                    max(region_data["min_y"] - 1, 0),
+                    min(region_data["max_y"] + 2, height),
+                    max(region_data["min_x"] - 1, 0),
+                    min(region_data["max_x"] + 2, width),
+                )
+            )
 
-        pending_points.append((x_seed, y_seed, seed_intensity))
+    def reset(self):
+        """
+        Clears the touched areas of the buffers.
+        """
 
-        while len(pending_points) > 0:
-            current_point = pending_points.pop(0)
-            current_x, current_y, _ = current_point
+        for y_start, y_end, x_start, x_end in self.touched:
+            self.visited[y_start:y_end, x_start:x_end] = False
+            self.result_image[y_start:y_end, x_start:x_end] = 0
+        self.touched = []
 
-            result_image[current_y][current_x] = region_colors[color_selector]
-            update_region_data(region_data, current_point)
+    def get_gray_buffer(self, shape):
+        """
+        Gets the reused buffer for the grayscale image of a frame, its
+        contents are only valid until the next frame.
+
+        Arguments:
+            shape {tuple} -- The height and width of the frame.
+        """
+
+        if self.gray_image is None or self.gray_image.shape != shape:
+            self.gray_image = np.empty(shape, np.uint8)
+
+        return self.gray_image
+
+
+@metrics.timed("segmentation")
+def region_expander(
+    image,
+    seed_coordinates_list,
+    intensity_threshold,
+    backend="scanline",
+    budget=None,
+    roi=None,
+    context=None,
+):
+    """
+    Expands regions given a grayscale image, a threshold and a list of seeds.
+
+    Arguments:
+        image {np.array} -- the original image in grayscale.
+        intensity_threshold {number} -- the maximum intensity difference of the seed
+            and any neighbour pixel.
+        backend {string} -- The implementation used to expand each region,
+            one of `region_expansion_backends`: "scanline" (default),
+            "opencv" or the pixel by pixel "reference".
+        budget {dictionary} -- Limits of each region, see `exceeds_budget`.
+            A region that exceeds them stops growing and is reported with
+            overflowed set, its characteristics are only partial.
+        roi {tuple} -- x_start, y_start, x_end, y_end of a region of interest,
+            see `get_regions_roi`. The regions only grow inside of it, unless
+            a seed falls outside or a region reaches its border, in which
+            case the whole image is used. The results are the same as
+            without it.
+        context {SegmentationContext} -- Buffers reused between calls, see
+            `SegmentationContext`. When given, the returned image is one of
+            its buffers and is only valid until the next call.
+
+    Returns:
+        Tuple -- Contains:
+            result_image: An image with the found regions marked with white,
+                or the label mask when the context outputs labels.
+            found_regions: An array of dictionaries containing the characteristics
+                of the fount regions and whether they overflowed.
 
-            for neighbour in get_neighbours(current_point, image, visited):
-                intensity = neighbour[2]
-                distance = abs(int(seed_intensity) - int(intensity))
-                if distance <= intensity_threshold:
-                    pending_points.append(neighbour)
+    """
+
+    if backend not in region_expansion_backends:
+        raise ValueError("FAILURE: unknown region growing backend " + backend)
+    expand_region = region_expansion_backends[backend]
+
+    height = len(image)
+    width = len(image[0])
+
+    if context is None:
+        # Generate a blank image to draw the points on.
+        result_image = np.zeros((height, width, 3), np.uint8)
+        visited = None
+        region_colors = None
+    else:
+        visited, result_image = context.prepare((height, width))
+        region_colors = context.get_region_colors(len(seed_coordinates_list))
+
+    regions_data = None
+
+    if roi is not None and all(
+        roi[0] <= x < roi[2] and roi[1] <= y < roi[3] for x, y in seed_coordinates_list
+    ):
+        x_start, y_start, x_end, y_end = roi
+        window = (slice(y_start, y_end), slice(x_start, x_end))
+        expand_window = expand_region
+        if expand_region is expand_region_scanline:
+            # The visited rows count as whole frame rows, like without the ROI.
+            expand_window = functools.partial(expand_region, row_width=width)
+
+        regions_data = [
+            translate_region_data(region_data, x_start, y_start)
+            for region_data in grow_regions(
+                image[window],
+                [(x - x_start, y - y_start) for x, y in seed_coordinates_list],
+                intensity_threshold,
+                expand_window,
+                budget,
+                result_image[window],
+                None if visited is None else visited[window],
+                region_colors,
+            )
+        ]
+
+        if any(
+            touches_roi_border(region_data, roi, image.shape)
+            for region_data in regions_data
+        ):
+            # Widen to the whole image.
+            if context is None:
+                result_image[window] = 0
+            else:
+                context.mark(regions_data)
+                context.reset()
+            regions_data = None
+
+    if regions_data is None:
+        regions_data = grow_regions(
+            image,
+            seed_coordinates_list,
+            intensity_threshold,
+            expand_region,
+            budget,
+            result_image,
+            visited,
+            region_colors,
+        )
+
+    if context is not None:
+        context.mark(regions_data)
+
+    return result_image, get_found_regions(regions_data)
+
+
+def get_found_regions(regions_data):
+    """
+    Gets the characteristics of the regions that are not noise.
+
+    Arguments:
+        regions_data {list} -- The region data of each seed, None for the
+            seeds without region.
+
+    Returns:
+        List -- The characteristics of the regions with 100 pixels or more,
+            or that overflowed, and whether they overflowed.
+    """
+
+    found_regions = []
+
+    for region_data in regions_data:
+        if region_data is None:
+            continue
+
+        overflowed = region_data.get("overflowed", False)
+        # Ignore small regions which are most likely noise.
+        if region_data["00"] < 100 and not overflowed:
+            metrics.increment("regions_discarded")
+            continue
+
+        characteristics = get_region_characteristics(region_data)
+        characteristics["overflowed"] = overflowed
+        found_regions.append(characteristics)
+        metrics.increment("regions_found")
+
+    return found_regions
+
+
+def get_pyramid(image, levels):
+    """
+    Gets an image and its versions downsampled by half with `cv2.pyrDown`.
+
+    Arguments:
+        image {np.array} -- The grayscale image.
+        levels {integer} -- The number of downsampled versions.
+
+    Returns:
+        List -- The image first and then each downsampled version.
+    """
+
+    pyramid = [image]
+    for _ in range(levels):
+        pyramid.append(cv2.pyrDown(pyramid[-1]))
+
+    return pyramid
+
+
+def get_scaled_budget(budget, scale):
+    """
+    Gets the limits of a region downsampled by a factor.
+    """
+
+    if budget is None:
+        return None
+
+    area_scale = scale * scale
+    limits = {
+        "max_area": area_scale,
+        "max_width": scale,
+        "max_height": scale,
+        "max_visited": area_scale,
+    }
+
+    return {
+        key: None if budget.get(key) is None else max(budget[key] // factor, 1)
+        for key, factor in limits.items()
+    }
+
+
+def refine_region(
+    image,
+    coarse_labels,
+    coarse_region_data,
+    label,
+    scale,
+    band,
+    seed_coordinates,
+    intensity_threshold,
+):
+    """
+    Gets the full resolution mask of a region grown on a downsampled image.
+    The pixels farther than band from the upsampled region border keep the
+    side they are on, the ones in the band belong to the region if they
+    meet the threshold with the seed, like during the expansion. Only the
+    part 4-connected to the seed is kept, so band pixels that meet the
+    threshold but are cut off from the region don't join it.
+
+    Arguments:
+        image {np.array} -- The full resolution grayscale image.
+        coarse_labels {np.array} -- The labels of the downsampled regions.
+        coarse_region_data {dictionary} -- The region data of the
+            downsampled region, see `update_region_data`.
+        label {integer} -- The label of the region.
+        scale {integer} -- The downsampling factor.
+        band {integer} -- Half the width of the refined band, in pixels.
+        seed_coordinates {tuple} -- x, y coordinates of the seed.
+        intensity_threshold {number} -- the maximum intensity difference of
+            the seed and any region pixel.
+
+    Returns:
+        Tuple -- Contains:
+            mask: The region pixels (booleans) of the window.
+            x_start, y_start: The origin of the window in the image.
+    """
+
+    height, width = image.shape[:2]
+    margin = band // scale + 1
+
+    # Window of the region and its band, aligned to the downsampled pixels.
+    coarse_y_start = max(coarse_region_data["min_y"] - margin, 0)
+    coarse_x_start = max(coarse_region_data["min_x"] - margin, 0)
+    coarse_y_end = coarse_region_data["max_y"] + margin + 1
+    coarse_x_end = coarse_region_data["max_x"] + margin + 1
+    y_start = coarse_y_start * scale
+    x_start = coarse_x_start * scale
+    y_end = min(coarse_y_end * scale, height)
+    x_end = min(coarse_x_end * scale, width)
+
+    coarse_mask = (
+        coarse_labels[coarse_y_start:coarse_y_end, coarse_x_start:coarse_x_end]
+        == label
+    ).view(np.uint8)
+    mask = cv2.resize(
+        coarse_mask, None, fx=scale, fy=scale, interpolation=cv2.INTER_NEAREST
+    )[: y_end - y_start, : x_end - x_start]
+
+    kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (2 * band + 1, 2 * band + 1))
+    inside = cv2.erode(mask, kernel)
+    near = cv2.dilate(mask, kernel)
+
+    # Pixels within the threshold of the seed intensity, 255 in the mask.
+    x_seed, y_seed = seed_coordinates
+    seed_intensity = int(image[y_seed][x_seed])
+    similar = cv2.inRange(
+        image[y_start:y_end, x_start:x_end],
+        max(math.ceil(seed_intensity - intensity_threshold), 0),
+        min(math.floor(seed_intensity + intensity_threshold), 255),
+    )
+
+    region = cv2.bitwise_or(inside, cv2.bitwise_and(near, similar))
+
+    _, components = cv2.connectedComponents(region, connectivity=4)
+    seed_component = components[y_seed - y_start, x_seed - x_start]
+    if seed_component:
+        region = components == seed_component
+    else:
+        region = region.view(bool)
+
+    return region, x_start, y_start
+
+
+def expand_full_resolution(
+    image,
+    seed_coordinates,
+    intensity_threshold,
+    expand_region,
+    budget,
+    claimed,
+):
+    """
+    Expands a region at full resolution, for the seeds whose downsampled
+    region is not reliable, without entering the claimed pixels.
+
+    Arguments:
+        image {np.array} -- The full resolution grayscale image.
+        seed_coordinates {tuple} -- x, y coordinates of the seed.
+        intensity_threshold {number} -- the maximum intensity difference of
+            the seed and any neighbour pixel.
+        expand_region {function} -- One of `region_expansion_backends`.
+        budget {dictionary} -- Limits of the region, see `exceeds_budget`.
+        claimed {np.array} -- The pixels (booleans) of the previous regions.
+
+    Returns:
+        Tuple -- Contains:
+            mask: The region pixels (booleans) of the window, None if the
+                seed was claimed.
+            x_start, y_start: The origin of the window in the image.
+            region_data: The region data, see `update_region_data`.
+    """
+
+    x_seed, y_seed = seed_coordinates
+    if claimed[y_seed][x_seed]:
+        return None, 0, 0, None
+
+    labels = np.zeros(claimed.shape, np.uint8)
+    region_data = expand_region(
+        image,
+        seed_coordinates,
+        intensity_threshold,
+        claimed.copy(),
+        labels,
+        1,
+        budget,
+    )
+    window = (
+        slice(region_data["min_y"], region_data["max_y"] + 1),
+        slice(region_data["min_x"], region_data["max_x"] + 1),
+    )
+
+    return (
+        labels[window].view(bool),
+        region_data["min_x"],
+        region_data["min_y"],
+        region_data,
+    )
+
+
+@metrics.timed("segmentation")
+def region_expander_pyramid(
+    image,
+    seed_coordinates_list,
+    intensity_threshold,
+    levels=1,
+    backend="scanline",
+    budget=None,
+    pyramid=None,
+    band=None,
+):
+    """
+    Expands regions coarse to fine: the regions grow on the image
+    downsampled levels times, and only a band around their border is
+    refined at full resolution before calculating their characteristics.
+    The cost is close to the one of growing on the downsampled image while
+    the centroid and orientation are close to the full resolution ones.
+    Unlike `region_expander`, a pixel of the band joins a region only by
+    meeting the threshold with the seed, and each seed is counted once.
+    Seeds whose downsampled pixel is too far from their intensity, like at
+    the tip of thin figures, or whose downsampled region is too small to
+    be refined, grow at full resolution instead.
+
+    Arguments:
+        image {np.array} -- the original image in grayscale.
+        seed_coordinates_list {list} -- x, y coordinates of the seeds.
+        intensity_threshold {number} -- the maximum intensity difference of
+            the seed and any neighbour pixel.
+        levels {integer} -- Times the image is downsampled by half.
+            Defaults to 1.
+        backend {string} -- The implementation used to expand each region on
+            the downsampled image, see `region_expander`.
+        budget {dictionary} -- Limits of each region at full resolution, see
+            `exceeds_budget`.
+        pyramid {list} -- The image and its downsampled versions, see
+            `get_pyramid`. Computed when not given.
+        band {integer} -- Half the width of the refined band in pixels.
+            Defaults to twice the downsampling factor: after two or more
+            blurred halvings a band of the factor misses border pixels and
+            the Hu moments drift by 10-50%. With the default, 1 and 2 levels
+            match full resolution; 3 levels can still lose the thin parts
+            of long figures.
+
+    Returns:
+        Tuple -- Contains:
+            result_image: An image with the found regions painted.
+            found_regions: The characteristics of the found regions and
+                whether they overflowed, see `region_expander`.
+    """
+
+    if backend not in region_expansion_backends:
+        raise ValueError("FAILURE: unknown region growing backend " + backend)
+    expand_region = region_expansion_backends[backend]
+
+    scale = 1 << levels
+    band = 2 * scale if band is None else band
+    if pyramid is None or len(pyramid) <= levels:
+        pyramid = get_pyramid(image, levels)
+    coarse_image = pyramid[levels]
+    coarse_height, coarse_width = coarse_image.shape[:2]
+
+    height, width = image.shape[:2]
+    result_image = np.zeros((height, width, 3), np.uint8)
+    region_colors = [(255, 0, 0), (0, 255, 0)]
+
+    coarse_seeds = [
+        (min(x // scale, coarse_width - 1), min(y // scale, coarse_height - 1))
+        for x, y in seed_coordinates_list
+    ]
+    coarse_labels = np.zeros((coarse_height, coarse_width), np.int32)
+    coarse_regions_data = grow_regions(
+        coarse_image,
+        coarse_seeds,
+        intensity_threshold,
+        expand_region,
+        get_scaled_budget(budget, scale),
+        coarse_labels,
+        None,
+        list(range(1, len(seed_coordinates_list) + 1)),
+    )
+
+    # Pixels that already belong to a region.
+    claimed = np.zeros((height, width), bool)
+    regions_data = []
+
+    for index, seed_coordinates in enumerate(seed_coordinates_list):
+        coarse_region_data = coarse_regions_data[index]
+        x_seed, y_seed = seed_coordinates
+        x_coarse, y_coarse = coarse_seeds[index]
+        seed_difference = abs(
+            int(image[y_seed][x_seed]) - int(coarse_image[y_coarse][x_coarse])
+        )
+
+        region_data = None
+        if (
+            2 * seed_difference > intensity_threshold
+            or coarse_region_data["00"] * scale * scale < 100
+        ):
+            mask, x_start, y_start, region_data = expand_full_resolution(
+                image,
+                seed_coordinates,
+                intensity_threshold,
+                expand_region,
+                budget,
+                claimed,
+            )
+            if mask is None:
+                regions_data.append(None)
+                continue
+        else:
+            mask, x_start, y_start = refine_region(
+                image,
+                coarse_labels,
+                coarse_region_data,
+                index + 1,
+                scale,
+                band,
+                seed_coordinates,
+                intensity_threshold,
+            )
+
+        window = (
+            slice(y_start, y_start + mask.shape[0]),
+            slice(x_start, x_start + mask.shape[1]),
+        )
+        np.logical_and(mask, np.logical_not(claimed[window]), out=mask)
+        if not mask.any():
+            regions_data.append(None)
+            continue
+
+        np.logical_or(claimed[window], mask, out=claimed[window])
+        # The pixels of the mask are not painted yet, adding paints them.
+        color = np.array(region_colors[index % len(region_colors)], np.uint8)
+        result_image[window] += mask.view(np.uint8)[:, :, None] * color
+
+        if region_data is None:
+            region_data = get_mask_region_data(mask, x_start, y_start)
+            if coarse_region_data.get("overflowed", False):
+                region_data["overflowed"] = True
+        regions_data.append(region_data)
+
+    return result_image, get_found_regions(regions_data)
+
+
+def get_labels_region_data(labels, region_count):
+    """
+    Calculates the region data of every region of a label image at once,
+    with `np.bincount` over the labels of the labelled pixels.
+
+    Arguments:
+        labels {np.array} -- label image (integers), 0 is the background and
+            region i is labelled i.
+        region_count {integer} -- the highest label.
+
+    Returns:
+        List -- The region data of each region, see `update_region_data`,
+            region i is in the position i - 1. None for empty regions.
+    """
+
+    width = labels.shape[1]
+    indices = np.flatnonzero(labels)
+    region_labels = labels.ravel()[indices]
+    ys, xs = np.divmod(indices, width)
+
+    def sum_by_label(values):
+        return np.bincount(region_labels, values, region_count + 1)
+
+    def extreme_by_label(ufunc, values, initial):
+        extremes = np.full(region_count + 1, initial, np.int64)
+        ufunc.at(extremes, region_labels, values)
+        return extremes
+
+    bounds = {
+        "min_x": extreme_by_label(np.minimum, xs, width),
+        "max_x": extreme_by_label(np.maximum, xs, -1),
+        "min_y": extreme_by_label(np.minimum, ys, len(labels)),
+        "max_y": extreme_by_label(np.maximum, ys, -1),
+    }
+
+    xs = xs.astype(np.float64)
+    ys = ys.astype(np.float64)
+    moments = {
+        "00": np.bincount(region_labels, minlength=region_count + 1),
+        "10": sum_by_label(xs),
+        "01": sum_by_label(ys),
+        "11": sum_by_label(xs * ys),
+        "20": sum_by_label(xs * xs),
+        "02": sum_by_label(ys * ys),
+        "30": sum_by_label(xs * xs * xs),
+        "21": sum_by_label(xs * xs * ys),
+        "12": sum_by_label(xs * ys * ys),
+        "03": sum_by_label(ys * ys * ys),
+    }
+    sums = {**moments, **bounds}
+
+    regions_data = []
+    for label in range(1, region_count + 1):
+        if sums["00"][label] == 0:
+            regions_data.append(None)
+            continue
+        regions_data.append(
+            {key: int(round(values[label])) for key, values in sums.items()}
+        )
+
+    return regions_data
+
+
+@metrics.timed("segmentation")
+def label_regions(image, seed_coordinates_list, intensity_threshold, budget=None):
+    """
+    Grows every seed into a single label image and then calculates the data of
+    all the regions in one pass, so the cost of the statistics doesn't depend
+    on the number of seeds.
+    The growth itself is still one scanline fill per seed, because each
+    region is compared with the intensity of its own seed; only the
+    statistics are batched.
+    Unlike `region_expander`, only the pixels of a region are claimed: a region
+    stops at the pixels of previous regions but not at their rejected
+    neighbours, and seeds that fall in a previous region are ignored.
+
+    Arguments:
+        image {np.array} -- the original image in grayscale.
+        seed_coordinates_list {list} -- x, y coordinates of the seeds.
+        intensity_threshold {number} -- the maximum intensity difference of the seed
+            and any neighbour pixel.
+        budget {dictionary} -- Limits of each region, see `exceeds_budget`.
+
+    Returns:
+        Tuple -- Contains:
+            labels: int32 label image, region i (seed i - 1) is labelled i.
+            found_regions: An array of dictionaries containing the characteristics
+                of the found regions, with their label and whether they overflowed.
+    """
+
+    labels = np.zeros(image.shape[:2], np.int32)
+    overflowed_labels = set()
+
+    for label, (x_seed, y_seed) in enumerate(seed_coordinates_list, 1):
+        if labels[y_seed][x_seed]:
+            continue
+
+        ys, run_starts, run_ends, overflowed = grow_runs(
+            image, (x_seed, y_seed), intensity_threshold, labels, budget
+        )
+        if overflowed:
+            overflowed_labels.add(label)
+        for y, x_start, x_end in zip(ys, run_starts, run_ends):
+            labels[y, x_start : x_end + 1] = label
+
+    found_regions = []
+    regions_data = get_labels_region_data(labels, len(seed_coordinates_list))
+
+    for label, region_data in enumerate(regions_data, 1):
+        if region_data is None:
+            continue
+
+        overflowed = label in overflowed_labels
+        # Ignore small regions which are most likely noise.
+        if region_data["00"] < 100 and not overflowed:
+            metrics.increment("regions_discarded")
+            continue
+
+        characteristics = get_region_characteristics(region_data)
+        characteristics["label"] = label
+        characteristics["overflowed"] = overflowed
+        found_regions.append(characteristics)
+        metrics.increment("regions_found")
+
+    return labels, found_regions
+
+
+def get_tile_executor():
+    """
+    Gets the thread pool shared by the tiled segmentations, with one thread
+    per core, creating it the first time.
+
+    Returns:
+        ThreadPoolExecutor -- The shared pool.
+    """
+
+    global tile_executor
+
+    if tile_executor is None:
+        tile_executor = ThreadPoolExecutor(os.cpu_count())
+
+    return tile_executor
+
+
+class UnionFind:
+    """
+    Disjoint sets of hashable items, used to merge the parts of a region
+    labelled on different tiles. Items are added when first found.
+    """
+
+    def __init__(self):
+        self.parents = {}
+
+    def find(self, item):
+        """
+        Gets the representative item of the set of an item.
+        """
+
+        parents = self.parents
+        parents.setdefault(item, item)
+        while parents[item] != item:
+            # Path halving keeps the trees flat.
+            parents[item] = parents[parents[item]]
+            item = parents[item]
+
+        return item
+
+    def union(self, first, second):
+        """
+        Joins the sets of two items.
+        """
+
+        first_root = self.find(first)
+        second_root = self.find(second)
+        if first_root != second_root:
+            self.parents[second_root] = first_root
+
+
+def get_tile_window(tile, tile_size, image_shape):
+    """
+    Gets the slices of the pixels of a tile.
+
+    Arguments:
+        tile {tuple} -- The row and column of the tile.
+        tile_size {integer} -- The side of the tiles.
+        image_shape {tuple} -- The height and width of the image.
+
+    Returns:
+        Tuple -- The row and column slices.
+    """
+
+    row, column = tile
+    y_start = row * tile_size
+    x_start = column * tile_size
+
+    return (
+        slice(y_start, min(y_start + tile_size, image_shape[0])),
+        slice(x_start, min(x_start + tile_size, image_shape[1])),
+    )
+
+
+def label_tile(image, labels, window, lower, upper):
+    """
+    Labels the 4-connected components of the pixels of a tile whose
+    intensity is within some bounds and that no region claimed yet. Only
+    calls OpenCV functions and numpy comparisons, which release the GIL, so
+    tiles can be labelled on several threads.
+
+    Arguments:
+        image {np.array} -- the original image in grayscale (uint8).
+        labels {np.array} -- The label image of the claimed pixels.
+        window {tuple} -- The slices of the tile, see `get_tile_window`.
+        lower {integer} -- The minimum intensity.
+        upper {integer} -- The maximum intensity.
+
+    Returns:
+        Tuple -- Contains:
+            tile_labels: int32 label image of the tile, 0 is the background.
+            stats: The `cv2.connectedComponentsWithStats` stats of each
+                component: x, y, width, height and area in the tile.
+    """
+
+    mask = cv2.inRange(image[window], lower, upper)
+    # cv2.compare takes a 1x1 tile as an array of the size of the scalar.
+    unclaimed = np.equal(labels[window], 0).view(np.uint8)
+    cv2.bitwise_and(mask, unclaimed, dst=mask)
+    _, tile_labels, stats, _ = cv2.connectedComponentsWithStats(
+        mask, connectivity=4, ltype=cv2.CV_32S
+    )
+
+    return tile_labels, stats
+
+
+def merge_tile_borders(union_find, first_tile, second_tile, tiles):
+    """
+    Joins the components of two neighbour tiles that touch across their
+    shared border. Both components meet the same intensity bounds, so the
+    merged region keeps the seed intensity criterion.
+
+    Arguments:
+        union_find {UnionFind} -- The components, (tile, label) items.
+        first_tile {tuple} -- The row and column of a tile.
+        second_tile {tuple} -- The row and column of the tile below or to
+            the right of it.
+        tiles {dictionary} -- The `label_tile` results of each tile.
+    """
+
+    first_labels = tiles[first_tile][0]
+    second_labels = tiles[second_tile][0]
+    if first_tile[0] == second_tile[0]:
+        first_border = first_labels[:, -1]
+        second_border = second_labels[:, 0]
+    else:
+        first_border = first_labels[-1, :]
+        second_border = second_labels[0, :]
+
+    touching = (first_border > 0) & (second_border > 0)
+    pairs = np.unique(
+        np.stack([first_border[touching], second_border[touching]]), axis=1
+    )
+    for first_label, second_label in pairs.T:
+        union_find.union(
+            (first_tile, int(first_label)), (second_tile, int(second_label))
+        )
+
+
+def get_region_parts(union_find, seed_item, tiles):
+    """
+    Gets the components of every tile that belong to the region of a seed.
+
+    Arguments:
+        union_find {UnionFind} -- The components, (tile, label) items.
+        seed_item {tuple} -- The (tile, label) item of the seed component.
+        tiles {dictionary} -- The `label_tile` results of each tile.
+
+    Returns:
+        Dictionary -- The labels of the region components of each tile.
+    """
+
+    # Only the components on the tile borders can join other components.
+    root = union_find.find(seed_item)
+    parts = {}
+    for tile, label in list(union_find.parents.keys()):
+        if tile in tiles and union_find.find((tile, label)) == root:
+            parts.setdefault(tile, []).append(label)
+
+    return parts
+
+
+def get_parts_bounds(parts, tiles, tile_size):
+    """
+    Gets the area and the bounds of a region made of tile components.
+
+    Returns:
+        Tuple -- The area, min_x, max_x, min_y and max_y of the region.
+    """
+
+    area = 0
+    min_x = min_y = float("inf")
+    max_x = max_y = float("-inf")
+    for (row, column), tile_labels in parts.items():
+        stats = tiles[(row, column)][1][tile_labels]
+        area += int(stats[:, cv2.CC_STAT_AREA].sum())
+        x_offset = column * tile_size
+        y_offset = row * tile_size
+        min_x = min(min_x, x_offset + int(stats[:, cv2.CC_STAT_LEFT].min()))
+        min_y = min(min_y, y_offset + int(stats[:, cv2.CC_STAT_TOP].min()))
+        max_x = max(
+            max_x,
+            x_offset
+            + int((stats[:, cv2.CC_STAT_LEFT] + stats[:, cv2.CC_STAT_WIDTH]).max())
+            - 1,
+        )
+        max_y = max(
+            max_y,
+            y_offset
+            + int((stats[:, cv2.CC_STAT_TOP] + stats[:, cv2.CC_STAT_HEIGHT]).max())
+            - 1,
+        )
+
+    return area, min_x, max_x, min_y, max_y
+
+
+def get_expansion_tiles(parts, tiles, tile_grid):
+    """
+    Gets the tiles not labelled yet that a region can grow into: the
+    neighbours of the tiles where a region component reaches the border.
+
+    Arguments:
+        parts {dictionary} -- The region components, see `get_region_parts`.
+        tiles {dictionary} -- The `label_tile` results of each tile.
+        tile_grid {tuple} -- The number of rows and columns of tiles.
+
+    Returns:
+        List -- The row and column of each tile.
+    """
+
+    expansion = set()
+    for (row, column), tile_labels in parts.items():
+        tile_labels_image = tiles[(row, column)][0]
+        borders = (
+            tile_labels_image[:, -1],
+            tile_labels_image[-1, :],
+            tile_labels_image[:, 0],
+            tile_labels_image[0, :],
+        )
+        for (row_offset, column_offset), border in zip(TILE_NEIGHBOURS, borders):
+            neighbour = (row + row_offset, column + column_offset)
+            if (
+                neighbour in tiles
+                or neighbour in expansion
+                or not 0 <= neighbour[0] < tile_grid[0]
+                or not 0 <= neighbour[1] < tile_grid[1]
+            ):
+                continue
+            if np.isin(border, tile_labels).any():
+                expansion.add(neighbour)
+
+    return sorted(expansion)
+
+
+def claim_tile_part(labels, window, tile_result, tile_labels, label):
+    """
+    Labels the pixels of the region components of a tile and calculates
+    their region data.
+
+    Arguments:
+        labels {np.array} -- The label image, updated in place.
+        window {tuple} -- The slices of the tile, see `get_tile_window`.
+        tile_result {tuple} -- The `label_tile` result of the tile.
+        tile_labels {list} -- The labels of the region components.
+        label {integer} -- The label of the region.
+
+    Returns:
+        Dictionary -- The region data of the part, in image coordinates.
+    """
+
+    component_labels, stats = tile_result
+    stats = stats[tile_labels]
+    x_start = int(stats[:, cv2.CC_STAT_LEFT].min())
+    y_start = int(stats[:, cv2.CC_STAT_TOP].min())
+    x_end = int((stats[:, cv2.CC_STAT_LEFT] + stats[:, cv2.CC_STAT_WIDTH]).max())
+    y_end = int((stats[:, cv2.CC_STAT_TOP] + stats[:, cv2.CC_STAT_HEIGHT]).max())
+
+    is_part = np.zeros(len(tile_result[1]), bool)
+    is_part[tile_labels] = True
+    part = is_part[component_labels[y_start:y_end, x_start:x_end]]
+
+    tile_y, tile_x = window
+    labels[window][y_start:y_end, x_start:x_end][part] = label
+
+    return get_mask_region_data(part, tile_x.start + x_start, tile_y.start + y_start)
+
+
+def combine_region_data(parts_data):
+    """
+    Combines the region data of the parts of a region: the moments are
+    sums over the pixels, so they add up, and the bounds are the extremes.
+
+    Arguments:
+        parts_data {list} -- The region data of each part, in the same
+            coordinates.
+
+    Returns:
+        Dictionary -- The region data of the whole region.
+    """
+
+    region_data = {
+        key: sum(part_data[key] for part_data in parts_data)
+        for key in ("00", "10", "01", "11", "20", "02", "30", "21", "12", "03")
+    }
+    for key, extreme in (
+        ("min_x", min),
+        ("max_x", max),
+        ("min_y", min),
+        ("max_y", max),
+    ):
+        region_data[key] = extreme(part_data[key] for part_data in parts_data)
+
+    return region_data
+
+
+def grow_tiled_region(
+    image,
+    seed_coordinates,
+    intensity_threshold,
+    labels,
+    label,
+    budget,
+    tile_size,
+    executor,
+):
+    """
+    Grows the region of a seed tile by tile. Each wave labels, on the
+    thread pool, the tiles that the region reached the border of in the
+    previous wave, and the components are merged across the tile borders,
+    until the region stops reaching new tiles or exceeds the budget.
+    Finally the region pixels of every tile are labelled, also in parallel.
+    The visited pixels counted for the budget are the pixels of the
+    labelled tiles.
+
+    Arguments:
+        image {np.array} -- the original image in grayscale (uint8).
+        seed_coordinates {tuple} -- x, y coordinates of the seed.
+        intensity_threshold {number} -- the maximum intensity difference of the seed
+            and any region pixel.
+        labels {np.array} -- int32 label image, the labelled pixels are
+            claimed. Updated in place.
+        label {integer} -- The label of the region.
+        budget {dictionary} -- Limits of the region, see `exceeds_budget`.
+        tile_size {integer} -- The side of the tiles.
+        executor {Executor} -- The pool the tiles are processed on.
+
+    Returns:
+        Dictionary -- The region data, see `update_region_data`, None if
+            the seed doesn't meet the threshold. Contains overflowed: True
+            when the growth stopped because the region exceeded the budget.
+    """
+
+    height, width = image.shape[:2]
+    tile_grid = (math.ceil(height / tile_size), math.ceil(width / tile_size))
+    x_seed, y_seed = seed_coordinates
+    seed_intensity = int(image[y_seed][x_seed])
+    lower = max(math.ceil(seed_intensity - intensity_threshold), 0)
+    upper = min(math.floor(seed_intensity + intensity_threshold), 255)
+
+    def label_window(tile):
+        window = get_tile_window(tile, tile_size, image.shape)
+        return label_tile(image, labels, window, lower, upper)
+
+    seed_tile = (y_seed // tile_size, x_seed // tile_size)
+    tiles = {}
+    union_find = UnionFind()
+    wave = [seed_tile]
+    overflowed = False
+
+    while wave:
+        for tile, tile_result in zip(wave, executor.map(label_window, wave)):
+            tiles[tile] = tile_result
+
+        for row, column in wave:
+            for row_offset, column_offset in TILE_NEIGHBOURS:
+                neighbour = (row + row_offset, column + column_offset)
+                # Merge each pair of tiles once.
+                if neighbour not in tiles or (
+                    neighbour in wave and neighbour < (row, column)
+                ):
+                    continue
+                first_tile, second_tile = sorted([(row, column), neighbour])
+                merge_tile_borders(union_find, first_tile, second_tile, tiles)
+
+        seed_label = int(
+            tiles[seed_tile][0][y_seed % tile_size, x_seed % tile_size]
+        )
+        if seed_label == 0:
+            return None
+
+        parts = get_region_parts(union_find, (seed_tile, seed_label), tiles)
+        area, min_x, max_x, min_y, max_y = get_parts_bounds(parts, tiles, tile_size)
+        visited_count = sum(tile_result[0].size for tile_result in tiles.values())
+        if exceeds_budget(
+            budget, area, max_x - min_x + 1, max_y - min_y + 1, visited_count
+        ):
+            overflowed = True
+            break
+
+        wave = get_expansion_tiles(parts, tiles, tile_grid)
+
+    def claim_part(tile):
+        window = get_tile_window(tile, tile_size, image.shape)
+        return claim_tile_part(labels, window, tiles[tile], parts[tile], label)
+
+    region_data = combine_region_data(list(executor.map(claim_part, parts)))
+    region_data["overflowed"] = overflowed
+
+    return region_data
+
+
+def paint_labels(labels, region_count):
+    """
+    Paints the regions of a label image red and green in turns, like
+    `region_expander` does.
+
+    Arguments:
+        labels {np.array} -- label image, region i is labelled i.
+        region_count {integer} -- the highest label.
+
+    Returns:
+        np.array -- The BGR result image.
+    """
+
+    palette = np.zeros((region_count + 1, 3), np.uint8)
+    palette[1::2] = (255, 0, 0)
+    palette[2::2] = (0, 255, 0)
+
+    return palette[labels]
+
+
+@metrics.timed("segmentation")
+def label_regions_tiled(
+    image,
+    seed_coordinates_list,
+    intensity_threshold,
+    budget=None,
+    tile_size=TILE_SIZE,
+    executor=None,
+):
+    """
+    Grows every seed into a single label image like `label_regions`, but
+    the image is split in tiles that are labelled on a thread pool with
+    `cv2.connectedComponentsWithStats`, and the parts of a region on
+    different tiles are merged with union-find, see `grow_tiled_region`.
+    Seeds are still grown in order, so the regions match the ones of
+    `label_regions`, and the only parallelism is over the tiles a region
+    reaches in each wave, see `grow_tiled_region`: a region within one or
+    two tiles gets none, and the merging between waves runs on a single
+    thread. It only scales when the regions span several tiles per wave
+    (smaller tiles add merging work) and there are as many cores; for
+    regions of a few tiles the "opencv" backend of `region_expander` is
+    faster.
+    A region that exceeds the budget stops at the border of the tiles
+    labelled so far.
+
+    Arguments:
+        image {np.array} -- the original image in grayscale (uint8).
+        seed_coordinates_list {list} -- x, y coordinates of the seeds.
+        intensity_threshold {number} -- the maximum intensity difference of the seed
+            and any region pixel.
+        budget {dictionary} -- Limits of each region, see `exceeds_budget`.
+        tile_size {integer} -- The side of the tiles. Defaults to TILE_SIZE.
+        executor {Executor} -- The pool the tiles are processed on.
+            Defaults to the shared one, see `get_tile_executor`.
+
+    Returns:
+        Tuple -- Contains:
+            labels: int32 label image, region i (seed i - 1) is labelled i.
+            found_regions: An array of dictionaries containing the characteristics
+                of the found regions, with their label and whether they overflowed.
+    """
+
+    if tile_size < 1:
+        raise ValueError("FAILURE: the tile size must be positive")
+    executor = executor or get_tile_executor()
+
+    labels = np.zeros(image.shape[:2], np.int32)
+    found_regions = []
+
+    for label, (x_seed, y_seed) in enumerate(seed_coordinates_list, 1):
+        if labels[y_seed][x_seed]:
+            continue
+
+        region_data = grow_tiled_region(
+            image,
+            (x_seed, y_seed),
+            intensity_threshold,
+            labels,
+            label,
+            budget,
+            tile_size,
+            executor,
+        )
+        if region_data is None:
+            continue
 
-        color_selector = (color_selector + 1) % 2
         # Ignore small regions which are most likely noise.
-        if region_data["00"] < 100:
+        if region_data["00"] < 100 and not region_data["overflowed"]:
+            metrics.increment("regions_discarded")
             continue
 
-        found_regions.append(get_region_characteristics(region_data))
+        characteristics = get_region_characteristics(region_data)
+        characteristics["label"] = label
+        characteristics["overflowed"] = region_data["overflowed"]
+        found_regions.append(characteristics)
+        metrics.increment("regions_found")
 
-    return result_image, found_regions
+    return labels, found_regions
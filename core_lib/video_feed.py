@@ -1,31 +1,372 @@
 """
-Exports the VideoFeed class which allows reading frames from a camera.
+Exports the VideoFeed class which allows reading frames from a camera,
+along with feeds with the same interface that read frames from files.
 """
+import glob
+import json
+import math
+import os
+import threading
+import time
+from collections import deque
+from functools import cached_property
+
 import cv2
+import numpy as np
+
+from core_lib.colors import classify_pixels
+from core_lib.metrics import metrics
+from core_lib.seeds import get_default_color_config
+
+# Files of a recorded session.
+SESSION_FRAMES_FILE = "frames.bin"
+SESSION_INDEX_FILE = "index.json"
+
+
+def resize_to_width(image, width):
+    """
+    Resizes an image to a target width, maintaining the aspect ratio.
+
+    Arguments:
+        image {np.array} -- The image to resize.
+        width {integer} -- The target width, any negative number keeps the
+            original dimension.
+
+    Returns:
+        np.array -- The resized image, the same image if it already has the
+            target width.
+    """
+
+    # Get the target width.
+    width = len(image[0]) if width < 0 else width
+
+    if width == len(image[0]):
+        return image
+
+    with metrics.timer("resize"):
+        # Get the target height maintaining aspect ratio.
+        conversion_ration = width / len(image[0])
+        height = int(len(image) * conversion_ration)
+
+        return cv2.resize(image, (width, height))
+
+
+class Frame:
+    """
+    A captured frame and its derived representations, each one computed the
+    first time it is used and shared by everyone that uses it afterwards.
+
+    Parameters:
+        image {np.array} -- The BGR image as captured.
+        width {integer} -- The width of `bgr`. Defaults to -1, any negative
+            number keeps the captured width.
+        timestamp {number} -- When the frame was captured, seconds since
+            the epoch.
+        sequence {integer} -- Number of the frame since the feed was opened.
+        color_config {ColorConfig} -- The calibrated colors of
+            `color_classes`. Defaults to the shared configuration.
+    """
+
+    def __init__(
+        self, image, width=-1, timestamp=None, sequence=None, color_config=None
+    ):
+        self.image = image
+        self.width = width
+        self.timestamp = timestamp
+        self.sequence = sequence
+        self.color_config = color_config
+        self.gray_image = None
+        self.pyramid = []
+        self.row_classes = {}
+
+    @cached_property
+    def bgr(self):
+        """
+        The BGR image resized to the target width.
+        """
+
+        return resize_to_width(self.image, self.width)
+
+    def get_gray(self, dst=None):
+        """
+        Gets the grayscale version of `bgr`.
+
+        Arguments:
+            dst {np.array} -- Buffer the conversion is written to, if it is
+                the first one and the buffer has the right shape.
+
+        Returns:
+            np.array -- The grayscale image.
+        """
+
+        if self.gray_image is None:
+            self.gray_image = cv2.cvtColor(self.bgr, cv2.COLOR_BGR2GRAY, dst=dst)
+
+        return self.gray_image
+
+    @property
+    def gray(self):
+        """
+        The grayscale version of `bgr`.
+        """
+
+        return self.get_gray()
+
+    def get_pyramid_level(self, level):
+        """
+        Gets the grayscale image downsampled level times by half with
+        `cv2.pyrDown`, level 0 is `gray`.
+        """
+
+        if not self.pyramid:
+            self.pyramid.append(self.gray)
+        while len(self.pyramid) <= level:
+            self.pyramid.append(cv2.pyrDown(self.pyramid[-1]))
+
+        return self.pyramid[level]
+
+    @cached_property
+    def color_classes(self):
+        """
+        The colors of each pixel of `bgr`, see `classify_pixels`.
+        """
+
+        color_config = self.color_config or get_default_color_config()
+        return classify_pixels(color_config.get_lut(), self.bgr)
+
+    def get_color_classes(self, rows=None):
+        """
+        Gets the color classes of `bgr`, see `color_classes`, or only of some
+        of its rows. The classes of the rows are taken from `color_classes`
+        if it was already computed, otherwise only those rows are classified
+        and the result is kept for the next call with the same rows.
+
+        Arguments:
+            rows {tuple} -- The row indices. Defaults to all of them.
+
+        Returns:
+            np.array -- The colors of each pixel, one row per requested row.
+        """
+
+        if rows is None:
+            return self.color_classes
+        if "color_classes" in self.__dict__:
+            return self.color_classes[list(rows)]
+
+        rows = tuple(rows)
+        if rows not in self.row_classes:
+            color_config = self.color_config or get_default_color_config()
+            self.row_classes[rows] = classify_pixels(
+                color_config.get_lut(), self.bgr[list(rows)]
+            )
+
+        return self.row_classes[rows]
 
 
 class VideoFeed:
     """
     Allows reading frames from an arbitrary camera with built-in resize.
+    In threaded mode a background thread keeps grabbing frames into a small
+    ring buffer and reading returns the newest one, so the latency is bounded
+    by the processing time instead of the driver queue. The frames that are
+    never returned are counted as dropped.
 
     Parameters:
         camera_index {integer} -- The index of the camera from which the
-            frames will be read. Defaults to 0.
+            frames will be read, or the path of a video file. Defaults to 0.
         width {integer} -- The target width of the captured images.
             Defaults to -1. Any negative number will keep the original
             dimension.
+        threaded {boolean} -- Whether to capture in a background thread.
+            Defaults to False.
+        buffer_size {integer} -- Frames kept by the background thread.
+            Defaults to 2.
     """
 
-    def __init__(self, camera_index=0, width=-1):
+    def __init__(self, camera_index=0, width=-1, threaded=False, buffer_size=2):
         self.video_feed = cv2.VideoCapture(camera_index)
         self.width = width
 
+        if width > 0 and isinstance(camera_index, int):
+            self.set_capture_width(width)
+        self.threaded = threaded
+
+        self.frames_captured = 0
+        self.dropped_frames = 0
+
+        self.buffer = deque(maxlen=buffer_size)
+        self.condition = threading.Condition()
+        self.capturing = False
+        self.capture_thread = None
+
+        if threaded:
+            self.capturing = True
+            self.capture_thread = threading.Thread(
+                target=self.capture_loop, daemon=True
+            )
+            self.capture_thread.start()
+
+    def set_capture_width(self, width):
+        """
+        Asks the camera to capture at a width, with the height that keeps its
+        aspect ratio, so the frames don't need to be resized. Drivers snap
+        to the closest mode they support, so if the delivered mode is
+        narrower or has another aspect ratio the native mode is restored
+        and the frames are resized as usual.
+
+        Arguments:
+            width {integer} -- The target width.
+        """
+
+        native_width = self.video_feed.get(cv2.CAP_PROP_FRAME_WIDTH)
+        native_height = self.video_feed.get(cv2.CAP_PROP_FRAME_HEIGHT)
+        if native_width <= 0 or native_height <= 0 or native_width == width:
+            return
+
+        self.video_feed.set(cv2.CAP_PROP_FRAME_WIDTH, width)
+        self.video_feed.set(
+            cv2.CAP_PROP_FRAME_HEIGHT, round(native_height * width / native_width)
+        )
+
+        delivered_width = self.video_feed.get(cv2.CAP_PROP_FRAME_WIDTH)
+        delivered_height = self.video_feed.get(cv2.CAP_PROP_FRAME_HEIGHT)
+        same_aspect = delivered_height > 0 and math.isclose(
+            delivered_width / delivered_height,
+            native_width / native_height,
+            rel_tol=0.01,
+        )
+        if delivered_width < width or not same_aspect:
+            self.video_feed.set(cv2.CAP_PROP_FRAME_WIDTH, native_width)
+            self.video_feed.set(cv2.CAP_PROP_FRAME_HEIGHT, native_height)
+
     def __enter__(self):
         return self
 
     def __exit__(self, type, value, tb):
+        self.release()
+
+    def release(self):
+        """
+        Stops the capture thread, if any, and releases the camera.
+        """
+
+        with self.condition:
+            self.capturing = False
+            self.condition.notify_all()
+
+        if self.capture_thread is not None:
+            self.capture_thread.join()
+            self.capture_thread = None
+
         self.video_feed.release()
 
+    def capture_loop(self):
+        """
+        Grabs frames into the ring buffer until the feed is released or
+        a frame can't be read.
+        """
+
+        while self.capturing:
+            with metrics.timer("capture"):
+                success, image = self.video_feed.read()
+            timestamp = time.time()
+
+            with self.condition:
+                if not success:
+                    self.capturing = False
+                    self.condition.notify_all()
+                    break
+
+                # The oldest frame is overwritten without being read.
+                if len(self.buffer) == self.buffer.maxlen:
+                    self.dropped_frames += 1
+                    metrics.increment("dropped_frames")
+
+                self.buffer.append((image, timestamp, self.frames_captured))
+                self.frames_captured += 1
+                self.condition.notify_all()
+
+    def resize(self, image):
+        """
+        Resizes an image to the target width, maintaining the aspect ratio.
+        """
+
+        return resize_to_width(image, self.width)
+
+    def read_captured(self, timeout=None):
+        """
+        Reads a single frame as captured, without resizing it, see
+        `read_timestamped`.
+        """
+
+        if not self.threaded:
+            with metrics.timer("capture"):
+                success, image = self.video_feed.read()
+            timestamp = time.time()
+            if not success:
+                return False, None, None, None
+
+            sequence = self.frames_captured
+            self.frames_captured += 1
+            return True, image, timestamp, sequence
+
+        with self.condition:
+            self.condition.wait_for(lambda: self.buffer or not self.capturing, timeout)
+            if not self.buffer:
+                return False, None, None, None
+
+            image, timestamp, sequence = self.buffer.pop()
+
+            # Older frames are skipped.
+            self.dropped_frames += len(self.buffer)
+            metrics.increment("dropped_frames", len(self.buffer))
+            self.buffer.clear()
+
+        return True, image, timestamp, sequence
+
+    def read_frame(self, timeout=None):
+        """
+        Reads a single frame as a `Frame`, which resizes it and derives
+        other representations only when they are used.
+
+        Arguments:
+            timeout {number} -- See `read_timestamped`.
+
+        Returns:
+            Frame -- The frame, None if it couldn't be read.
+        """
+
+        success, image, timestamp, sequence = self.read_captured(timeout)
+        if not success:
+            return None
+
+        return Frame(image, self.width, timestamp, sequence)
+
+    def read_timestamped(self, timeout=None):
+        """
+        Reads a single frame from the video feed, the newest one in threaded
+        mode, waiting for it if it hasn't been captured yet.
+
+        Arguments:
+            timeout {number} -- Maximum seconds to wait for a frame in
+                threaded mode, None waits until the capture stops.
+
+        Returns:
+            Tuple -- Contains:
+                success: Whether the frame was read successfully.
+                image: The image if success is True, None otherwise.
+                timestamp: Time (seconds since the epoch) when the frame
+                    was captured, None if it wasn't.
+                sequence: Number of the frame since the feed was opened,
+                    None if it wasn't read.
+        """
+
+        success, image, timestamp, sequence = self.read_captured(timeout)
+        if not success:
+            return False, None, None, None
+
+        return True, self.resize(image), timestamp, sequence
+
     def read(self):
         """
         Reads a single frame from the video feed.
@@ -37,18 +378,308 @@ class VideoFeed:
 
         """
 
-        success, image = self.video_feed.read()
+        success, image, _, _ = self.read_timestamped()
+
+        return success, image
+
+
+class SequenceFeed:
+    """
+    Base of the feeds that read the frames of a finite sequence, one after
+    the other and as fast as they are requested. Subclasses implement
+    `__len__` and `get_frame`.
+
+    Parameters:
+        width {integer} -- The target width of the images. Defaults to -1.
+            Any negative number will keep the original dimension.
+    """
+
+    def __init__(self, width=-1):
+        self.width = width
+        self.frames_captured = 0
+        self.dropped_frames = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, tb):
+        self.release()
+
+    def release(self):
+        """
+        Releases the resources of the feed.
+        """
+
+    def get_frame(self, index):
+        """
+        Gets a frame of the sequence, None if it can't be read.
+        """
+
+        raise NotImplementedError
+
+    def get_timestamp(self, index):
+        """
+        Gets the capture time of a frame of the sequence, the time it is read
+        unless the subclass knows better.
+        """
+
+        return time.time()
+
+    def read_captured(self, timeout=None):
+        """
+        Reads the next frame of the sequence without resizing it, see
+        `VideoFeed.read_timestamped`.
+        """
+
+        sequence = self.frames_captured
+        if sequence >= len(self):
+            return False, None, None, None
+
+        with metrics.timer("capture"):
+            image = self.get_frame(sequence)
+        timestamp = self.get_timestamp(sequence)
+        if image is None:
+            return False, None, None, None
+
+        self.frames_captured += 1
+        return True, image, timestamp, sequence
+
+    def read_frame(self, timeout=None):
+        """
+        Reads the next frame of the sequence, see `VideoFeed.read_frame`.
+        """
+
+        success, image, timestamp, sequence = self.read_captured(timeout)
         if not success:
-            return False, None
+            return None
 
-        # Get the target width.
-        width = len(image[0]) if self.width < 0 else self.width
+        return Frame(image, self.width, timestamp, sequence)
 
-        # Get the target height maintaining aspect ratio.
-        conversion_ration = width / len(image[0])
-        height = int(len(image) * conversion_ration)
+    def read_timestamped(self, timeout=None):
+        """
+        Reads the next frame of the sequence, see `VideoFeed.read_timestamped`.
+        """
+
+        success, image, timestamp, sequence = self.read_captured(timeout)
+        if not success:
+            return False, None, None, None
+
+        return True, resize_to_width(image, self.width), timestamp, sequence
+
+    def read(self):
+        """
+        Reads the next frame of the sequence, see `VideoFeed.read`.
+        """
+
+        success, image, _, _ = self.read_timestamped()
+
+        return success, image
+
+
+class ImageSequenceFeed(SequenceFeed):
+    """
+    Reads the frames from image files, in alphabetical order.
+
+    Parameters:
+        pattern {string} -- A directory with the images or a glob pattern
+            that matches them.
+        width {integer} -- The target width of the images. Defaults to -1.
+    """
+
+    def __init__(self, pattern, width=-1):
+        super().__init__(width)
+
+        if os.path.isdir(pattern):
+            pattern = os.path.join(pattern, "*")
+        self.paths = sorted(glob.glob(pattern))
+
+    def __len__(self):
+        return len(self.paths)
+
+    def get_frame(self, index):
+        return cv2.imread(self.paths[index])
+
+
+class ArrayFeed(SequenceFeed):
+    """
+    Reads the frames from an array with one BGR frame per element, for
+    example a memory-mapped .npy file.
+
+    Parameters:
+        frames {np.array} -- The frames, shape (count, height, width, 3).
+        width {integer} -- The target width of the images. Defaults to -1.
+    """
+
+    def __init__(self, frames, width=-1):
+        super().__init__(width)
+        self.frames = frames
+
+    def __len__(self):
+        return len(self.frames)
+
+    def get_frame(self, index):
+        return self.frames[index]
+
+
+class SessionWriter:
+    """
+    Records frames and their capture timestamps into a session directory
+    that `RecordedFeed` can replay. The frames are stored raw, one after the
+    other, in SESSION_FRAMES_FILE so they can be memory-mapped, and their
+    shape, type and timestamps in SESSION_INDEX_FILE, written on release.
+
+    Parameters:
+        path {string} -- The session directory, created if needed.
+    """
+
+    def __init__(self, path):
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+        self.frames_file = open(os.path.join(path, SESSION_FRAMES_FILE), "wb")
+        self.shape = None
+        self.dtype = None
+        self.timestamps = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, tb):
+        self.release()
+
+    def write(self, image, timestamp=None):
+        """
+        Appends a frame to the session.
+
+        Arguments:
+            image {np.array} -- The frame, all of them must have the same
+                shape and type.
+            timestamp {number} -- When the frame was captured, seconds since
+                the epoch. Defaults to now.
+        """
+
+        if self.shape is None:
+            self.shape = image.shape
+            self.dtype = image.dtype
+        elif image.shape != self.shape or image.dtype != self.dtype:
+            raise ValueError("FAILURE: all the frames of a session must match")
+
+        self.frames_file.write(np.ascontiguousarray(image).data)
+        self.timestamps.append(time.time() if timestamp is None else timestamp)
+
+    def release(self):
+        """
+        Finishes the session writing its index.
+        """
+
+        if self.frames_file.closed:
+            return
+        self.frames_file.close()
+
+        index = {
+            "count": len(self.timestamps),
+            "shape": list(self.shape or ()),
+            "dtype": str(self.dtype or np.dtype(np.uint8)),
+            "timestamps": self.timestamps,
+        }
+        with open(os.path.join(self.path, SESSION_INDEX_FILE), "w") as index_file:
+            json.dump(index, index_file)
+
+
+class RecordedFeed(SequenceFeed):
+    """
+    Replays a session recorded with `SessionWriter`. The frames are
+    memory-mapped, so they are read without copies, and they carry their
+    recorded timestamps. By default frames are returned as fast as they are
+    requested; in real time mode reading waits so the frames are returned
+    at the recorded pace.
+
+    Parameters:
+        path {string} -- The session directory.
+        width {integer} -- The target width of the images. Defaults to -1.
+        realtime {boolean} -- Whether to replay at the recorded pace.
+            Defaults to False.
+    """
+
+    def __init__(self, path, width=-1, realtime=False):
+        super().__init__(width)
+
+        with open(os.path.join(path, SESSION_INDEX_FILE)) as index_file:
+            index = json.load(index_file)
+
+        self.timestamps = index["timestamps"]
+        self.realtime = realtime
+        self.replay_start = None
+
+        shape = (index["count"], *index["shape"])
+        if index["count"]:
+            self.frames = np.memmap(
+                os.path.join(path, SESSION_FRAMES_FILE),
+                dtype=index["dtype"],
+                mode="r",
+                shape=shape,
+            )
+        else:
+            self.frames = np.empty(shape, index["dtype"])
+
+    def __len__(self):
+        return len(self.frames)
+
+    def get_frame(self, index):
+        return self.frames[index]
+
+    def get_timestamp(self, index):
+        if self.realtime:
+            # Seconds into the session at which the frame was captured.
+            offset = self.timestamps[index] - self.timestamps[0]
+            now = time.monotonic()
+            if self.replay_start is None:
+                self.replay_start = now - offset
+            delay = self.replay_start + offset - now
+            if delay > 0:
+                time.sleep(delay)
+
+        return self.timestamps[index]
+
+
+def is_session(path):
+    """
+    Checks whether a path is a session directory written by `SessionWriter`.
+    """
+
+    return os.path.isfile(os.path.join(path, SESSION_INDEX_FILE))
+
+
+def open_feed(source=0, width=-1, threaded=False, realtime=False):
+    """
+    Opens the feed that corresponds to a source.
+
+    Arguments:
+        source {integer|string} -- A camera index, a recorded session, a
+            directory of images or a glob pattern that matches them, a .npy
+            file with a stack of frames or a video file.
+        width {integer} -- The target width of the images. Defaults to -1.
+        threaded {boolean} -- Whether cameras and video files are captured in
+            a background thread, see `VideoFeed`.
+        realtime {boolean} -- Whether recorded sessions are replayed at the
+            recorded pace, see `RecordedFeed`.
+
+    Returns:
+        VideoFeed|SequenceFeed -- The feed.
+    """
+
+    if isinstance(source, int) or source.isdigit():
+        return VideoFeed(int(source), width, threaded)
+
+    if is_session(source):
+        return RecordedFeed(source, width, realtime)
+
+    if os.path.isdir(source) or glob.has_magic(source):
+        return ImageSequenceFeed(source, width)
+
+    if source.endswith(".npy"):
+        return ArrayFeed(np.load(source, mmap_mode="r"), width)
 
-        return True, cv2.resize(image, (width, height))
+    return VideoFeed(source, width, threaded)
 
 
 def main():
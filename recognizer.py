@@ -6,14 +6,22 @@ import argparse
 import cv2
 import json
 import statistics
+import sys
+import threading
+import time
 
-from core_lib.video_feed import VideoFeed
-from core_lib.seeds import get_seeds
-from core_lib.segmentation import region_expander
+from core_lib.video_feed import open_feed
+from core_lib.segmentation import region_expansion_backends
 from core_lib.drawing import draw_region_characteristics
-from core_lib.drawing import draw_results_ui
-from core_lib.drawing import draw_training_space
-from core_lib.region_identifier import identify_region
+from core_lib.drawing import RateLimiter
+from core_lib.drawing import ResultsUI
+from core_lib.drawing import TrainingSpacePlot
+from core_lib.metrics import metrics
+from core_lib.multi_camera import MultiCameraRecognizer
+from core_lib.pipeline import Pipeline
+from core_lib.recognition import FrameRecognizer
+from core_lib.recognition import get_frame_record
+from core_lib.region_identifier import region_classifiers
 
 # object_names = {
 #     "1": "martillo",
@@ -35,52 +43,398 @@ def read_training_params():
 #         print("id = ", object_names[obj[0]], "\ttheta = ", obj[1], "\n")
 
 
+def render(frame, results_ui, training_space_plot):
+    """
+    Shows the input, the found regions and the detected figures of a frame.
+    """
+
+    # The result image can be a buffer reused by the next frame.
+    result_image = frame["result_image"].copy()
+    found_regions = frame["found_regions"]
+
+    with metrics.timer("plots"):
+        results_ui.show(frame["detected_figures"])
+        training_space_plot.update(found_regions)
+    # print_object_names (detected_figures)
+
+    with metrics.timer("drawing"):
+        for region in found_regions:
+            draw_region_characteristics(result_image, region)
+
+        cv2.imshow("Input", frame["frame"].bgr)
+        cv2.imshow("Output", result_image)
+
+
+def read_frame(feed):
+    """
+    Reads the next frame of a feed as a frame dictionary, None if there are
+    no more frames.
+    """
+
+    source = feed.read_frame()
+    if source is None:
+        return None
+
+    return {
+        "frame_id": source.sequence,
+        "timestamp": source.timestamp,
+        "frame": source,
+    }
+
+
+def run_headless(feed, recognizer, output):
+    """
+    Processes every frame of a feed as fast as possible, without any display,
+    and writes the record of each one as a JSON line.
+
+    Arguments:
+        feed {VideoFeed} -- The source of the frames.
+        recognizer {FrameRecognizer} -- Processes the frames.
+        output {file} -- Where the JSON lines are written.
+    """
+
+    frame_count = 0
+    start = time.perf_counter()
+
+    while True:
+        frame = read_frame(feed)
+        if frame is None:
+            break
+
+        timing = recognizer.process_timed(frame)
+        output.write(json.dumps(get_frame_record(frame, timing)) + "\n")
+        frame_count += 1
+        metrics.increment("frames")
+        metrics.report()
+
+    elapsed = time.perf_counter() - start
+    print(
+        "Processed {} frames in {:.2f}s ({:.1f} fps)".format(
+            frame_count, elapsed, frame_count / elapsed if elapsed else 0
+        ),
+        file=sys.stderr,
+    )
+
+
+def capture_frames(feed, pipeline, stop_event):
+    """
+    Submits the frames of a feed to a pipeline until the feed ends or the
+    event is set, then closes the pipeline.
+    """
+
+    while not stop_event.is_set():
+        frame = read_frame(feed)
+        if frame is None:
+            break
+        pipeline.submit(frame["frame_id"], frame)
+
+    pipeline.close()
+
+
 def main():
     """
     Performs the seeded region growing algorithm for image segmentation.
-    Reads images directlty from the webcam.
+    Reads images directlty from the webcam, or from files with --source.
     """
 
     parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "-s",
+        "--source",
+        default="0",
+        help="Camera index, recorded session, video file, directory or glob "
+        "of images, or .npy stack of frames",
+    )
+    parser.add_argument(
+        "--cameras",
+        nargs="+",
+        help="Process these sources (same forms as --source) at once on a pool "
+        "of worker processes and write the detections of all of them, tagged "
+        "with the camera, like --headless",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        help="Worker processes of --cameras, defaults to the number of cores",
+    )
+    parser.add_argument(
+        "--realtime",
+        action="store_true",
+        help="Replay recorded sessions at their recorded pace instead of "
+        "as fast as possible",
+    )
+    parser.add_argument(
+        "-w",
+        "--width",
+        type=int,
+        default=450,
+        help="The width the frames are resized to, negative keeps the original",
+    )
+    parser.add_argument(
+        "--headless",
+        action="store_true",
+        help="Process every frame without display and write the detections "
+        "as JSON lines",
+    )
+    parser.add_argument(
+        "-o",
+        "--output",
+        default="detections.jsonl",
+        help="The JSON lines file written in headless mode, - for stdout",
+    )
     parser.add_argument(
         "-i",
         "--intensity-threshold",
         default=30,
         help="The maximum distance for 2 pixels to be considered in the same region",
     )
+    parser.add_argument(
+        "-b",
+        "--backend",
+        default="scanline",
+        choices=sorted(region_expansion_backends.keys()),
+        help="The implementation used to grow the regions",
+    )
+    parser.add_argument(
+        "-c",
+        "--classifier",
+        default="box",
+        choices=sorted(region_classifiers.keys()),
+        help="How the regions are matched with the trained figures: the phi_1 "
+        "and phi_2 box or the full covariance of the trained features",
+    )
+    parser.add_argument(
+        "--max-region-area",
+        type=int,
+        help="Regions with more pixels stop growing and are not classified",
+    )
+    parser.add_argument(
+        "--max-region-width",
+        type=int,
+        help="Regions with a wider bounding box stop growing and are not classified",
+    )
+    parser.add_argument(
+        "--max-region-height",
+        type=int,
+        help="Regions with a taller bounding box stop growing and are not classified",
+    )
+    parser.add_argument(
+        "--max-visited",
+        type=int,
+        help="Regions that examine more pixels stop growing and are not classified",
+    )
+    parser.add_argument(
+        "--pyramid-levels",
+        type=int,
+        default=0,
+        help="Grow the regions on the frame downsampled this many times by half "
+        "and refine their border at full resolution, for high resolution cameras",
+    )
+    parser.add_argument(
+        "--tile-size",
+        type=int,
+        help="Grow the regions on tiles of this side in parallel, one thread "
+        "per core, only faster for regions that span many tiles. Like "
+        "--batch-statistics, the regions can differ from the default ones",
+    )
+    parser.add_argument(
+        "--batch-statistics",
+        action="store_true",
+        help="Grow the regions into one label image and compute the statistics "
+        "of all of them in one pass, for frames with many seeds. The seed is "
+        "counted once and a region can take the pixels that a previous region "
+        "rejected, so the moments, and sometimes the figures, differ from the "
+        "default segmentation",
+    )
+    parser.add_argument(
+        "-t",
+        "--track-seeds",
+        action="store_true",
+        help="Use the centroids of the previous frame as seeds when possible",
+    )
+    parser.add_argument(
+        "-r",
+        "--roi-margin",
+        type=int,
+        help="Grow the regions only around the regions of the previous frame, "
+        "with this margin in pixels",
+    )
+    parser.add_argument(
+        "--threaded-capture",
+        action="store_true",
+        help="Capture frames in a background thread and always process the newest",
+    )
+    parser.add_argument(
+        "-p",
+        "--pipelined",
+        action="store_true",
+        help="Run capture, seeds, segmentation, classification and rendering "
+        "on separate threads",
+    )
+    parser.add_argument(
+        "--queue-size",
+        type=int,
+        default=1,
+        help="Frames waiting before each pipeline stage, "
+        "new frames replace the oldest waiting one",
+    )
+    parser.add_argument(
+        "--display-fps",
+        type=float,
+        default=30,
+        help="Maximum rate the windows are updated at, independent of the "
+        "processing rate, 0 updates them on every frame",
+    )
+    parser.add_argument(
+        "--plot-interval",
+        type=float,
+        default=0.2,
+        help="Minimum seconds between updates of the training space plot",
+    )
+    parser.add_argument(
+        "--metrics-log",
+        help="Periodically append the stage latencies and counters to this "
+        "file, CSV if it ends with .csv and JSON lines otherwise",
+    )
+    parser.add_argument(
+        "--metrics-prometheus",
+        help="Periodically rewrite this file with the metrics in Prometheus "
+        "text format",
+    )
+    parser.add_argument(
+        "--metrics-interval",
+        type=float,
+        default=10,
+        help="Seconds between metrics reports",
+    )
     args = parser.parse_args()
 
+    if args.metrics_log or args.metrics_prometheus:
+        metrics.configure(
+            report_interval=args.metrics_interval,
+            log_path=args.metrics_log,
+            prometheus_path=args.metrics_prometheus,
+        )
+
+    budget = {
+        "max_area": args.max_region_area,
+        "max_width": args.max_region_width,
+        "max_height": args.max_region_height,
+        "max_visited": args.max_visited,
+    }
+    # Without limits the region growing skips the budget checks altogether.
+    if all(limit is None for limit in budget.values()):
+        budget = None
+
+    training_params = read_training_params()
+    recognizer_options = {
+        "intensity_threshold": int(args.intensity_threshold),
+        "backend": args.backend,
+        "budget": budget,
+        "track_seeds": args.track_seeds,
+        "roi_margin": args.roi_margin,
+        "classifier": args.classifier,
+        "pyramid_levels": args.pyramid_levels,
+        "tile_size": args.tile_size,
+        "batch_statistics": args.batch_statistics,
+    }
+
+    if args.cameras:
+        multi_camera_recognizer = MultiCameraRecognizer(
+            args.cameras,
+            training_params,
+            recognizer_options,
+            args.width,
+            args.workers,
+            args.threaded_capture,
+            args.realtime,
+        )
+        if args.output == "-":
+            multi_camera_recognizer.run(sys.stdout)
+        else:
+            with open(args.output, "w") as output:
+                multi_camera_recognizer.run(output)
+        metrics.report(force=True)
+        return
+
+    recognizer = FrameRecognizer(
+        training_params,
+        # Frames processed concurrently can't share buffers.
+        reuse_buffers=args.headless or not args.pipelined,
+        # Nobody displays the segmentation in headless mode.
+        label_output=args.headless,
+        **recognizer_options,
+    )
+
+    if args.headless:
+        with open_feed(args.source, args.width, realtime=args.realtime) as feed:
+            if args.output == "-":
+                run_headless(feed, recognizer, sys.stdout)
+            else:
+                with open(args.output, "w") as output:
+                    run_headless(feed, recognizer, output)
+        metrics.report(force=True)
+        return
+
     # Create 2 named windows for the input and output image.
     cv2.namedWindow("Input")
     cv2.namedWindow("Output")
+    results_ui = ResultsUI()
+    training_space_plot = TrainingSpacePlot(training_params, args.plot_interval)
+    display_rate = RateLimiter(1 / args.display_fps if args.display_fps > 0 else 0)
 
-    training_params = read_training_params()
+    with open_feed(
+        args.source, args.width, args.threaded_capture, args.realtime
+    ) as feed:
+        if args.pipelined:
+            pipeline = Pipeline(
+                [recognizer.find_seeds, recognizer.segment, recognizer.classify],
+                args.queue_size,
+            )
+            stop_event = threading.Event()
+            capture_thread = threading.Thread(
+                target=capture_frames, args=(feed, pipeline, stop_event), daemon=True
+            )
+            capture_thread.start()
+            pipeline_closed = False
 
-    with VideoFeed(camera_index=0, width=450) as feed:
         while True:
-            _, image = feed.read()
-            gray_image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-            seeds = get_seeds(image)
+            if args.pipelined:
+                result = pipeline.get()
+                if result is None:
+                    pipeline_closed = True
+                    break
+                _, frame = result
+            else:
+                frame = read_frame(feed)
+                if frame is None:
+                    break
+                recognizer.process(frame)
 
-            result_image, found_regions = region_expander(
-                gray_image, seeds, int(args.intensity_threshold)
-            )
-            detected_figures = identify_region(training_params, found_regions)
-            draw_results_ui(detected_figures)
-            draw_training_space(training_params, found_regions)
-            # print_object_names (detected_figures)
+            metrics.increment("frames")
+            metrics.report()
 
-            for region in found_regions:
-                draw_region_characteristics(result_image, region)
+            # The frames processed in between are not shown.
+            if not display_rate.ready():
+                continue
 
-            cv2.imshow("Input", image)
-            cv2.imshow("Output", result_image)
+            render(frame, results_ui, training_space_plot)
+            # From capture until the results are shown.
+            metrics.record("latency", time.time() - frame["timestamp"])
 
             # End the loop when "q" is pressed.
             if cv2.waitKey(1) & 0xFF == ord("q"):
                 break
 
+        if args.pipelined:
+            stop_event.set()
+            # The stages wait for the results to be read to finish.
+            if not pipeline_closed:
+                pipeline.drain()
+            capture_thread.join()
+
     cv2.destroyAllWindows()
+    metrics.report(force=True)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,79 @@
+"""
+This program records the raw frames of a camera into a session directory.
+The session can be replayed later with --source by the recognizer, the
+color calibration and the training, so all of them run on identical inputs.
+"""
+import argparse
+import cv2
+
+from core_lib.video_feed import SessionWriter
+from core_lib.video_feed import VideoFeed
+
+
+def main():
+    """
+    Records frames from the webcam until "q" is pressed, the requested
+    number of frames is reached or the camera stops delivering frames.
+    """
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "-o",
+        "--output",
+        default="session",
+        help="The session directory, created if needed",
+    )
+    parser.add_argument(
+        "-c",
+        "--camera",
+        type=int,
+        default=0,
+        help="The index of the camera to record",
+    )
+    parser.add_argument(
+        "-w",
+        "--width",
+        type=int,
+        default=-1,
+        help="The width the frames are resized to, negative keeps the original",
+    )
+    parser.add_argument(
+        "-n",
+        "--frames",
+        type=int,
+        help="Stop after recording this many frames",
+    )
+    args = parser.parse_args()
+
+    cv2.namedWindow("Recording")
+
+    with VideoFeed(args.camera, args.width) as feed, SessionWriter(
+        args.output
+    ) as writer:
+        while args.frames is None or len(writer.timestamps) < args.frames:
+            success, image, timestamp, _ = feed.read_timestamped()
+            if not success:
+                # Retrying would spin forever on a missing or failed camera.
+                if not writer.timestamps:
+                    raise ValueError(
+                        "FAILURE: no frame could be read from camera {}".format(
+                            args.camera
+                        )
+                    )
+                print("The camera stopped delivering frames")
+                break
+
+            writer.write(image, timestamp)
+            cv2.imshow("Recording", image)
+
+            # End the loop when "q" is pressed.
+            if cv2.waitKey(1) & 0xFF == ord("q"):
+                break
+
+        print("Recorded {} frames".format(len(writer.timestamps)))
+
+    cv2.destroyAllWindows()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,56 @@
+import cv2
+import numpy as np
+
+from core_lib.segmentation import label_regions
+from core_lib.segmentation import label_regions_tiled
+from core_lib.segmentation import region_expander
+
+
+def get_test_image(height, width):
+    rng = np.random.default_rng(0)
+    noise = rng.integers(0, 256, (height, width)).astype(np.uint8)
+    return cv2.GaussianBlur(noise, (9, 9), 0)
+
+
+def test_tiled_labels_with_one_pixel_remainder_tiles():
+    # height % tile_size == width % tile_size == 1 leaves 1x1 corner tiles.
+    image = get_test_image(41, 61)
+    seeds = [(0, 0), (60, 40), (30, 20), (60, 0), (0, 40)]
+    expected_labels, expected_regions = label_regions(image, seeds, 10)
+
+    for tile_size in (4, 8, 1):
+        labels, found_regions = label_regions_tiled(
+            image, seeds, 10, tile_size=tile_size
+        )
+
+        assert np.array_equal(labels, expected_labels)
+        assert [region["label"] for region in found_regions] == [
+            region["label"] for region in expected_regions
+        ]
+
+
+def test_roi_with_visited_budget_matches_whole_image():
+    rng = np.random.default_rng(0)
+
+    for _ in range(300):
+        height, width = rng.integers(40, 90, 2)
+        image = get_test_image(height, width)
+        seeds = [
+            (int(rng.integers(10, width - 10)), int(rng.integers(10, height - 10)))
+            for _ in range(2)
+        ]
+        xs, ys = zip(*seeds)
+        roi = (
+            max(min(xs) - int(rng.integers(1, 30)), 0),
+            max(min(ys) - int(rng.integers(1, 30)), 0),
+            min(max(xs) + int(rng.integers(1, 30)), width),
+            min(max(ys) + int(rng.integers(1, 30)), height),
+        )
+        budget = {"max_visited": int(rng.integers(50, 3000))}
+
+        _, expected_regions = region_expander(image, seeds, 12, "scanline", budget)
+        _, found_regions = region_expander(
+            image, seeds, 12, "scanline", budget, roi
+        )
+
+        assert found_regions == expected_regions
@@ -7,10 +7,11 @@ import json
 import statistics
 import numpy as np
 
-from core_lib.video_feed import VideoFeed
+from core_lib.video_feed import open_feed
 from core_lib.seeds import get_seeds
 from core_lib.segmentation import region_expander
 from core_lib.drawing import draw_region_characteristics
+from core_lib.region_identifier import get_gaussian_params
 
 seed = (0,0)
 points = []
@@ -36,12 +37,19 @@ def mouse_callback(event, x_coordinate, y_coordinate, _flags, _params):
         print(found_regions)
         points.append(
             {
-                "phi_1": found_regions[0]["phi_1"],
-                "phi_2": found_regions[0]["phi_2"]
+                key: value
+                for key, value in found_regions[0].items()
+                if key.startswith("phi_")
             }
         )
 
-def calculate_parameters():
+def calculate_parameters(features):
+    """
+    Gets the mean and standard deviation of phi_1 and phi_2 over the samples
+    of an object, and the distribution of the given features with its
+    inverse covariance precomputed, see `get_gaussian_params`.
+    """
+
     phi_1_acum = []
     phi_2_acum = []
 
@@ -55,7 +63,9 @@ def calculate_parameters():
         "sigma_phi_1": statistics.stdev(phi_1_acum),
         "sigma_phi_2": statistics.stdev(phi_2_acum),
         "mean_phi_1": statistics.mean(phi_1_acum),
-        "mean_phi_2": statistics.mean(phi_2_acum)
+        "mean_phi_2": statistics.mean(phi_2_acum),
+        "features": features,
+        **get_gaussian_params(points, features),
     }
 
 def main():
@@ -85,6 +95,20 @@ def main():
         default=10,
         help="The number of samples per object that will be taken",
     )
+    parser.add_argument(
+        "--source",
+        default="0",
+        help="Camera index, recorded session, video file or images to train on",
+    )
+    parser.add_argument(
+        "-f",
+        "--features",
+        type=int,
+        default=2,
+        choices=range(2, 8),
+        help="The number of Hu invariants (phi_1, phi_2, ...) of the full "
+        "covariance used by the mahalanobis classifier",
+    )
     args = parser.parse_args()
 
     # Create 2 named windows for the input and output image.
@@ -95,20 +119,50 @@ def main():
     regions = []
     intensity_threshold = int(args.intensity_threshold)
 
+    # The first point is dropped, see `calculate_parameters`, and the
+    # covariance needs more samples than features.
+    min_points = args.features + 2
+    if int(args.samples) + 1 < min_points:
+        raise ValueError("FAILURE: need more samples than features per object")
+    features = ["phi_{}".format(index + 1) for index in range(args.features)]
+
     for _ in range(int(args.objects)):
         object_id = input("Enter object id: ")
-        with VideoFeed(camera_index=0, width=450) as feed:
-            while True:
-                _, image = feed.read()
-                color_image = image
-                
-                cv2.imshow("Input", image)
-
-                # End the loop when "q" is pressed.
-                if cv2.waitKey(1) & 0xFF == ord("q") or len(points) > int(args.samples):
-                    break
-
-        calculated_params = calculate_parameters()
+        calculated_params = None
+        while calculated_params is None:
+            with open_feed(args.source, width=450) as feed:
+                while True:
+                    # Keep showing the last frame when a recording ends.
+                    success, image = feed.read()
+                    if success:
+                        color_image = image
+                    elif isinstance(color_image, int):
+                        # Nothing to show or sample, waiting would spin forever.
+                        raise ValueError(
+                            "FAILURE: no frame could be read from " + str(args.source)
+                        )
+
+                    cv2.imshow("Input", color_image)
+
+                    # End the loop when "q" is pressed, once there are enough
+                    # samples.
+                    if len(points) > int(args.samples):
+                        break
+                    if cv2.waitKey(1) & 0xFF == ord("q"):
+                        if len(points) >= min_points:
+                            break
+                        print(
+                            "Take at least {} samples of {} with {} features".format(
+                                min_points - len(points), object_id, args.features
+                            )
+                        )
+
+            try:
+                calculated_params = calculate_parameters(features)
+            except ValueError as error:
+                print(error)
+                print("Sample {} again, with different positions".format(object_id))
+                points = []
 
         region = {
             "object_id": object_id,
@@ -116,7 +170,12 @@ def main():
             "sigma_phi_1": calculated_params["sigma_phi_1"],
             "sigma_phi_2": calculated_params["sigma_phi_2"],
             "mean_phi_1": calculated_params["mean_phi_1"],
-            "mean_phi_2": calculated_params["mean_phi_2"]
+            "mean_phi_2": calculated_params["mean_phi_2"],
+            "features": calculated_params["features"],
+            "mean": calculated_params["mean"],
+            "covariance": calculated_params["covariance"],
+            "inverse_covariance": calculated_params["inverse_covariance"],
+            "log_determinant": calculated_params["log_determinant"],
         }
 
         regions.append(region)